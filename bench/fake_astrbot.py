@@ -0,0 +1,289 @@
+"""基准测试用的 AstrBot/NapCat 替身
+
+只实现插件用到的那部分接口：过滤器装饰器、Star 的 KV 方法、消息组件、
+事件对象和 NapCat 的 call_action。install() 把替身模块注册到 sys.modules，
+load_plugin() 以包的形式导入插件的 main.py。
+"""
+
+import sys
+import json
+import types
+import asyncio
+import sqlite3
+import contextvars
+import logging
+import tempfile
+import importlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "ccb_plugin"
+# 当前正在执行的指令名，KV/NapCat 调用按它归类；KV 缓存的写回任务不继承它，记在“写回”名下
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar("current_command", default="写回")
+
+
+class _Passthrough:
+    """filter.xxx(...) 装饰器：原样返回被装饰的函数"""
+
+    def __getattr__(self, name):
+        def factory(*args, **kwargs):
+            return lambda fn: fn
+        return factory
+
+
+class EventMessageType:
+    GROUP_MESSAGE = "group_message"
+    ALL = "all"
+
+
+class PlatformAdapterType:
+    AIOCQHTTP = "aiocqhttp"
+
+
+class Attrs(dict):
+    """既能按键也能按属性读取的字典，对应 aiocqhttp 的 Event 与 AstrBotConfig"""
+
+    def __getattr__(self, name):
+        return self.get(name)
+
+
+class Star:
+    def __init__(self, context=None) -> None:
+        self.context = context
+        self._kv = context.kv if context is not None else FakeKV()
+
+    async def get_kv_data(self, key, default):
+        return await self._kv.get(key, default)
+
+    async def put_kv_data(self, key, value):
+        await self._kv.put(key, value)
+
+    async def delete_kv_data(self, key):
+        await self._kv.delete(key)
+
+
+class StarTools:
+    data_root: Path | None = None
+
+    @classmethod
+    def get_data_dir(cls, name: str) -> Path:
+        if cls.data_root is None:
+            cls.data_root = Path(tempfile.mkdtemp(prefix="ccb_bench_"))
+        path = cls.data_root / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+class FakeKV:
+    """内存 KV，统计调用次数（总数及按指令归类），可选每次调用的延迟（模拟数据库往返）"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.data: dict = {}
+        self.latency = latency
+        self.gets = self.puts = self.deletes = 0
+        self.by_command: dict[str, dict[str, int]] = {}
+
+    @property
+    def calls(self) -> int:
+        return self.gets + self.puts + self.deletes
+
+    async def _wait(self, op: str) -> None:
+        counts = self.by_command.setdefault(current_command.get(), {"get": 0, "put": 0, "delete": 0})
+        counts[op] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _load(self, key, default):
+        return self.data.get(key, default)
+
+    def _store(self, key, value) -> None:
+        self.data[key] = value
+
+    def _remove(self, key) -> None:
+        self.data.pop(key, None)
+
+    async def get(self, key, default):
+        self.gets += 1
+        await self._wait("get")
+        return self._load(key, default)
+
+    async def put(self, key, value):
+        self.puts += 1
+        await self._wait("put")
+        self._store(key, value)
+
+    async def delete(self, key):
+        self.deletes += 1
+        await self._wait("delete")
+        self._remove(key)
+
+
+class SqliteKV(FakeKV):
+    """与 AstrBot 默认存储相近的 SQLite KV：值以 JSON 存在一张表里"""
+
+    def __init__(self, path: str | Path, latency: float = 0.0) -> None:
+        super().__init__(latency)
+        self.db = sqlite3.connect(str(path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _load(self, key, default):
+        row = self.db.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _store(self, key, value) -> None:
+        self.db.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        self.db.commit()
+
+    def _remove(self, key) -> None:
+        self.db.execute("DELETE FROM kv WHERE key = ?", (key,))
+        self.db.commit()
+
+
+class FakeContext:
+    def __init__(self, kv: FakeKV | None = None) -> None:
+        self.kv = kv or FakeKV()
+
+
+class FakeNapCat:
+    """NapCat 的 call_action：记录调用，send_group_msg 返回递增的 message_id"""
+
+    def __init__(self, latency: float = 0.0, members: dict | None = None) -> None:
+        self.latency = latency
+        self.calls: list[tuple[str, dict]] = []
+        self.sent: list[tuple[dict, dict]] = []  # send_group_msg 的 (参数, 返回值)
+        self.by_command: dict[str, int] = {}
+        self.next_message_id = 1000
+        self.members = members or {}  # gid -> {uid: role}
+
+    async def call_action(self, action: str, **params):
+        self.calls.append((action, params))
+        command = current_command.get()
+        self.by_command[command] = self.by_command.get(command, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if action == "send_group_msg":
+            self.next_message_id += 1
+            resp = {"message_id": self.next_message_id}
+            self.sent.append((params, resp))
+            return resp
+        if action == "get_group_member_list":
+            roles = self.members.get(str(params.get("group_id")), {})
+            return [{"user_id": uid, "role": role} for uid, role in roles.items()]
+        if action == "get_group_member_info":
+            roles = self.members.get(str(params.get("group_id")), {})
+            return {"role": roles.get(str(params.get("user_id")), "member")}
+        return {}
+
+    def count(self, action: str) -> int:
+        return sum(1 for a, _ in self.calls if a == action)
+
+
+class FakeEvent:
+    """AstrMessageEvent 替身"""
+
+    _next_id = 1
+
+    def __init__(self, bot: FakeNapCat, group_id, sender_id, self_id="10000",
+                 post_type="message", notice_type=None, message_id=None, **raw) -> None:
+        if message_id is None:
+            message_id = FakeEvent._next_id
+            FakeEvent._next_id += 1
+        self.bot = Attrs(api=bot)
+        self._group_id = str(group_id) if group_id is not None else None
+        self._sender_id = str(sender_id)
+        self._self_id = str(self_id)
+        raw_message = Attrs(post_type=post_type, notice_type=notice_type, message_id=message_id,
+                            group_id=self._group_id, user_id=self._sender_id, **raw)
+        self.message_obj = Attrs(message_id=message_id, raw_message=raw_message)
+        self.call_llm = False
+
+    def get_group_id(self):
+        return self._group_id
+
+    def get_sender_id(self):
+        return self._sender_id
+
+    def get_self_id(self):
+        return self._self_id
+
+    def get_sender_name(self):
+        return f"user{self._sender_id}"
+
+    def plain_result(self, text):
+        return ("plain", text)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+class _Component:
+    def __init__(self, *args, **kwargs) -> None:
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.args!r}, {self.kwargs!r})"
+
+
+class Image(_Component):
+    @classmethod
+    def fromFileSystem(cls, path):
+        return cls(file=path)
+
+    @classmethod
+    def fromURL(cls, url):
+        return cls(url=url)
+
+
+def install() -> None:
+    """把替身模块注册到 sys.modules（重复调用无副作用）"""
+    if "astrbot" in sys.modules:
+        return
+    modules = {
+        name: types.ModuleType(name)
+        for name in (
+            "astrbot", "astrbot.api", "astrbot.api.event", "astrbot.api.star",
+            "astrbot.api.message_components", "astrbot.core", "astrbot.core.star",
+            "astrbot.core.star.filter", "astrbot.core.star.filter.platform_adapter_type",
+        )
+    }
+    passthrough = _Passthrough()
+    passthrough.EventMessageType = EventMessageType
+    modules["astrbot.api.event"].filter = passthrough
+    modules["astrbot.api.event"].AstrMessageEvent = FakeEvent
+    modules["astrbot.api.star"].Context = FakeContext
+    modules["astrbot.api.star"].Star = Star
+    modules["astrbot.api.star"].StarTools = StarTools
+    modules["astrbot.api.star"].register = lambda *a, **k: (lambda cls: cls)
+    modules["astrbot.api"].AstrBotConfig = Attrs
+    modules["astrbot.api"].logger = logging.getLogger("ccb_bench")
+    comp = modules["astrbot.api.message_components"]
+    for name in ("Plain", "At", "Reply", "Node", "Nodes"):
+        setattr(comp, name, type(name, (_Component,), {}))
+    comp.Image = Image
+    modules["astrbot.api"].message_components = comp
+    modules["astrbot.core.star.filter.platform_adapter_type"].PlatformAdapterType = PlatformAdapterType
+    sys.modules.update(modules)
+
+
+def load_plugin():
+    """以包的形式导入插件的 main 模块"""
+    install()
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.main")
+
+
+def make_plugin(config: dict | None = None, kv: FakeKV | None = None):
+    """构造插件实例（不调用 initialize，不访问网络）"""
+    main = load_plugin()
+    context = FakeContext(kv)
+    return main.CCB_Plugin(context, Attrs(config or {})), context.kv
+
+
+async def drain(gen) -> list:
+    """跑完一个处理器（异步生成器），返回它产出的结果"""
+    return [item async for item in gen]
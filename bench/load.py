@@ -0,0 +1,318 @@
+"""多群抽卡风暴压测
+
+用替身 AstrBot 上下文、带延迟的 KV 和记录调用的 NapCat 驱动插件的处理器：
+抽卡、搜索、我的后宫、交换（发起 + 贴表情确认）以及无关的贴表情。
+按指令报告吞吐、p50/p99 延迟和每次指令的存储/NapCat 调用数；写回缓存批量写回的存储调用
+不计入任何指令，单独报告。
+
+    python bench/load.py --groups 20 --users 50 --draws 5 --kv-latency 2
+    python bench/load.py --out new.json --compare old.json
+
+--out 写出 JSON 结果；--compare 与之前的结果对比，任一指令 p99 变慢超过
+--tolerance（默认 20%）或每次指令的存储调用数增加超过 5% 时以非零状态退出，便于在提交之间比较。
+随机种子固定，同样的参数每次产生同样的负载。
+"""
+
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from fake_astrbot import (  # noqa: E402
+    FakeEvent,
+    FakeKV,
+    FakeNapCat,
+    SqliteKV,
+    StarTools,
+    current_command,
+    drain,
+    make_plugin,
+)
+
+BOT_ID = "10000"
+NOISE_MS = 0.5
+
+
+class ErrorCounter(logging.Handler):
+    """统计插件打出的 warning/error 日志，不逐条打印"""
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.count = 0
+        self.first = None
+
+    def emit(self, record) -> None:
+        self.count += 1
+        if self.first is None:
+            self.first = record.getMessage()
+
+
+class Recorder:
+    """每个指令的延迟样本"""
+
+    def __init__(self, busy_text: str | None = None) -> None:
+        self.samples: dict[str, list[float]] = {}
+        self.wall: dict[str, float] = {}
+        # 排队已满被丢弃的指令只回复忙碌提示，单独计数，不计入延迟分位数
+        self.busy_text = busy_text
+        self.shed: dict[str, int] = {}
+
+    async def run(self, command: str, gen) -> list:
+        token = current_command.set(command)
+        start = time.perf_counter()
+        results = None
+        try:
+            results = await drain(gen)
+            return results
+        finally:
+            elapsed = time.perf_counter() - start
+            current_command.reset(token)
+            if results is not None and self.busy_text is not None and results == [("plain", self.busy_text)]:
+                self.shed[command] = self.shed.get(command, 0) + 1
+            else:
+                self.samples.setdefault(command, []).append(elapsed)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+async def phase(rec: Recorder, name: str, jobs, concurrency: int) -> None:
+    """以给定并发跑完一组指令，记录该阶段的墙钟时间"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(job):
+        async with semaphore:
+            await job()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(job) for job in jobs))
+    rec.wall[name] = rec.wall.get(name, 0.0) + time.perf_counter() - start
+
+
+async def settle(plugin, timeout: float = 10.0) -> None:
+    """等待出站队列发完"""
+    deadline = time.monotonic() + timeout
+    while plugin.outbound.stats()["depth"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    StarTools.data_root = None
+    data_root = StarTools.get_data_dir("bench")
+    latency = args.kv_latency / 1000
+    kv = SqliteKV(data_root / "kv.sqlite3", latency) if args.kv == "sqlite" else FakeKV(latency)
+    config = {
+        "super_admins": [],
+        "draw_hourly_limit": 10**6,
+        "harem_max_size": args.harem,
+        "image_cache_size_mb": 0,
+        "group_concurrency": args.group_concurrency,
+    }
+    plugin, kv = make_plugin(config, kv)
+    # 压测的是处理器本身，不让按群限速拖慢出站队列
+    plugin.outbound.rate = plugin.outbound.burst = plugin.outbound.max_queue = 10**9
+    errors = ErrorCounter()
+    plugin_logger = logging.getLogger("ccb_bench")
+    plugin_logger.addHandler(errors)
+    plugin_logger.propagate = False
+    bot = FakeNapCat(latency=args.napcat_latency / 1000)
+    groups = [str(700000 + g) for g in range(args.groups)]
+    users = {gid: [str(100000 + g * 1000 + u) for u in range(args.users)] for g, gid in enumerate(groups)}
+    for gid in groups:
+        bot.members[gid] = {uid: "member" for uid in users[gid]}
+    # 风暴期间另有一个只是正常聊天抽卡的群，看它受多大影响
+    quiet_gid = "799999"
+    quiet_users = [str(990000 + u) for u in range(5)]
+
+    start = time.perf_counter()
+    await plugin.char_manager.load_characters_async()
+    while not plugin.char_manager.search_ready:
+        await asyncio.sleep(0.01)
+    pool_load_ms = (time.perf_counter() - start) * 1000
+    names = [plugin.char_manager.characters[i].get("name") for i in range(min(2000, len(plugin.char_manager.characters)))]
+
+    rec = Recorder(sys.modules[type(plugin).__module__].DRAW_BUSY_TEXT)
+
+    def event(gid, uid, **kw):
+        return FakeEvent(bot, gid, uid, self_id=BOT_ID, **kw)
+
+    # 抽卡风暴：所有群的所有用户同时抽
+    draws = [
+        (lambda gid=gid, uid=uid: rec.run("抽卡", plugin.handle_draw(event(gid, uid))))
+        for _ in range(args.draws) for gid in groups for uid in users[gid]
+    ]
+    random.shuffle(draws)
+
+    async def quiet_group():
+        for i in range(args.draws * len(quiet_users)):
+            await rec.run("抽卡(安静群)", plugin.handle_draw(event(quiet_gid, quiet_users[i % len(quiet_users)])))
+            await asyncio.sleep(0.002)
+
+    await asyncio.gather(phase(rec, "抽卡", draws, args.concurrency), quiet_group())
+    await settle(plugin)
+
+    searches = [
+        (lambda gid=gid, uid=uid, kw=random.choice(names)[:2]: rec.run("搜索", plugin.handle_search(event(gid, uid), kw)))
+        for gid in groups for uid in users[gid][: max(1, args.users // 5)]
+    ]
+    await phase(rec, "搜索", searches, args.concurrency)
+
+    harems = [
+        (lambda gid=gid, uid=uid: rec.run("我的后宫", plugin.handle_harem(event(gid, uid))))
+        for gid in groups for uid in users[gid]
+    ]
+    await phase(rec, "我的后宫", harems, args.concurrency)
+
+    # 交换：每群两两配对发起，等提示发出后由对方贴表情确认
+    exchanges = []
+    for gid in groups:
+        group = await plugin.ownership.group(gid)
+        owners = [uid for uid in users[gid] if group.harems.get(uid)]
+        for a, b in zip(owners[0::2], owners[1::2]):
+            mine, theirs = next(iter(group.harems[a])), next(iter(group.harems[b]))
+            exchanges.append(
+                lambda gid=gid, a=a, mine=mine, theirs=theirs: rec.run("交换", plugin.handle_exchange(event(gid, a), mine, theirs))
+            )
+    sent_before = len(bot.sent)
+    await phase(rec, "交换", exchanges, args.concurrency)
+    await settle(plugin)
+    accepts = []
+    for params, resp in bot.sent[sent_before:]:
+        ats = [seg["data"]["qq"] for seg in params["message"] if seg.get("type") == "at"]
+        if len(ats) == 2:
+            accepts.append(lambda gid=str(params["group_id"]), to_uid=ats[1], mid=resp["message_id"]: rec.run(
+                "process_swap",
+                plugin.handle_group_notice(event(gid, to_uid, post_type="notice", notice_type="group_msg_emoji_like", message_id=mid)),
+            ))
+    await phase(rec, "process_swap", accepts, args.concurrency)
+
+    # 群友随手贴的表情：绝大多数不对应任何待处理消息
+    noise = [
+        (lambda gid=gid, uid=random.choice(users[gid]): rec.run(
+            "贴表情",
+            plugin.handle_group_notice(event(gid, uid, post_type="notice", notice_type="group_msg_emoji_like", message_id=random.randrange(10**9))),
+        ))
+        for gid in groups for _ in range(args.users)
+    ]
+    await phase(rec, "贴表情", noise, args.concurrency)
+
+    await plugin.kv.flush()
+    await plugin.outbound.close()
+    await plugin.pending.close()
+    await plugin.char_manager.close()
+    plugin.membership.close()
+
+    commands = {}
+    for name, samples in rec.samples.items():
+        ops = kv.by_command.get(name, {"get": 0, "put": 0, "delete": 0})
+        n = len(samples)
+        commands[name] = {
+            "count": n,
+            "throughput": round(n / rec.wall[name], 1) if rec.wall.get(name) else None,
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+            "max_ms": round(max(samples) * 1000, 3),
+            "kv_get": round(ops["get"] / n, 3),
+            "kv_put": round(ops["put"] / n, 3),
+            "kv_delete": round(ops["delete"] / n, 3),
+            "napcat": round(bot.by_command.get(name, 0) / n, 3),
+            "shed": rec.shed.get(name, 0),
+        }
+    flush = kv.by_command.get("写回", {"get": 0, "put": 0, "delete": 0})
+    return {
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "tolerance")},
+        "python": platform.python_version(),
+        "pool_load_ms": round(pool_load_ms, 1),
+        "commands": commands,
+        "flush": flush,
+        "outbound": plugin.outbound.stats(),
+        "gate": plugin.gate.stats(),
+        "errors": errors.count,
+        "first_error": errors.first,
+    }
+
+
+def report(result: dict) -> None:
+    print(f"pool load {result['pool_load_ms']} ms, python {result['python']}, params {result['params']}")
+    header = f"{'指令':<12}{'次数':>7}{'吞吐/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'get':>7}{'put':>7}{'del':>7}{'napcat':>8}"
+    print(header)
+    for name, c in result["commands"].items():
+        print(
+            f"{name:<12}{c['count']:>7}{c['throughput'] or 0:>10.0f}{c['p50_ms']:>9.3f}{c['p99_ms']:>9.3f}"
+            f"{c['max_ms']:>9.3f}{c['kv_get']:>7.2f}{c['kv_put']:>7.2f}{c['kv_delete']:>7.2f}{c['napcat']:>8.2f}"
+        )
+    flush = result["flush"]
+    print(f"写回 KV：get {flush['get']} put {flush['put']} delete {flush['delete']}")
+    gate = result["gate"]
+    print(f"群排队：累计排队 {gate['queued']}，丢弃 {gate['shed']}")
+    for name, c in result["commands"].items():
+        if c.get("shed"):
+            print(f"{name}：{c['shed']} 条因排队已满只回复了忙碌提示（不计入上面的次数和延迟）")
+    if result["errors"]:
+        print(f"插件日志中有 {result['errors']} 条 warning/error，第一条：{result['first_error']}")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """与基线比较，返回退化项"""
+    if baseline.get("params") != result["params"]:
+        print("警告：两次运行的参数不同，结果不可直接比较")
+    regressions = []
+    for name, c in result["commands"].items():
+        old = baseline.get("commands", {}).get(name)
+        if not old:
+            continue
+        ratio = c["p99_ms"] / old["p99_ms"] if old["p99_ms"] else 1.0
+        print(f"{name:<12} p99 {old['p99_ms']:.3f} → {c['p99_ms']:.3f} ms ({(ratio - 1) * 100:+.0f}%)")
+        # 亚毫秒级的指令受调度抖动影响大，只看超过 NOISE_MS 的变化
+        if ratio > 1 + tolerance and c["p99_ms"] - old["p99_ms"] > NOISE_MS:
+            regressions.append(f"{name} p99 +{(ratio - 1) * 100:.0f}%")
+        for op in ("kv_get", "kv_put", "kv_delete"):
+            # 抽中已婚角色的比例随调度略有浮动，留 5% 余量
+            if c[op] > old[op] * 1.05 + 1e-9:
+                regressions.append(f"{name} {op} {old[op]} → {c[op]}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50, help="每群用户数")
+    parser.add_argument("--draws", type=int, default=5, help="每人抽卡次数")
+    parser.add_argument("--harem", type=int, default=50, help="后宫上限")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时在处理的指令数")
+    parser.add_argument("--group-concurrency", type=int, default=4, help="每群同时处理的指令数，0 为不限制")
+    parser.add_argument("--kv", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--kv-latency", type=float, default=1.0, help="每次 KV 调用的延迟（毫秒）")
+    parser.add_argument("--napcat-latency", type=float, default=5.0, help="每次 NapCat 调用的延迟（毫秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="把结果写成 JSON")
+    parser.add_argument("--compare", help="与之前 --out 写出的结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的 p99 变慢比例")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("退化：" + "；".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""普通群聊消息经过插件的开销
+
+每条群消息都会进入 handle_group_notice。本脚本用替身事件反复调用它，
+测量已知发言者、新发言者和无关 notice 三种情况的单条耗时，并确认没有
+任何 KV 调用。超过预算时以非零状态退出。
+
+    python bench/message_path.py
+"""
+
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from fake_astrbot import FakeEvent, FakeNapCat, drain, make_plugin  # noqa: E402
+
+BUDGET_US = 20.0  # 非指令聊天每条消息的开销上限（微秒）
+ROUNDS = 50000
+
+
+async def measure(plugin, events) -> float:
+    handler = plugin.handle_group_notice
+    start = time.perf_counter()
+    for event in events:
+        await drain(handler(event))
+    return (time.perf_counter() - start) / len(events) * 1e6
+
+
+async def main() -> int:
+    plugin, kv = make_plugin()
+    bot = FakeNapCat()
+    speakers = [str(100000 + i) for i in range(500)]
+    # 先让所有人说一次话，之后都是已知发言者
+    await measure(plugin, [FakeEvent(bot, "1", uid) for uid in speakers])
+    kv_before = kv.calls
+    log = plugin.membership.path
+
+    chatter = [FakeEvent(bot, "1", speakers[i % len(speakers)]) for i in range(ROUNDS)]
+    newcomers = [FakeEvent(bot, "2", str(200000 + i)) for i in range(ROUNDS // 10)]
+    notices = [FakeEvent(bot, "1", "1", post_type="notice", notice_type="group_recall") for _ in range(ROUNDS)]
+    log_size = log.stat().st_size
+    results = {
+        "known speaker": await measure(plugin, chatter),
+    }
+    log_grew = log.stat().st_size != log_size
+    results |= {
+        "new speaker": await measure(plugin, newcomers),
+        "ignored notice": await measure(plugin, notices),
+    }
+    plugin.membership.close()
+
+    for name, us in results.items():
+        print(f"{name:>15}: {us:6.2f} us/msg")
+    kv_calls = kv.calls - kv_before
+    print(f"{'kv calls':>15}: {kv_calls}")
+    if log_grew:
+        print("members.log grew for known speakers")
+    failed = log_grew or kv_calls > 0 or results["known speaker"] > BUDGET_US or results["ignored notice"] > BUDGET_US
+    print("over budget" if failed else f"ok (budget {BUDGET_US} us/msg, no storage access)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,127 +1,300 @@
 ﻿from astrbot.api.event import filter, AstrMessageEvent
 from astrbot.core.star.filter.platform_adapter_type import PlatformAdapterType
-from astrbot.api.star import Context, Star, register
+from astrbot.api.star import Context, Star, StarTools, register
 from astrbot.api import AstrBotConfig, logger
 import astrbot.api.message_components as Comp
 import time
 from .util.character_manager import CharacterManager
+from .util.draw_engine import DrawEngine
+from .util.kv_cache import KVCache
+from .util.ownership import OwnershipIndex
+from .util.outbound import OutboundDispatcher, not_sent
+from .util.image_cache import ImageCache
+from .util.quota import QuotaEngine
+from .util.wishes import WishBook
+from .util.harem_view import HaremViews
+from .util.member_cache import MemberCache
+from .util.membership import Membership
+from .util.pending import PendingActions
+from .util.metrics import Metrics, metered
+from .util.sqlite_store import SqliteStore
+from .util.group_gate import GroupGate, gated
+from .util.group_archive import GroupArchive
+from .util.http import create_session
+from pathlib import Path
 import random
 import asyncio
 
 DRAW_MSG_TTL = 45  # seconds to keep draw message records
-DRAW_MSG_INDEX_MAX = 300  # max tracked message ids to avoid unbounded growth
+PLUGIN_NAME = "astrbot_plugin_mudae_qq"
+CLAIM_RETRY_MAX = 3  # optimistic claim attempts before giving up
+SEARCH_RESULT_MAX = 10  # max characters listed by 搜索
+IMAGE_PREFETCH_TOP = 300  # top-heat characters whose images are warmed at startup
+POOL_WARMING_TEXT = "卡池加载中，请稍后再试"
+DRAW_BUSY_TEXT = "抽卡太频繁，请稍后再试"  # reply when a group's draw queue is full
+# notice types the plugin reacts to; every other notice is dropped before any work
+HANDLED_NOTICE_TYPES = frozenset({"group_msg_emoji_like", "group_admin", "group_increase", "group_decrease"})
+WISH_WEIGHT_DEFAULT = 3  # wished characters are this many times as likely as others
+UNKNOWN_ID_SAMPLE = 10  # unknown character ids listed in the 导入存档 report
 
 class CCB_Plugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
-        self.char_manager = CharacterManager()
+        self.data_dir = StarTools.get_data_dir(PLUGIN_NAME)
         self.config = config
+        # 指令延迟、KV/NapCat 调用、群锁等待等计数，统计 指令和 Prometheus 导出共用
+        self.metrics = Metrics()
+        self.char_manager = CharacterManager(self.data_dir, logger=logger)
+        self.char_manager.metrics = self.metrics
+        self.char_manager.owned_ids = self._owned_ids
+        self.http = None
+        # 所有游戏数据经写回缓存读写，定时批量落到 AstrBot KV，或落到可选的 SQLite 后端
+        self.store = None
+        if self.config.get("storage_backend", "kv") == "sqlite":
+            # 旧 KV 里的数据在首次访问每个群时迁移过来
+            self.store = SqliteStore(self.data_dir / "game.db", legacy_get=self.get_kv_data)
+            self.kv = KVCache(
+                *self.metrics.wrap_kv(self.store.get, self.store.put, self.store.delete),
+                journal_path=self.data_dir / "kv_journal.jsonl",
+                write_batch=self.metrics.wrap_batch(self.store.write_batch),
+            )
+        else:
+            self.kv = KVCache(
+                *self.metrics.wrap_kv(self.get_kv_data, self.put_kv_data, self.delete_kv_data),
+                journal_path=self.data_dir / "kv_journal.jsonl",
+            )
+        self._migrate_task = None
+        # 发过言的用户只在内存里维护，新用户追加写日志
+        self.membership = Membership(self.kv, self.data_dir / "members.log")
+        if self.store is not None:
+            self.store.known_users = self.membership.known
+        self.ownership = OwnershipIndex(
+            self.kv,
+            users=self.membership.users,
+            loader=self.store.group_harems if self.store is not None else None,
+        )
+        self.wishes = WishBook(self.kv, self.ownership)
+        # 我的后宫 的分页/拼图缓存，后宫变化时由归属索引通知失效
+        self.harem_views = HaremViews(self.data_dir / "harem_grid")
+        self.ownership.add_listener(self.harem_views.invalidate)
+        # 群身份/成员缓存，管理员指令不必每次请求 NapCat
+        self.members = MemberCache(on_call=self.metrics.observe_napcat)
+        # NapCat 发送走按群限速的异步队列，处理器入队后立即返回
+        self.outbound = OutboundDispatcher(on_call=self.metrics.observe_napcat)
+        # 抽卡次数/冷却只在内存中计数，定期快照到文件
+        self.quota = QuotaEngine(self.data_dir / "quota.json", store=self.store)
+        # 等待贴表情的交换请求只放在内存里，开启后才快照到文件以便重启后继续生效
+        self.pending = PendingActions(
+            DRAW_MSG_TTL,
+            self.data_dir / "pending.json" if self.config.get("pending_persist", False) else None,
+        )
         self.super_admins = self.config.super_admins or []
         self.draw_hourly_limit_default = self.config.draw_hourly_limit or 5
         self.claim_cooldown_default = self.config.claim_cooldown or 3600
         self.harem_max_size_default = self.config.harem_max_size or 10
+        cache_mb = self.config.get("image_cache_size_mb", 512)
+        self.image_cache = ImageCache(self.data_dir / "images", max_bytes=max(0, int(cache_mb or 0)) * 1024 * 1024)
+        self.image_send_mode = self.config.get("image_send_mode", "base64") or "base64"
         self.group_cfgs = {}
-        self.user_lists = {}
         self.group_locks = {}
+        # 每个群同时处理的玩家指令数上限，刷屏的群在自己的队列里排队
+        self.gate = GroupGate(int(self.config.get("group_concurrency", 4) or 0))
+        # 群存档（导出/导入/定时快照）放在数据目录的 exports 下
+        self.archive = GroupArchive(self.kv)
+        self.export_dir = self.data_dir / "exports"
+        self._snapshot_task = None
 
     async def initialize(self):
-        """异步初始化插件，加载角色数据"""
+        """异步初始化插件，加载角色数据（本地快照），远程列表在后台刷新"""
+        # 卡池刷新和图片下载共用一个带超时的连接池
+        self.http = create_session()
+        self.char_manager.session = self.http
+        self.image_cache.session = self.http
+        if self.store is not None:
+            await self.store.open()
+        await self.quota.start()
+        await self.membership.start()
+        if self.store is not None:
+            # 已知的群在后台一次性迁移；迁移完成前访问到的群会先单独迁移
+            self._migrate_task = asyncio.create_task(self._migrate_store())
+        await self.pending.start()
+        try:
+            metrics_file = str(self.config.get("metrics_file", "") or "").strip()
+            await self.metrics.start(
+                self.data_dir / metrics_file if metrics_file else None,
+                int(self.config.get("metrics_port", 0) or 0),
+            )
+        except OSError as e:
+            logger.error({"stage": "metrics_server_failed", "error": repr(e)})
+        replayed = await self.kv.recover()
+        if replayed:
+            logger.info({"stage": "kv_journal_replayed", "keys": len(replayed)})
+        start = time.perf_counter()
         chars = await self.char_manager.load_characters_async()
+        self.metrics.observe_pool("load", time.perf_counter() - start)
         if not chars:
-            logger.warning("角色数据加载失败，将在首次抽卡时重试")
+            if self.char_manager.state == self.char_manager.STATE_FAILED:
+                logger.warning("角色数据加载失败，将在首次抽卡时重试")
+            else:
+                logger.info({"stage": "pool_first_fetch_started", "url": self.char_manager.IMAGE_LIST_URL})
+        if self.char_manager.id_collisions:
+            logger.warning({"stage": "char_id_collision", "collisions": self.char_manager.id_collisions[:20]})
+        self.char_manager.start_background_refresh()
+        snapshot_hours = float(self.config.get("snapshot_interval_hours", 0) or 0)
+        if snapshot_hours > 0:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop(snapshot_hours * 3600))
+        self.image_cache.prefetch(
+            c.get("image_url") for c in self.char_manager.top_characters(IMAGE_PREFETCH_TOP)
+        )
+
+    async def _migrate_store(self):
+        try:
+            reports = await self.store.migrate(self.membership.groups())
+        except Exception as e:
+            logger.error({"stage": "sqlite_migrate_failed", "error": repr(e)})
+            return
+        if reports:
+            logger.info({
+                "stage": "sqlite_migrated",
+                "groups": len(reports),
+                "users": sum(r["users"] for r in reports),
+                "rows": sum(r["rows"] for r in reports),
+            })
+
+    async def _snapshot_loop(self, interval):
+        '''定时把每个已知的群导出为压缩存档，只保留最近的若干份'''
+        keep = int(self.config.get("snapshot_keep", 7) or 0)
+        while True:
+            await asyncio.sleep(interval)
+            for gid in self.membership.groups():
+                try:
+                    report = await self._export_group(gid, compress=True, prefix="auto")
+                    await asyncio.to_thread(self.archive.prune, self.export_dir, f"{gid}-auto-*.jsonl.gz", keep)
+                except Exception as e:
+                    logger.error({"stage": "snapshot_failed", "gid": gid, "error": repr(e)})
+                    continue
+                logger.info({"stage": "snapshot_written", "gid": gid, "users": report["users"], "path": report["path"]})
+
+    async def _export_group(self, gid, compress=False, prefix=""):
+        '''导出不持有群锁，按批读取，期间的抽卡/交换照常进行
+
+        因此存档不是整群的原子快照：导出过程中换手的角色可能出现在两个用户名下，导入时只保留第一位。
+        '''
+        users = set(await self.membership.users(gid)) | set((await self.ownership.group(gid)).harems)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"{gid}-{prefix + '-' if prefix else ''}{stamp}.jsonl" + (".gz" if compress else "")
+        return await self.archive.export(gid, users, self.export_dir / name, self.char_manager.pool_version)
+
+    async def _owned_ids(self):
+        '''所有群里已被娶走的角色ID，卡池更新时据此决定哪些下架角色需要保留
+
+        只有旧 KV 里记录过的群列不出来，所以还不知道任何群、或见到过旧版本数据时
+        返回 None，由卡池保留全部下架角色。
+        '''
+        groups = self.membership.groups()
+        owned = set()
+        for gid in groups:
+            await self.membership.users(gid)  # 合并旧的 user_list，顺带发现旧版本数据
+            if self.membership.legacy:
+                return None
+            owned.update((await self.ownership.group(gid)).owner)
+        return owned if groups else None
 
     async def get_group_cfg(self, gid):
         if gid not in self.group_cfgs:
-            config = await self.get_kv_data(f"{gid}:config", {}) or {}
+            config = await self.kv.get(f"{gid}:config", {}) or {}
             self.group_cfgs[gid] = config
         return self.group_cfgs[gid]
 
     async def put_group_cfg(self, gid, config):
         self.group_cfgs[gid] = config
-        await self.put_kv_data(f"{gid}:config", config)
+        await self.kv.put(f"{gid}:config", config)
 
     async def get_user_list(self, gid):
-        if gid not in self.user_lists:
-            users = await self.get_kv_data(f"{gid}:user_list", [])
-            self.user_lists[gid] = set(users)
-        return self.user_lists[gid]
-
-    async def put_user_list(self, gid, users):
-        self.user_lists[gid] = set(users)
-        await self.put_kv_data(f"{gid}:user_list", list(users))
+        return await self.membership.users(gid)
 
     async def get_group_role(self, event):
         gid = event.get_group_id() or "global"
         uid = event.get_sender_id()
-        resp = await event.bot.api.call_action("get_group_member_info", group_id=gid, user_id=uid)
-        return resp.get("role", None)
+        return await self.members.role(event.bot.api.call_action, gid, uid)
+
+    async def is_group_member(self, event, uid):
+        '''用户是否仍在群里；拿不到成员列表时退回到“在本群发过言”'''
+        gid = event.get_group_id() or "global"
+        member = await self.members.is_member(event.bot.api.call_action, gid, uid)
+        if member is None:
+            return str(uid) in await self.get_user_list(event.get_group_id())
+        return member
+
+    def _pool_ready(self):
+        '''卡池未就绪时在后台触发加载（不阻塞），返回卡池是否可用'''
+        if self.char_manager.ready:
+            return True
+        self.char_manager.ensure_loading()
+        return False
 
     def _get_group_lock(self, gid):
         lock = self.group_locks.get(gid)
         if lock is None:
-            lock = asyncio.Lock()
+            lock = self.metrics.timed_lock(asyncio.Lock())
             self.group_locks[gid] = lock
         return lock
 
     @filter.platform_adapter_type(PlatformAdapterType.AIOCQHTTP)
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
     async def handle_group_notice(self, event: AstrMessageEvent):
-        '''用户回应抽卡结果和交换请求的处理器'''
+        '''用户回应抽卡结果和交换请求的处理器
+
+        每条群消息都会经过这里，普通聊天只做一次内存集合查找，不读写存储。
+        '''
+        raw = event.message_obj.raw_message
+        is_notice = raw.post_type == "notice"
+        # 不关心的 notice 直接丢弃
+        if is_notice and raw.notice_type not in HANDLED_NOTICE_TYPES:
+            return
         gid = event.get_group_id()
         if not gid:
             return  # commands are group-only
+        if is_notice:
+            # 管理员变动、成员进出群时更新群身份缓存（包括机器人自己被踢出群）
+            self.members.on_notice(raw)
         uid = event.get_sender_id()
         if uid == event.get_self_id():
             return
-        user_set = await self.get_user_list(gid)
-        if uid not in user_set:
-            user_set.add(uid)
-            await self.put_user_list(gid, user_set)
+        if not is_notice:
+            self.membership.observe(gid, uid)
+            return
 
-        # 检查是否为notice事件：event.message_obj.raw_message.post_type == "notice"
-        if event.message_obj.raw_message.post_type == "notice":
-            # 检查是否为emoji事件：event.message_obj.raw_message.notice_type == "group_msg_emoji_like"
-            if event.message_obj.raw_message.notice_type == "group_msg_emoji_like":
-                # stop further pipeline (including default LLM) for notice events
-                async for result in self.handle_emoji_like_notice(event):
-                    yield result
+        if raw.notice_type == "group_msg_emoji_like":
+            self.membership.observe(gid, uid)
+            # stop further pipeline (including default LLM) for notice events
+            async for result in self.handle_emoji_like_notice(event):
+                yield result
 
+    @metered("贴表情")
     async def handle_emoji_like_notice(self, event: AstrMessageEvent):
-        '''用户回应抽卡结果和交换请求的处理器'''
+        '''用户回应交换请求的处理器（抽卡结果在发出时已自动收集）'''
         emoji_user = event.get_sender_id()
         # 忽略机器人自己的贴表情操作
         if str(emoji_user) == str(event.get_self_id()):
             return
         msg_id = event.message_obj.raw_message.message_id
-        now_ts = time.time()
         gid = event.get_group_id() or "global"
-        
-        draw_msg = await self.get_kv_data(f"{gid}:draw_msg:{msg_id}", None)
-        if draw_msg:
-            event.call_llm = True
-            async for res in self.handle_claim(event):
-                yield res
+
+        # 一次内存查找，过期的条目已被丢弃
+        pending = self.pending.get(gid, msg_id)
+        if pending is None or pending.kind != "exchange":
             return
-        exchange_req = await self.get_kv_data(f"{gid}:exchange_req:{msg_id}", None)
-        if exchange_req:
-            event.call_llm = True
-            if str(emoji_user) != str(exchange_req.get("to_uid")):
-                return
-            await self.delete_kv_data(f"{gid}:exchange_req:{msg_id}")
-            ts = float(exchange_req.get("ts", 0) or 0)
-            idx_key = f"{gid}:exchange_req_index"
-            idx = await self.get_kv_data(idx_key, [])
-            new_idx = [item for item in idx if not (isinstance(item, dict) and item.get("id") == msg_id)]
-            if len(new_idx) != len(idx):
-                await self.put_kv_data(idx_key, new_idx)
-            if ts and (now_ts - ts > DRAW_MSG_TTL):
-                return
-            async for res in self.process_swap(event, exchange_req, msg_id):
-                yield res
+        event.call_llm = True
+        if str(emoji_user) != str(pending.data.get("to_uid")):
             return
+        self.pending.pop(gid, msg_id)
+        async for res in self.process_swap(event, pending.data, msg_id):
+            yield res
 
     @filter.command("菜单", alias={"帮助"})
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("菜单")
     async def handle_help_menu(self, event: AstrMessageEvent):
         '''显示帮助菜单'''
         event.call_llm = True
@@ -135,6 +308,7 @@ class CCB_Plugin(Star):
             "搜索 <角色名称>",
             "我的后宫",
             "我的后宫 <页码>",
+            "我的后宫 图",
             "交换 <我的角色ID> <对方角色ID>",
             "许愿 <角色ID>",
             "愿望单",
@@ -147,7 +321,14 @@ class CCB_Plugin(Star):
             "================================",
             "群主/超管指令：",
             "刷新 <QQ号>",
-            "终极轮回"
+            "终极轮回",
+            "修复索引",
+            "导出存档 [gz]",
+            "导入存档 <文件名> [确认]",
+            "================================",
+            "超管指令：",
+            "重载卡池 [本地]",
+            "统计"
         ]
         yield event.chain_result([Comp.Plain("\n".join(menu_lines))])
         return
@@ -155,50 +336,51 @@ class CCB_Plugin(Star):
     @filter.command("抽卡", alias={"ck"})
     @filter.platform_adapter_type(PlatformAdapterType.AIOCQHTTP)
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("抽卡")
+    @gated(shed=DRAW_BUSY_TEXT)
     async def handle_draw(self, event: AstrMessageEvent):
         '''抽卡！直接获得角色'''
         event.call_llm = True
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         user_id = event.get_sender_id()
         gid = event.get_group_id() or "global"
         
-        # 先获取配置和检查限制（不加锁，提高响应速度）
-        key = f"{gid}:{user_id}:draw_status"
-        now_ts = time.time()
+        # 先检查次数和冷却（纯内存，不读写存储）
         config = await self.get_group_cfg(gid)
         limit = config.get("draw_hourly_limit", self.draw_hourly_limit_default)
-        now_tm = time.localtime(now_ts)
-        bucket = f"{now_tm.tm_year}-{now_tm.tm_yday}-{now_tm.tm_hour}"
-        record_bucket, record_count = await self.get_kv_data(key, (None, 0))
         cooldown = config.get("draw_cooldown", 0)
-
-        # 注：已移除抽卡冷却，只保留每小时次数限制
-
-        if record_bucket != bucket:
-            count = 0
-        else:
-            count = record_count
-            if count >= limit:
-                if count == limit:
-                    chain = [
-                        Comp.At(qq=user_id),
-                        Comp.Plain("\u200b\n⚠本小时已达上限⚠")
-                    ]
-                    yield event.chain_result(chain)
-                    await self.put_kv_data(key, (bucket, count + 1))
-                return
-
-        next_count = count + 1
-        remaining = limit - next_count
+        quota_status, remaining, wait = self.quota.acquire(gid, user_id, limit, cooldown)
+        if quota_status == QuotaEngine.LIMITED:
+            chain = [
+                Comp.At(qq=user_id),
+                Comp.Plain(f"\u200b\n⚠本小时已达上限⚠（{int(wait // 60) + 1}分钟后恢复）")
+            ]
+            yield event.chain_result(chain)
+            return
+        if quota_status == QuotaEngine.COOLDOWN:
+            yield event.chain_result([
+                Comp.At(qq=user_id),
+                Comp.Plain(f"\u200b\n抽卡冷却中，{int(wait) + 1}秒后再试")
+            ])
+            return
+        if quota_status != QuotaEngine.OK:
+            return
         
-        # 随机选择角色
-        wish_list = await self.get_kv_data(f"{gid}:{user_id}:wish_list", [])
-        if random.random() < 0.001 and wish_list:
-            char_id = random.choice(wish_list)
-            character = self.char_manager.get_character_by_id(char_id)
-        else:
-            character = self.char_manager.get_random_character(limit=config.get('draw_scope', None))
+        # 随机选择角色：先按许愿加成判定是否直接抽中愿望单里的角色
+        draw_scope = config.get('draw_scope', None)
+        scope = min(draw_scope or len(self.char_manager.characters), len(self.char_manager.characters))
+        wished_id = await self.wishes.pick(gid, user_id, scope, config.get("wish_weight", WISH_WEIGHT_DEFAULT))
+        character = self.char_manager.get_character_by_id(wished_id) if wished_id else None
+        if character is None or character.get("removed"):
+            character = self.char_manager.get_random_character(
+                limit=draw_scope,
+                mode=config.get('draw_mode', DrawEngine.MODE_UNIFORM),
+            )
         
         if not character:
+            self.quota.refund(gid, user_id)
             yield event.plain_result("卡池数据未加载")
             return
             
@@ -207,77 +389,126 @@ class CCB_Plugin(Star):
         image_url = character.get("image_url")  # animewifex 图床图片
         char_id = character.get("id")
         
-        # 检查角色是否已被结婚
-        married_to = await self.get_kv_data(f"{gid}:{char_id}:married_to", None)
+        # 先完成抢占（临界区内不做网络 I/O），再发送消息
+        harem_max = config.get("harem_max_size", self.harem_max_size_default)
+        status, married_to = await self._claim_character(gid, user_id, char_id, harem_max)
         
         # 获取用户昵称
         nick = event.get_sender_name() or str(user_id)
         
-        try:
-            # 构建消息 - 使用 animewifex 格式
-            # 先发送角色图片和来源信息
-            if not married_to:
-                # 未结婚：显示获得消息（包含ID）
-                text = f"{nick}，你抽到了来自《{source}》的{name}[id:{char_id}]，请好好珍惜哦~"
-            else:
-                # 已结婚：显示已被占用（包含ID）
-                text = f"{name}[id:{char_id}] - 来自《{source}》\n❤已与{married_to}结婚，勿扰❤"
-            
-            cq_message = [{"type": "text", "data": {"text": text}}]
-            if image_url:
-                cq_message.append({"type": "image", "data": {"file": image_url}})
-            
-            if remaining <= 0:
-                cq_message.append({"type": "text", "data": {"text": "⚠本小时已达上限⚠"}})
-            
-            # 使用NapCat的API发送消息
-            resp = await event.bot.api.call_action("send_group_msg", group_id=event.get_group_id(), message=cq_message)
-            await self.put_kv_data(key, (bucket, next_count))
-            
-            # 如果角色未被结婚，直接让用户获得该角色
-            if not married_to:
-                marry_list_key = f"{gid}:{user_id}:partners"
-                marry_list = await self.get_kv_data(marry_list_key, [])
-                harem_max = config.get("harem_max_size", self.harem_max_size_default)
-                
-                if len(marry_list) < harem_max:
-                    # 添加到后宫
-                    if str(char_id) not in marry_list:
-                        marry_list.append(str(char_id))
-                    await self.put_kv_data(marry_list_key, marry_list)
-                    await self.put_kv_data(f"{gid}:{char_id}:married_to", user_id)
-                else:
-                    # 后宫已满的提示
-                    yield event.chain_result([
-                        Comp.At(qq=user_id),
-                        Comp.Plain(f" 你的后宫已满{harem_max}，无法再获得新角色。")
-                    ])
-        except Exception as e:
-            logger.error({"stage": "draw_send_error_bot", "error": repr(e)})
+        # 构建消息 - 使用 animewifex 格式
+        # 先发送角色图片和来源信息
+        if status != "married":
+            # 未结婚：显示获得消息（包含ID）
+            text = f"{nick}，你抽到了来自《{source}》的{name}[id:{char_id}]，请好好珍惜哦~"
+        else:
+            # 已结婚：显示已被占用（包含ID）
+            text = f"{name}[id:{char_id}] - 来自《{source}》\n❤已与{married_to}结婚，勿扰❤"
+        
+        cq_message = [{"type": "text", "data": {"text": text}}]
+        if image_url:
+            # 命中本地缓存时直接发送文件，未命中则发 URL 并在后台缓存
+            image_file = await self.image_cache.message_file(image_url, self.image_send_mode)
+            if image_file is None:
+                image_file = image_url
+                self.image_cache.prefetch([image_url])
+            cq_message.append({"type": "image", "data": {"file": image_file}})
+        
+        if remaining <= 0:
+            cq_message.append({"type": "text", "data": {"text": "⚠本小时已达上限⚠"}})
+        
+        if status == "full":
+            # 后宫已满的提示，与抽卡结果同一条消息发出
+            cq_message.append({"type": "at", "data": {"qq": user_id}})
+            cq_message.append({"type": "text", "data": {"text": f" 你的后宫已满{harem_max}，无法再获得新角色。"}})
 
-    async def handle_claim(self, event: AstrMessageEvent):
-        '''结婚逻辑（保留用于兼容，但抽卡已自动获得）'''
-        event.call_llm = True
-        gid = event.get_group_id() or "global"
-        user_id = event.get_sender_id()
-        msg_id = event.message_obj.raw_message.message_id
-        draw_msg = await self.get_kv_data(f"{gid}:draw_msg:{msg_id}", None)
-        if draw_msg:
-            char_id = draw_msg.get("char_id")
-            await self.delete_kv_data(f"{gid}:draw_msg:{msg_id}")
-            async for res in self.auto_claim(event, user_id, char_id, msg_id):
-                yield res
+        # 通知许愿了这个角色的其他人
+        wishers = [uid for uid in await self.wishes.wishers(gid, char_id) if uid != str(user_id)]
+        if wishers:
+            cq_message.append({"type": "text", "data": {"text": "\n"}})
+            for uid in wishers:
+                cq_message.append({"type": "at", "data": {"qq": uid}})
+            cq_message.append({"type": "text", "data": {"text": f" 你们许愿的{name}出现了"}})
+        
+        async def on_sent(resp, error):
+            if error is None:
+                return
+            logger.error({"stage": "draw_send_error_bot", "error": repr(error)})
+            if status == "claimed" and not_sent(error):
+                # 消息确定没发出去，撤销本次获得；超时等情况下消息可能已送达，保留
+                await self._release_claim(gid, user_id, char_id)
+        
+        # 使用NapCat的API发送消息（入队后立即返回）
+        self.outbound.submit(event.bot.api.call_action, event.get_group_id(), cq_message, on_sent)
+
+    async def _claim_character(self, gid, user_id, char_id, harem_max):
+        '''抢占角色，返回 (claimed/married/full, 当前持有者)
+
+        相关键在锁外预读进缓存；锁内只做无 await 的比较并写入，持锁时间极短。
+        校验失败说明预读后有其他协程改动了数据，重新预读后重试。
+        '''
+        claim_key = f"{gid}:{char_id}:married_to"
+        marry_list_key = f"{gid}:{user_id}:partners"
+        lock = self._get_group_lock(gid)
+        for _ in range(CLAIM_RETRY_MAX):
+            married_to = await self.kv.get(claim_key, None)
+            if married_to:
+                return "married", married_to
+            marry_list = await self.kv.get(marry_list_key, [])
+            if len(marry_list) >= harem_max:
+                return "full", None
+            await self.ownership.group(gid)  # 预读归属索引，锁内不再产生 I/O
+            new_list = marry_list if str(char_id) in marry_list else marry_list + [str(char_id)]
+            async with lock:
+                claimed = self.kv.compare_and_set(
+                    {claim_key: None, marry_list_key: marry_list},
+                    {claim_key: user_id, marry_list_key: new_list},
+                )
+                if claimed:
+                    await self.ownership.add(gid, user_id, char_id)
+                    return "claimed", user_id
+        # 竞争激烈时退回到整段持锁
+        async with lock:
+            married_to = await self.kv.get(claim_key, None)
+            if married_to:
+                return "married", married_to
+            marry_list = await self.kv.get(marry_list_key, [])
+            if len(marry_list) >= harem_max:
+                return "full", None
+            if str(char_id) not in marry_list:
+                marry_list.append(str(char_id))
+            await self.kv.put(marry_list_key, marry_list)
+            await self.kv.put(claim_key, user_id)
+            await self.ownership.add(gid, user_id, char_id)
+            return "claimed", user_id
+
+    async def _release_claim(self, gid, user_id, char_id):
+        '''撤销一次抢占（仅当角色仍属于该用户时）'''
+        claim_key = f"{gid}:{char_id}:married_to"
+        marry_list_key = f"{gid}:{user_id}:partners"
+        async with self._get_group_lock(gid):
+            if str(await self.kv.get(claim_key, None)) != str(user_id):
+                return
+            marry_list = await self.kv.get(marry_list_key, [])
+            await self.kv.put(marry_list_key, [m for m in marry_list if m != str(char_id)])
+            await self.kv.delete(claim_key)
+            await self.ownership.remove(gid, char_id)
 
     @filter.command("我的后宫")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
-    async def handle_harem(self, event: AstrMessageEvent, page: int = 0):
-        '''显示收集的人物列表（文字形式，带ID）'''
+    @metered("我的后宫")
+    @gated
+    async def handle_harem(self, event: AstrMessageEvent, page: str | None = None):
+        '''显示收集的人物列表（文字分页，带ID）；参数为“图”时发送拼图'''
         event.call_llm = True
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         gid = event.get_group_id() or "global"
         uid = str(event.get_sender_id())
         nick = event.get_sender_name() or str(uid)
         marry_list_key = f"{gid}:{uid}:partners"
-        marry_list = await self.get_kv_data(marry_list_key, [])
+        marry_list = await self.kv.get(marry_list_key, [])
         
         if not marry_list:
             yield event.chain_result([
@@ -286,30 +517,44 @@ class CCB_Plugin(Star):
                 Comp.Plain("，你的后宫空空如也。")
             ])
             return
-        
-        # 获取角色信息
-        characters = []
-        for cid in marry_list:
-            char = self.char_manager.get_character_by_id(cid)
-            if char:
-                characters.append(char)
-        
-        if not characters:
+
+        pool_version = self.char_manager.pool_version
+        page = str(page or "").strip()
+        if page in ("图", "图片") and self.harem_views.grid_available:
+            async for res in self._send_harem_grid(event, gid, uid, nick, marry_list, pool_version):
+                yield res
+            return
+
+        def render():
+            lines = []
+            for cid in marry_list:
+                char = self.char_manager.get_character_by_id(cid)
+                if not char:
+                    continue
+                name = char.get("name", "未知角色")
+                source = char.get("source", "未知作品")
+                removed = "（已下架）" if char.get("removed") else ""
+                lines.append(f"《{source}》的{name}[id:{char.get('id', '?')}]{removed}")
+            return lines
+
+        pages = self.harem_views.pages(gid, uid, pool_version, render)
+        total = sum(len(p) for p in pages)
+        if not total:
             yield event.chain_result([
                 Comp.Reply(id=event.message_obj.message_id),
                 Comp.At(qq=uid),
                 Comp.Plain("，你的后宫数据异常。")
             ])
             return
+        page_no = int(page) if page.isdigit() else 1
+        page_no = min(max(page_no, 1), len(pages))
         
         # 构建文字列表
-        lines = [f"🎀 {nick}的后宫 🎀", f"共{len(characters)}位角色", ""]
-        
-        for char in characters:
-            name = char.get("name", "未知角色")
-            source = char.get("source", "未知作品")
-            char_id = char.get("id", "?")
-            lines.append(f"《{source}》的{name}[id:{char_id}]")
+        lines = [f"🎀 {nick}的后宫 🎀", f"共{total}位角色"]
+        if len(pages) > 1:
+            lines.append(f"第{page_no}/{len(pages)}页，使用“我的后宫 <页码>”翻页")
+        lines.append("")
+        lines.extend(pages[page_no - 1])
         
         # 发送合并转发消息（纯文字）
         node_list = [
@@ -322,8 +567,34 @@ class CCB_Plugin(Star):
         
         yield event.chain_result([Comp.Nodes(node_list)])
 
+    async def _send_harem_grid(self, event, gid, uid, nick, marry_list, pool_version):
+        '''把后宫角色的本地缓存图片拼成一张图发送，缺图的在后台预取'''
+        urls = []
+        for cid in marry_list:
+            char = self.char_manager.get_character_by_id(cid)
+            if char:
+                urls.append(char.get("image_url"))
+        tiles = [self.image_cache.lookup(url) for url in urls]
+        missing = [url for url, tile in zip(urls, tiles) if tile is None and url]
+        if missing:
+            self.image_cache.prefetch(missing)
+        path = await self.harem_views.grid(gid, uid, pool_version, tiles)
+        if path is None:
+            yield event.plain_result("生成后宫拼图失败")
+            return
+        chain = [
+            Comp.Reply(id=event.message_obj.message_id),
+            Comp.Plain(f"🎀 {nick}的后宫（{len(tiles)}位）🎀"),
+            Comp.Image.fromFileSystem(str(path)),
+        ]
+        if missing:
+            chain.append(Comp.Plain(f"\n{len(missing)}张图片还在缓存中，稍后再看会更完整"))
+        yield event.chain_result(chain)
+
     @filter.command("离婚")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("离婚")
+    @gated
     async def handle_divorce(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''移除自己与指定角色的婚姻'''
         event.call_llm = True
@@ -336,7 +607,7 @@ class CCB_Plugin(Star):
         lock = self._get_group_lock(gid)
         async with lock:
             marry_list_key = f"{gid}:{user_id}:partners"
-            marry_list = await self.get_kv_data(marry_list_key, [])
+            marry_list = await self.kv.get(marry_list_key, [])
             cmd_msg_id = event.message_obj.message_id
             if str(cid) not in marry_list:
                 yield event.chain_result([
@@ -345,16 +616,17 @@ class CCB_Plugin(Star):
                 ])
                 return
 
-            fav = await self.get_kv_data(f"{gid}:{user_id}:fav", None)
+            fav = await self.kv.get(f"{gid}:{user_id}:fav", None)
             if fav and str(fav) == str(cid):
-                await self.delete_kv_data(f"{gid}:{user_id}:fav")
+                await self.kv.delete(f"{gid}:{user_id}:fav")
             elif fav is not None and fav not in marry_list:
-                await self.delete_kv_data(f"{gid}:{user_id}:fav")
+                await self.kv.delete(f"{gid}:{user_id}:fav")
 
             marry_list = [m for m in marry_list if m != str(cid)]
-            await self.put_kv_data(marry_list_key, marry_list)
-            await self.delete_kv_data(f"{gid}:{cid}:married_to")
-            cname = self.char_manager.get_character_by_id(cid).get("name") or ""
+            await self.kv.put(marry_list_key, marry_list)
+            await self.kv.delete(f"{gid}:{cid}:married_to")
+            await self.ownership.remove(gid, cid)
+            cname = (self.char_manager.get_character_by_id(cid) or {}).get("name") or ""
             yield event.chain_result([
                 Comp.Reply(id=cmd_msg_id),
                 Comp.At(qq=event.get_sender_id()),
@@ -363,12 +635,13 @@ class CCB_Plugin(Star):
 
     @filter.command("交换")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("交换")
+    @gated
     async def handle_exchange(self, event: AstrMessageEvent, my_cid: str | int | None = None, other_cid: str | int | None = None):
         '''向其他用户发起交换请求'''
         event.call_llm = True
         gid = event.get_group_id() or "global"
         user_id = event.get_sender_id()
-        user_set = await self.get_user_list(gid)
         if my_cid is None or other_cid is None or not str(my_cid).strip().isdigit() or not str(other_cid).strip().isdigit():
             yield event.plain_result("用法：交换 <我的角色ID> <对方角色ID>")
             return
@@ -377,24 +650,24 @@ class CCB_Plugin(Star):
 
         # Validate ownership via char_marry to avoid stale local list
         my_claim_key = f"{gid}:{my_cid}:married_to"
-        my_uid = await self.get_kv_data(my_claim_key, None)
+        my_uid = await self.kv.get(my_claim_key, None)
         if not my_uid or str(my_uid) != str(user_id):
             yield event.plain_result("你并未与该角色结婚，无法交换。")
             return
 
         other_claim_key = f"{gid}:{other_cid}:married_to"
-        other_uid = await self.get_kv_data(other_claim_key, None)
+        other_uid = await self.kv.get(other_claim_key, None)
         if not other_uid or str(other_uid) == str(user_id):
             yield event.plain_result("对方角色未婚，无法交换。")
             return
 
-        if str(other_uid) not in user_set:
+        if not await self.is_group_member(event, other_uid):
             yield event.plain_result("对方角色已不在本群，无法交换。")
             return
 
         # Prefer existing claim data; avoid loading full character pool
-        my_cname = self.char_manager.get_character_by_id(my_cid).get("name") or str(my_cid)
-        other_cname = self.char_manager.get_character_by_id(other_cid).get("name") or str(other_cid)
+        my_cname = (self.char_manager.get_character_by_id(my_cid) or {}).get("name") or str(my_cid)
+        other_cname = (self.char_manager.get_character_by_id(other_cid) or {}).get("name") or str(other_cid)
 
         cq_message = [
             {"type": "reply", "data": {"id": str(event.message_obj.message_id)}},
@@ -403,44 +676,27 @@ class CCB_Plugin(Star):
             {"type": "at", "data": {"qq": other_uid}},
             {"type": "text", "data": {"text": "若同意，请给此条消息贴表情。"}},
         ]
-        try:
-            resp = await event.bot.api.call_action("send_group_msg", group_id=event.get_group_id(), message=cq_message)
+        call_action = event.bot.api.call_action
+        group_id = event.get_group_id()
+
+        async def on_sent(resp, error):
+            if error is not None:
+                logger.error({"stage": "exchange_prompt_send_error", "error": repr(error)})
+                self.outbound.submit(call_action, group_id, [
+                    {"type": "text", "data": {"text": "发送交换请求失败，请稍后再试。"}},
+                ])
+                return
             msg_id = resp.get("message_id") if isinstance(resp, dict) else None
             if msg_id is not None:
-                now_ts = time.time()
-                idx_key = f"{gid}:exchange_req_index"
-                idx = await self.get_kv_data(idx_key, [])
-                cutoff = now_ts - DRAW_MSG_TTL
-                new_idx = []
-                if isinstance(idx, list):
-                    for item in idx:
-                        if not isinstance(item, dict):
-                            continue
-                        ts_old = item.get("ts", 0)
-                        mid_old = item.get("id")
-                        if ts_old and ts_old < cutoff and mid_old:
-                            await self.delete_kv_data(f"{gid}:exchange_req:{mid_old}")
-                            continue
-                        new_idx.append(item)
-                    idx = new_idx[-(DRAW_MSG_INDEX_MAX - 1) :] if len(new_idx) >= DRAW_MSG_INDEX_MAX else new_idx
-                else:
-                    idx = []
-                idx.append({"id": msg_id, "ts": now_ts})
-                await self.put_kv_data(idx_key, idx)
-                await self.put_kv_data(
-                    f"{gid}:exchange_req:{msg_id}",
-                    {
-                        "from_uid": str(user_id),
-                        "to_uid": str(other_uid),
-                        "from_cid": str(my_cid),
-                        "to_cid": str(other_cid),
-                        "ts": time.time(),
-                    },
-                )
-        except Exception as e:
-            logger.error({"stage": "exchange_prompt_send_error", "error": repr(e)})
-            yield event.plain_result("发送交换请求失败，请稍后再试。")
-            return
+                # DRAW_MSG_TTL 秒内贴表情有效，到期自动丢弃
+                self.pending.add(gid, msg_id, "exchange", {
+                    "from_uid": str(user_id),
+                    "to_uid": str(other_uid),
+                    "from_cid": str(my_cid),
+                    "to_cid": str(other_cid),
+                })
+
+        self.outbound.submit(call_action, group_id, cq_message, on_sent)
 
     async def process_swap(self, event: AstrMessageEvent, req: dict, msg_id):
         event.call_llm = True
@@ -449,17 +705,17 @@ class CCB_Plugin(Star):
         to_uid = str(req.get("to_uid"))
         from_cid = str(req.get("from_cid"))
         to_cid = str(req.get("to_cid"))
-        user_set = await self.get_user_list(event.get_group_id())
+        # 成员检查可能访问 NapCat，放在锁外
+        if not (await self.is_group_member(event, from_uid) and await self.is_group_member(event, to_uid)):
+            return
         lock = self._get_group_lock(gid)
 
         async with lock:
-            if not (from_uid in user_set and to_uid in user_set):
-                return
 
             from_claim_key = f"{gid}:{from_cid}:married_to"
             to_claim_key = f"{gid}:{to_cid}:married_to"
-            from_marrried_to = await self.get_kv_data(from_claim_key, None)
-            to_marrried_to = await self.get_kv_data(to_claim_key, None)
+            from_marrried_to = await self.kv.get(from_claim_key, None)
+            to_marrried_to = await self.kv.get(to_claim_key, None)
 
             # Validate ownership
             if not (to_marrried_to and str(to_marrried_to) == to_uid):
@@ -469,17 +725,17 @@ class CCB_Plugin(Star):
                 yield event.plain_result("交换失败：你已不再拥有该角色。")
                 return
 
-            from_fav = await self.get_kv_data(f"{gid}:{from_uid}:fav", None)
-            to_fav = await self.get_kv_data(f"{gid}:{to_uid}:fav", None)
+            from_fav = await self.kv.get(f"{gid}:{from_uid}:fav", None)
+            to_fav = await self.kv.get(f"{gid}:{to_uid}:fav", None)
             if from_fav and str(from_fav) == from_cid:
-                await self.delete_kv_data(f"{gid}:{from_uid}:fav")
+                await self.kv.delete(f"{gid}:{from_uid}:fav")
             if to_fav and str(to_fav) == to_cid:
-                await self.delete_kv_data(f"{gid}:{to_uid}:fav")
+                await self.kv.delete(f"{gid}:{to_uid}:fav")
 
             from_list_key = f"{gid}:{from_uid}:partners"
             to_list_key = f"{gid}:{to_uid}:partners"
-            from_list = await self.get_kv_data(from_list_key, [])
-            to_list = await self.get_kv_data(to_list_key, [])
+            from_list = await self.kv.get(from_list_key, [])
+            to_list = await self.kv.get(to_list_key, [])
 
             if from_cid not in from_list or to_cid not in to_list:
                 logger.info({"stage": "exchange_fail_missing_role", "msg_id": msg_id})
@@ -490,11 +746,13 @@ class CCB_Plugin(Star):
             to_list = [m for m in to_list if m != to_cid]
             from_list.append(to_cid)
             to_list.append(from_cid)
-            await self.put_kv_data(from_list_key, from_list)
-            await self.put_kv_data(to_list_key, to_list)
+            await self.kv.put(from_list_key, from_list)
+            await self.kv.put(to_list_key, to_list)
 
-            await self.put_kv_data(to_claim_key, from_uid)
-            await self.put_kv_data(from_claim_key, to_uid)
+            await self.kv.put(to_claim_key, from_uid)
+            await self.kv.put(from_claim_key, to_uid)
+            await self.ownership.add(gid, from_uid, to_cid)
+            await self.ownership.add(gid, to_uid, from_cid)
             logger.info({
                 "stage": "exchange_success",
                 "msg_id": msg_id,
@@ -504,8 +762,8 @@ class CCB_Plugin(Star):
                 "to_cid": to_cid,
             })
 
-            from_cname = self.char_manager.get_character_by_id(from_cid).get("name") or str(from_cid)
-            to_cname = self.char_manager.get_character_by_id(to_cid).get("name") or str(to_cid)
+            from_cname = (self.char_manager.get_character_by_id(from_cid) or {}).get("name") or str(from_cid)
+            to_cname = (self.char_manager.get_character_by_id(to_cid) or {}).get("name") or str(to_cid)
             yield event.chain_result([
                 Comp.Reply(id=str(msg_id)),
                 Comp.At(qq=from_uid),
@@ -516,6 +774,8 @@ class CCB_Plugin(Star):
 
     @filter.command("最爱")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("最爱")
+    @gated
     async def handle_favorite(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''将指定角色设为最爱'''
         event.call_llm = True
@@ -526,13 +786,13 @@ class CCB_Plugin(Star):
             return
         cid = str(cid).strip()
         marry_list_key = f"{gid}:{user_id}:partners"
-        marry_list = await self.get_kv_data(marry_list_key, [])
+        marry_list = await self.kv.get(marry_list_key, [])
         target = next((m for m in marry_list if str(m) == str(cid)), None)
         if not target:
             yield event.plain_result("你尚未与该角色结婚！")
             return
-        cname = self.char_manager.get_character_by_id(cid).get("name") or ""
-        await self.put_kv_data(f"{gid}:{user_id}:fav", cid)
+        cname = (self.char_manager.get_character_by_id(cid) or {}).get("name") or ""
+        await self.kv.put(f"{gid}:{user_id}:fav", cid)
         msg_chain = [
             Comp.Plain("已将 "),
             Comp.Plain(cname or str(cid)),
@@ -545,9 +805,14 @@ class CCB_Plugin(Star):
 
     @filter.command("许愿")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("许愿")
+    @gated
     async def handle_wish(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''许愿指定角色，稍稍增加概率'''
         event.call_llm = True
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         gid = event.get_group_id() or "global"
         user_id = str(event.get_sender_id())
         config = await self.get_group_cfg(gid)
@@ -559,22 +824,15 @@ class CCB_Plugin(Star):
         if not char:
             yield event.plain_result(f"未找到ID为 {cid} 的角色")
             return
-        wish_list_key = f"{gid}:{user_id}:wish_list"
-        wish_list = await self.get_kv_data(wish_list_key, [])
-        if len(wish_list) >= config.get("harem_max_size", self.harem_max_size_default):
+        max_size = config.get("harem_max_size", self.harem_max_size_default)
+        if not await self.wishes.add(gid, user_id, cid, max_size):
             yield event.chain_result([
                 Comp.Reply(id=str(event.message_obj.message_id)),
                 Comp.Plain(f"愿望单已满"),
             ])
             return
-        if cid not in wish_list:
-            wish_list.append(cid)
-            await self.put_kv_data(wish_list_key, wish_list)
-        wished_by_key = f"{gid}:{cid}:wished_by"
-        wished_by = await self.get_kv_data(wished_by_key, [])
-        if user_id not in wished_by:
-            wished_by.append(user_id)
-            await self.put_kv_data(wished_by_key, wished_by)
+        # 许愿的角色随时可能抽到，提前缓存图片
+        self.image_cache.prefetch([char.get("image_url")])
         yield event.chain_result([
             Comp.Reply(id=str(event.message_obj.message_id)),
             Comp.Plain(f"已许愿 {char.get('name')}"),
@@ -582,14 +840,19 @@ class CCB_Plugin(Star):
 
     @filter.command("愿望单")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("愿望单")
+    @gated
     async def handle_wish_list(self, event: AstrMessageEvent):
         '''查看愿望单'''
         event.call_llm = True
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         gid = event.get_group_id() or "global"
         user_id = str(event.get_sender_id())
-        wish_list_key = f"{gid}:{user_id}:wish_list"
-        wish_list = await self.get_kv_data(wish_list_key, [])
-        if not wish_list:
+        # 整个愿望单的归属一次从本群归属索引中查出
+        statuses = await self.wishes.statuses(gid, user_id)
+        if not statuses:
             yield event.chain_result([
                 Comp.Reply(id=str(event.message_obj.message_id)),
                 Comp.At(qq=user_id),
@@ -597,8 +860,7 @@ class CCB_Plugin(Star):
             ])
             return
         lines = []
-        for cid in wish_list:
-            married_to = await self.get_kv_data(f"{gid}:{cid}:married_to", None)
+        for cid, married_to in statuses:
             char = self.char_manager.get_character_by_id(cid)
             if char is None:
                 continue
@@ -616,6 +878,8 @@ class CCB_Plugin(Star):
 
     @filter.command("删除许愿")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("删除许愿")
+    @gated
     async def handle_wish_clear(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''从愿望单中删除指定角色'''
         event.call_llm = True
@@ -625,17 +889,7 @@ class CCB_Plugin(Star):
             yield event.plain_result("用法：删除许愿 <角色ID>")
             return
         cid = str(cid).strip()
-        wish_list_key = f"{gid}:{user_id}:wish_list"
-        wish_list = await self.get_kv_data(wish_list_key, [])
-        wish_list = [x for x in wish_list if str(x) != cid]
-        await self.put_kv_data(wish_list_key, wish_list)
-        wished_by_key = f"{gid}:{cid}:wished_by"
-        wished_by = await self.get_kv_data(wished_by_key, [])
-        wished_by = [uid for uid in wished_by if str(uid) != user_id]
-        if wished_by:
-            await self.put_kv_data(wished_by_key, wished_by)
-        else:
-            await self.delete_kv_data(wished_by_key)
+        await self.wishes.remove(gid, user_id, cid)
         yield event.chain_result([
             Comp.Reply(id=str(event.message_obj.message_id)),
             Comp.Plain(f"已从愿望单移除"),
@@ -643,9 +897,14 @@ class CCB_Plugin(Star):
 
     @filter.command("查询")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("查询")
+    @gated
     async def handle_query(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''查询指定角色的信息'''
         event.call_llm = True
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         if cid is None:
             yield event.plain_result("用法：查询 <角色ID>")
             return
@@ -659,11 +918,10 @@ class CCB_Plugin(Star):
                 return
             async for res in self.print_character_info(event, char):
                 yield res
-                return
         else:
-            async for res in self.handle_search(event, cid_str):
+            # 不经过 搜索 的处理器：它同样按群排队，嵌套调用会再占一个名额
+            async for res in self._search(event, cid_str):
                 yield res
-                return
 
     async def print_character_info(self, event: AstrMessageEvent, char: dict):
         '''打印角色信息'''
@@ -679,10 +937,15 @@ class CCB_Plugin(Star):
         images = char.get("image") or []
         image_url = random.choice(images) if images else None
         gid = event.get_group_id() or "global"
-        married_to = await self.get_kv_data(f"{gid}:{char.get('id')}:married_to", None)
+        married_to = await self.kv.get(f"{gid}:{char.get('id')}:married_to", None)
         chain = [Comp.Plain(f"ID: {char.get('id')}\n{name}\n{gender_mark}\n热度: {heat}")]
         if image_url:
-            chain.append(Comp.Image.fromURL(image_url))
+            image_path = self.image_cache.lookup(image_url)
+            if image_path is not None:
+                chain.append(Comp.Image.fromFileSystem(str(image_path)))
+            else:
+                chain.append(Comp.Image.fromURL(image_url))
+                self.image_cache.prefetch([image_url])
         if married_to:
             chain.append(Comp.Plain("❤已与 "))
             chain.append(Comp.At(qq=married_to))
@@ -691,31 +954,39 @@ class CCB_Plugin(Star):
 
     @filter.command("搜索")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("搜索")
+    @gated
     async def handle_search(self, event: AstrMessageEvent, keyword: str | None = None):
         '''搜索角色'''
+        async for res in self._search(event, keyword):
+            yield res
+
+    async def _search(self, event: AstrMessageEvent, keyword: str | None):
+        '''搜索 与 查询 <名字> 共用的搜索逻辑，不按群排队'''
         event.call_llm = True
+        if not self._pool_ready() or not self.char_manager.search_ready:
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
         if not keyword:
             yield event.plain_result("用法：搜索 <角色名字/部分名字>")
             return
         keyword = str(keyword).strip()
-        matches = self.char_manager.search_characters_by_name(keyword)
+        matches = self.char_manager.search_characters_by_name(keyword, limit=SEARCH_RESULT_MAX + 1)
         if not matches:
             yield event.plain_result(f"未找到名称包含“{keyword}”的角色")
             return
         if len(matches) == 1:
-            char = matches[0]
-            async for res in self.print_character_info(event, char):
+            async for res in self.print_character_info(event, matches[0]):
                 yield res
-                return
-            return
         else:
-            top = matches[:10]
+            top = matches[:SEARCH_RESULT_MAX]
             lines = [f"{c.get('name')} (ID: {c.get('id')})" for c in top]
             more = "" if len(matches) <= len(top) else f"\n..."
             yield event.plain_result("\n".join(lines) + more)
 
     @filter.command("强制离婚")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("强制离婚")
     async def handle_force_divorce(self, event: AstrMessageEvent, cid: str | int | None = None):
         '''强制移除指定角色的婚姻，用于清除坏的数据（管理员专用）'''
         event.call_llm = True
@@ -728,25 +999,31 @@ class CCB_Plugin(Star):
             yield event.plain_result("用法：强制离婚 <角色ID>")
             return
         cid = int(str(cid).strip())
-        await self.delete_kv_data(f"{gid}:{cid}:married_to")
-
-        # 遍历用户列表检查坏数据
-        users = await self.get_kv_data(f"{gid}:user_list", [])
-        for uid in users:
-            partners_key = f"{gid}:{uid}:partners"
-            marry_list = await self.get_kv_data(partners_key, [])
-            if str(cid) in marry_list:
+        lock = self._get_group_lock(gid)
+        async with lock:
+            married_to = await self.kv.get(f"{gid}:{cid}:married_to", None)
+            await self.kv.delete(f"{gid}:{cid}:married_to")
+            # 通过归属索引和 married_to 直接定位持有者，不再遍历全群用户
+            owners = {str(married_to)} if married_to else set()
+            indexed = await self.ownership.remove(gid, cid)
+            if indexed is not None:
+                owners.add(indexed)
+            for uid in owners:
+                partners_key = f"{gid}:{uid}:partners"
+                marry_list = await self.kv.get(partners_key, [])
                 marry_list = [m for m in marry_list if m != str(cid)]
-                await self.put_kv_data(partners_key, marry_list)
-                fav = await self.get_kv_data(f"{gid}:{uid}:fav", None)
+                await self.kv.put(partners_key, marry_list)
+                self.harem_views.invalidate(gid, uid)
+                fav = await self.kv.get(f"{gid}:{uid}:fav", None)
                 if fav and str(fav) == str(cid):
-                    await self.delete_kv_data(f"{gid}:{uid}:fav")
+                    await self.kv.delete(f"{gid}:{uid}:fav")
 
         cname = (self.char_manager.get_character_by_id(cid) or {}).get("name") or cid
         yield event.plain_result(f"{cname} 已被强制解除婚约。")
 
     @filter.command("清理后宫")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("清理后宫")
     async def handle_clear_harem(self, event: AstrMessageEvent, uid: str | None = None):
         '''清理指定用户的后宫，最爱会被保留（管理员专用）'''
         event.call_llm = True
@@ -761,28 +1038,20 @@ class CCB_Plugin(Star):
                 yield event.plain_result("用法：清理后宫 <QQ号>")
                 return
             uid = str(uid).strip()
-            fav = await self.get_kv_data(f"{gid}:{uid}:fav", None)
-            marry_list = await self.get_kv_data(f"{gid}:{uid}:partners", [])
+            fav = await self.kv.get(f"{gid}:{uid}:fav", None)
+            marry_list = await self.kv.get(f"{gid}:{uid}:partners", [])
             if not marry_list:
-                await self.delete_kv_data(f"{gid}:{uid}:fav")
-                await self.delete_kv_data(f"{gid}:{uid}:partners")
+                await self.kv.delete(f"{gid}:{uid}:fav")
+                await self.kv.delete(f"{gid}:{uid}:partners")
+                await self.ownership.set_harem(gid, uid, [])
                 yield event.plain_result(f"{uid} 的后宫为空")
                 return
-            for cid in marry_list:
-                if str(cid) == str(fav):
-                    continue
-                await self.delete_kv_data(f"{gid}:{cid}:married_to")
-            if fav is None:
-                await self.delete_kv_data(f"{gid}:{uid}:partners")
-            elif fav not in marry_list:
-                await self.delete_kv_data(f"{gid}:{uid}:fav")
-                await self.delete_kv_data(f"{gid}:{uid}:partners")
-            else:
-                await self.put_kv_data(f"{gid}:{uid}:partners", [fav])
+            await self._clear_user_harem(gid, uid, fav, marry_list)
             yield event.plain_result(f"已清理 {uid} 的后宫")
 
     @filter.command("系统设置")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("系统设置")
     async def handle_config(self, event: AstrMessageEvent, feature: str | None = None, value: str | None = None):
         '''系统设置（管理员专用）'''
         event.call_llm = True
@@ -801,6 +1070,10 @@ class CCB_Plugin(Star):
             f"———后宫人数上限 | 当前值: {config.get('harem_max_size', self.harem_max_size_default)}",
             "系统设置 抽卡范围 [5000~20000]",
             f"———抽卡热度范围 | 当前值: {config.get('draw_scope', '无')}",
+            "系统设置 抽卡模式 [均匀/热度]",
+            f"———热度模式下热度越高越容易抽到 | 当前值: {'热度' if config.get('draw_mode') == DrawEngine.MODE_WEIGHTED else '均匀'}",
+            "系统设置 许愿加成 [1~50]",
+            f"———愿望单角色是普通角色的几倍概率 | 当前值: {config.get('wish_weight', WISH_WEIGHT_DEFAULT)}",
         ]
         if feature is None:
             yield event.chain_result([Comp.Plain("\n".join(menu_lines))])
@@ -856,11 +1129,32 @@ class CCB_Plugin(Star):
             config["draw_scope"] = scope
             await self.put_group_cfg(event.get_group_id(), config)
             yield event.plain_result(f"抽卡范围已设置为热度前{scope}")
+        elif feature == "抽卡模式":
+            modes = {"均匀": DrawEngine.MODE_UNIFORM, "热度": DrawEngine.MODE_WEIGHTED}
+            if value is None or str(value).strip() not in modes:
+                yield event.plain_result("用法：抽卡模式 [均匀/热度]")
+                return
+            config["draw_mode"] = modes[str(value).strip()]
+            await self.put_group_cfg(event.get_group_id(), config)
+            yield event.plain_result(f"抽卡模式已设置为{str(value).strip()}")
+        elif feature == "许愿加成":
+            if value is None or not str(value).strip().isdigit():
+                yield event.plain_result("用法：许愿加成 [1~50]")
+                return
+            weight = int(str(value).strip())
+            if weight < 1:
+                weight = 1
+            if weight > 50:
+                weight = 50
+            config["wish_weight"] = weight
+            await self.put_group_cfg(event.get_group_id(), config)
+            yield event.plain_result(f"许愿加成已设置为{weight}倍")
         else:
             yield event.chain_result([Comp.Plain("\n".join(menu_lines))]) 
 
     @filter.command("刷新")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("刷新")
     async def handle_refresh(self, event: AstrMessageEvent, user_id: str | None = None):
         '''刷新指定用户的抽卡和结婚冷却（群主和超管专用）'''
         event.call_llm = True
@@ -876,12 +1170,13 @@ class CCB_Plugin(Star):
             yield event.plain_result("用法：刷新 <QQ号>")
             return
         gid = event.get_group_id() or "global"
-        await self.delete_kv_data(f"{gid}:{user_id}:draw_status")
-        await self.delete_kv_data(f"{gid}:{user_id}:last_claim")
+        self.quota.reset(gid, user_id)
+        await self.kv.delete(f"{gid}:{user_id}:last_claim")
         yield event.plain_result("次数已重置，结婚冷却已清除")
 
     @filter.command("终极轮回")
     @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("终极轮回")
     async def handle_ultimate_reset(self, event: AstrMessageEvent, confirm: str | None = None):
         '''清除本群所有角色婚姻信息（除了最爱角色）（群主和超管专用）'''
         event.call_llm = True
@@ -895,27 +1190,205 @@ class CCB_Plugin(Star):
         gid = event.get_group_id() or "global"
         lock = self._get_group_lock(gid)
         async with lock:
-            users = await self.get_kv_data(f"{gid}:user_list", [])
-            for uid in users:
-                fav = await self.get_kv_data(f"{gid}:{uid}:fav", None)
-                marry_list = await self.get_kv_data(f"{gid}:{uid}:partners", [])
-                if not marry_list:
-                    await self.delete_kv_data(f"{gid}:{uid}:fav")
-                    await self.delete_kv_data(f"{gid}:{uid}:partners")
-                    continue
-                for cid in marry_list:
-                    if str(cid) == str(fav):
-                        continue
-                    await self.delete_kv_data(f"{gid}:{cid}:married_to")
-                if fav is None:
-                    await self.delete_kv_data(f"{gid}:{uid}:partners")
-                elif fav not in marry_list:
-                    await self.delete_kv_data(f"{gid}:{uid}:fav")
-                    await self.delete_kv_data(f"{gid}:{uid}:partners")
-                else:
-                    await self.put_kv_data(f"{gid}:{uid}:partners", [fav])
+            # 只处理索引中有后宫的用户，读取一次性批量完成，写入由 KV 缓存合并为一批
+            group = await self.ownership.group(gid)
+            owners = list(group.harems)
+            favs = await self.kv.get_many([f"{gid}:{uid}:fav" for uid in owners], None)
+            harems = await self.kv.get_many([f"{gid}:{uid}:partners" for uid in owners], [])
+            for uid in owners:
+                await self._clear_user_harem(
+                    gid, uid, favs[f"{gid}:{uid}:fav"], harems[f"{gid}:{uid}:partners"]
+                )
             yield event.plain_result("已清除本群所有角色婚姻信息")
 
+    @filter.command("修复索引")
+    @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("修复索引")
+    async def handle_repair_index(self, event: AstrMessageEvent):
+        '''从各用户后宫数据重建本群的角色归属索引（群主和超管专用）'''
+        event.call_llm = True
+        group_role = await self.get_group_role(event)
+        if group_role not in ['owner'] and str(event.get_sender_id()) not in self.super_admins:
+            yield event.plain_result("无权限执行此命令。")
+            return
+        gid = event.get_group_id() or "global"
+        lock = self._get_group_lock(gid)
+        async with lock:
+            group = await self.ownership.rebuild(gid)
+        yield event.plain_result(f"索引已重建：{len(group.harems)}位用户，{len(group.owner)}个角色")
+
+    @filter.command("导出存档")
+    @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("导出存档")
+    async def handle_export(self, event: AstrMessageEvent, fmt: str | None = None):
+        '''把本群的后宫、最爱、愿望单和群设置导出为存档文件（群主和超管专用）'''
+        event.call_llm = True
+        group_role = await self.get_group_role(event)
+        if group_role not in ['owner'] and str(event.get_sender_id()) not in self.super_admins:
+            yield event.plain_result("无权限执行此命令。")
+            return
+        gid = event.get_group_id() or "global"
+        try:
+            report = await self._export_group(gid, compress=str(fmt or "").strip().lower() == "gz")
+        except Exception as e:
+            logger.error({"stage": "export_failed", "gid": gid, "error": repr(e)})
+            yield event.plain_result("导出失败")
+            return
+        yield event.plain_result(
+            f"已导出：{report['users']}位用户，{report['characters']}个角色，{report['wishes']}条许愿\n"
+            f"文件：{Path(report['path']).name}"
+        )
+
+    @filter.command("导入存档")
+    @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("导入存档")
+    async def handle_import(self, event: AstrMessageEvent, name: str | None = None, confirm: str | None = None):
+        '''用存档文件替换本群的后宫、最爱、愿望单和群设置，不加“确认”时只校验（群主和超管专用）'''
+        event.call_llm = True
+        group_role = await self.get_group_role(event)
+        if group_role not in ['owner'] and str(event.get_sender_id()) not in self.super_admins:
+            yield event.plain_result("无权限执行此命令。")
+            return
+        if not name:
+            yield event.plain_result("请提供存档文件名，如：导入存档 <文件名>")
+            return
+        if not self._pool_ready():
+            yield event.plain_result(POOL_WARMING_TEXT)
+            return
+        # 只接受 exports 目录下的文件名，不允许带路径
+        path = self.export_dir / Path(str(name)).name
+        if not path.is_file():
+            yield event.plain_result("存档文件不存在")
+            return
+        gid = event.get_group_id() or "global"
+        known = lambda cid: self.char_manager.get_character_by_id(cid) is not None
+        apply = str(confirm) == "确认"
+        lock = self._get_group_lock(gid)
+        try:
+            async with lock:
+                if apply:
+                    current = set(await self.membership.users(gid)) | set((await self.ownership.group(gid)).harems)
+                    report = await self.archive.restore(gid, path, known, current)
+                    for uid in report["imported_users"]:
+                        self.membership.observe(gid, uid)
+                    if report["config"] is not None:
+                        self.group_cfgs[gid] = report["config"]
+                    self.wishes.invalidate_group(gid)
+                    await self.ownership.rebuild(gid)
+                else:
+                    report = await self.archive.load(gid, path, known)
+        except (ValueError, OSError) as e:
+            yield event.plain_result(f"存档无法读取：{e}")
+            return
+        except Exception as e:
+            logger.error({"stage": "import_failed", "gid": gid, "file": path.name, "apply": apply, "error": repr(e)})
+            yield event.plain_result("导入失败")
+            return
+        lines = [
+            f"{'已导入' if apply else '校验通过'}：{report['users']}位用户，{report['characters']}个角色，{report['wishes']}条许愿",
+        ]
+        if report.get("source_gid") != str(gid):
+            lines.append(f"存档来自群{report.get('source_gid')}")
+        if not report["complete"]:
+            lines.append("存档不完整（缺少结尾记录）")
+        if report["unknown_count"]:
+            lines.append(
+                f"卡池中不存在的角色{report['unknown_count']}个，已跳过："
+                + "、".join(report["unknown"][:UNKNOWN_ID_SAMPLE])
+            )
+        if report["duplicates"]:
+            lines.append(f"重复归属的角色{report['duplicates']}个，只保留第一位用户")
+        if not apply:
+            lines.append(f"确认无误后使用“导入存档 {path.name} 确认”替换本群当前数据")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("重载卡池")
+    @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("重载卡池")
+    async def handle_reload_pool(self, event: AstrMessageEvent, source: str | None = None):
+        '''重新拉取远程列表（或重读本地数据）并热替换卡池（超管专用）'''
+        event.call_llm = True
+        if str(event.get_sender_id()) not in self.super_admins:
+            yield event.plain_result("无权限执行此命令。")
+            return
+        remote = str(source or "").strip() != "本地"
+        try:
+            report = await self.char_manager.reload(remote=remote)
+        except Exception as e:
+            logger.error({"stage": "pool_reload_failed", "remote": remote, "error": repr(e)})
+            yield event.plain_result("卡池重载失败，已保留当前卡池")
+            return
+        logger.info({"stage": "pool_reloaded", **report})
+        self.metrics.observe_pool("reload", report["duration_ms"] / 1000)
+        lines = [
+            f"卡池已重载（{'远程' if remote else '本地'}，版本{report['version']}）：共{report['size']}个角色",
+            f"新增{report['added']}，下架{report['removed']}，改名{report['renamed']}，耗时{report['duration_ms']}ms",
+        ]
+        for label, key in (("新增", "added_sample"), ("下架", "removed_sample"), ("改名", "renamed_sample")):
+            if report[key]:
+                lines.append(f"{label}：" + "、".join(str(x) for x in report[key]))
+        if report["removed"]:
+            lines.append("已下架的角色仍保留在各自后宫中，但不会再被抽到或搜索到")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("统计")
+    @filter.event_message_type(filter.EventMessageType.GROUP_MESSAGE)
+    @metered("统计")
+    async def handle_stats(self, event: AstrMessageEvent):
+        '''显示指令耗时、存储/NapCat 调用、群锁等待和卡池加载统计（超管专用）'''
+        event.call_llm = True
+        if str(event.get_sender_id()) not in self.super_admins:
+            yield event.plain_result("无权限执行此命令。")
+            return
+        lines = self.metrics.summary(self.char_manager.refresh_stats)
+        outbound = self.outbound.stats()
+        lines.append(
+            f"发送队列：已发{outbound['sent']} 失败{outbound['failed']} 合并{outbound['merged']}"
+            f" 丢弃{outbound['dropped']} 平均延迟{outbound['latency_ewma_ms']}ms"
+        )
+        gate = self.gate.stats()
+        lines.append(f"群排队：当前{gate['busy_groups']}个群 等待{gate['waiting']} 累计排队{gate['queued']} 丢弃{gate['shed']}")
+        lines.append(f"群身份缓存：命中{self.members.hits} 未命中{self.members.misses}")
+        lines.append(f"图片缓存：命中{self.image_cache.hits} 未命中{self.image_cache.misses}")
+        yield event.plain_result("\n".join(lines))
+
+    async def _clear_user_harem(self, gid, uid, fav, marry_list):
+        '''清空用户后宫，只保留最爱角色'''
+        for cid in marry_list:
+            if str(cid) == str(fav):
+                continue
+            await self.kv.delete(f"{gid}:{cid}:married_to")
+        if fav is None:
+            await self.kv.delete(f"{gid}:{uid}:partners")
+            kept = []
+        elif fav not in marry_list:
+            await self.kv.delete(f"{gid}:{uid}:fav")
+            await self.kv.delete(f"{gid}:{uid}:partners")
+            kept = []
+        else:
+            await self.kv.put(f"{gid}:{uid}:partners", [fav])
+            kept = [fav]
+        await self.ownership.set_harem(gid, uid, kept)
+
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
+        await self.outbound.close()
+        await self.image_cache.close()
+        await self.char_manager.close()
+        await self.quota.close()
+        await self.pending.close()
+        self.membership.close()
+        await self.metrics.close()
+        for task in (self._snapshot_task, self._migrate_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        await self.kv.close()
+        if self.store is not None:
+            await self.store.close()
+        if self.http is not None:
+            await self.http.close()
 
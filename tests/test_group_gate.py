@@ -0,0 +1,138 @@
+import sys
+import asyncio
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "util"))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from group_gate import GroupGate, gated  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_release_hands_slot_to_queue_head_in_order():
+    async def main():
+        gate = GroupGate(limit=1)
+        assert await gate.acquire("g")
+        order = []
+
+        async def waiter(name):
+            await gate.acquire("g")
+            order.append(name)
+            await asyncio.sleep(0)
+            gate.release("g")
+
+        tasks = [asyncio.create_task(waiter(n)) for n in "abc"]
+        await asyncio.sleep(0)
+        assert gate.stats()["waiting"] == 3
+        gate.release("g")
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        assert gate.stats()["busy_groups"] == 0
+
+    run(main())
+
+
+def test_shed_only_when_requested():
+    async def main():
+        gate = GroupGate(limit=1, max_waiting=1)
+        assert await gate.acquire("g")
+        queued = asyncio.create_task(gate.acquire("g"))
+        await asyncio.sleep(0)
+        assert not await gate.acquire("g", shed=True)
+        kept = asyncio.create_task(gate.acquire("g"))
+        await asyncio.sleep(0)
+        assert gate.stats()["waiting"] == 2
+        gate.release("g")
+        assert await queued
+        gate.release("g")
+        assert await kept
+        gate.release("g")
+        assert gate.stats() == {"busy_groups": 0, "waiting": 0, "queued": 2, "shed": 1}
+
+    run(main())
+
+
+def test_shed_command_gets_busy_reply():
+    class Event:
+        call_llm = False
+
+        def get_group_id(self):
+            return "g"
+
+        def plain_result(self, text):
+            return ("plain", text)
+
+    class Handler:
+        def __init__(self):
+            self.gate = GroupGate(limit=1, max_waiting=0)
+            self.release = asyncio.Event()
+
+        @gated(shed="忙")
+        async def draw(self, event):
+            await self.release.wait()
+            yield ("plain", "ok")
+
+    async def main():
+        handler = Handler()
+        first = asyncio.create_task(drain_all(handler.draw(Event())))
+        await asyncio.sleep(0)
+        assert await drain_all(handler.draw(Event())) == [("plain", "忙")]
+        handler.release.set()
+        assert await first == [("plain", "ok")]
+
+    run(main())
+
+
+async def drain_all(gen):
+    return [item async for item in gen]
+
+
+def test_cancelled_waiter_passes_slot_on():
+    async def main():
+        gate = GroupGate(limit=1)
+        assert await gate.acquire("g")
+        first = asyncio.create_task(gate.acquire("g"))
+        second = asyncio.create_task(gate.acquire("g"))
+        await asyncio.sleep(0)
+        gate.release("g")  # 名额交给 first，但它在拿到之前被取消
+        first.cancel()
+        assert await second
+        gate.release("g")
+        assert gate.stats()["busy_groups"] == 0
+
+    run(main())
+
+
+def test_query_by_name_does_not_take_a_second_slot():
+    """查询 <名字> 走搜索逻辑时不能再占一个名额，否则名额持有者会互相等待"""
+    from fake_astrbot import FakeEvent, FakeNapCat, drain, make_plugin
+
+    async def main():
+        plugin, _ = make_plugin({"group_concurrency": 2, "image_cache_size_mb": 0})
+        plugin.char_manager._bundled = True
+        await plugin.char_manager.load_characters_async()
+        while not plugin.char_manager.search_ready:
+            await asyncio.sleep(0.01)
+        bot = FakeNapCat()
+        gid = "1"
+        lock = plugin._get_group_lock(gid)
+        await lock.lock.acquire()
+        # 两条离婚在 _get_group_lock 上占住名额，两条 查询 排队
+        divorces = [asyncio.create_task(drain(plugin.handle_divorce(FakeEvent(bot, gid, str(u)), "1"))) for u in (1, 2)]
+        queries = [asyncio.create_task(drain(plugin.handle_query(FakeEvent(bot, gid, str(u)), "红莉栖"))) for u in (3, 4)]
+        await asyncio.sleep(0.05)
+        lock.lock.release()
+        await asyncio.wait_for(asyncio.gather(*divorces, *queries), timeout=5)
+        later = await asyncio.wait_for(drain(plugin.handle_wish_list(FakeEvent(bot, gid, "5"))), timeout=5)
+        assert later
+        assert plugin.gate.stats()["busy_groups"] == 0
+        await plugin.outbound.close()
+        await plugin.kv.close()
+        await plugin.char_manager.close()
+        plugin.membership.close()
+
+    run(main())
@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "util"))
+
+from pool_artifact import build_artifact, open_artifact, validate_artifact  # noqa: E402
+from pool_store import PoolStore  # noqa: E402
+
+
+def char(cid, name, heat):
+    return {"id": cid, "name": name, "heat": heat, "image": [f"https://img/{name}.jpg"]}
+
+
+def test_collision_survives_round_trip(tmp_path):
+    chars = [char(1, "a", 30), char(2, "b", 20), char(1, "c", 10), char(3, "d", 5)]
+    path = tmp_path / "pool.bin"
+    build_artifact(chars, path, "json:test")
+    pool = open_artifact(path, "json:test")
+    expected = PoolStore(chars)
+
+    assert pool is not None
+    assert pool.duplicates == expected.duplicates == [2]
+    assert [pool.position(cid) for cid in (1, 2, 3)] == [0, 1, 3]
+    assert pool[pool.position(1)]["name"] == "a"
+    assert pool.position(4) is None
+    assert validate_artifact(path, chars) == []
+
+
+def test_no_collision_reports_nothing(tmp_path):
+    chars = [char(1, "a", 2), char(2, "b", 1)]
+    path = tmp_path / "pool.bin"
+    build_artifact(chars, path, "json:test")
+    pool = open_artifact(path)
+    assert pool.duplicates == []
+    assert [pool.position(cid) for cid in (1, 2)] == [0, 1]
@@ -1,32 +1,162 @@
 import json
-import random
+import os
+import time
+import hashlib
+import logging
 import aiohttp
 import asyncio
 from pathlib import Path
+from .id_registry import IdRegistry
+from .draw_engine import DrawEngine
+from .search_index import SearchIndex
+from .pool_store import PoolStore
+from .pool_artifact import MappedPool, build_artifact, open_artifact, source_tag, file_tag
+
+
+class CharacterPool:
+    """一个卡池版本：角色存储、抽卡引擎、搜索索引与ID冲突记录
+
+    构建完成后只读（搜索索引可能在换上后才补建，补建前为 None）。
+    CharacterManager 只持有一个 CharacterPool 引用，换池就是替换这个引用。
+    """
+
+    __slots__ = ("store", "engine", "search_index", "collisions", "version")
+
+    def __init__(self, store, engine: DrawEngine, search_index: SearchIndex | None, collisions: list, version: int = 0) -> None:
+        self.store = store
+        self.engine = engine
+        self.search_index = search_index
+        self.collisions = collisions
+        self.version = version
 
 
 class CharacterManager:
-    """使用 animewifex 图床数据源的角色管理器"""
+    """使用 animewifex 图床数据源的角色管理器
+
+    启动时只读本地快照（上次成功拉取的 list.txt），远程列表在后台刷新，有变化时整体替换卡池。
+    从未拉取成功过时先同步拉取一次，拉不到才退回随插件分发的 characters.json。
+    两者的角色ID不在同一个编号空间，退回后会记下这一点并一直使用 characters.json，
+    后台刷新不会自行切换，只有管理员“重载卡池”才会换到远程列表。
+    解析结果编译为二进制产物 pool.bin，数据源未变时下次启动直接 mmap 打开。
+    """
 
     # animewifex 图床配置
     IMAGE_BASE_URL = "https://cdn.jsdmirror.com/gh/monbed/wife@main"
     IMAGE_LIST_URL = "https://animewife.dpdns.org/list.txt"
 
-    def __init__(self) -> None:
-        self._characters: list[dict] | None = None
-        self._id_index: dict[int, dict] | None = None
+    # 随插件分发的 bangumi 角色数据
+    BUNDLED_PATH = Path(__file__).with_name("characters.json")
+    SNAPSHOT_NAME = "list.txt"
+    SNAPSHOT_META_NAME = "list_meta.json"
+    REGISTRY_NAME = "id_registry.json"
+    ARTIFACT_NAME = "pool.bin"
+    TOMBSTONE_NAME = "tombstones.json"
+    BUNDLED_MARKER_NAME = "pool_source.json"  # 存在时表示本群数据使用 characters.json 的ID
+    DIFF_SAMPLE = 10  # 重载报告里每类变化列出的角色数
+    REFRESH_INTERVAL = 6 * 3600  # seconds between background refreshes
+    LOAD_RETRY_INTERVAL = 60  # 加载失败后至少隔这么久才由指令触发下一次加载
+
+    # 卡池状态
+    STATE_LOADING = "loading"  # 尚无可用卡池，正在（或等待）加载
+    STATE_READY = "ready"
+    STATE_STALE = "stale"  # 卡池可用，但最近一次远程刷新失败
+    STATE_FAILED = "failed"  # 本地加载未得到任何角色，等待远程刷新或重试
+
+    def __init__(self, data_dir: str | Path | None = None, logger=None) -> None:
+        self.data_dir = Path(data_dir) if data_dir else None
+        self.logger = logger or logging.getLogger(__name__)
+        # 由插件在 initialize() 中注入共享会话，未注入时每次刷新临时创建
+        self.session: aiohttp.ClientSession | None = None
+        # 由插件注入的指标收集器（可选），记录刷新耗时
+        self.metrics = None
+        # 由插件注入：返回所有群里已被娶走的角色ID（异步），只有这些角色下架时才留墓碑；
+        # 返回 None 表示无法确定全部归属
+        self.owned_ids = None
+        self.refresh_stats = {
+            "attempts": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "not_modified": 0,
+            "failures": 0,
+            "last_error": None,
+            "last_duration_ms": None,
+            "last_success_ts": None,
+        }
+        self._pool: CharacterPool | None = None
+        self._pool_version = 0
+        self._reload_lock = asyncio.Lock()
+        # 已从卡池下架、但仍在某人后宫里的角色，仍可按ID查询，避免后宫里的角色凭空消失
+        self._tombstones = PoolStore((), base_url=self.IMAGE_BASE_URL)
+        self._heat_by_name: dict[str, int] | None = None
+        self._snapshot_meta: dict = {}
+        self._bundled = False  # 当前（及以后）是否使用 characters.json 的ID空间
+        self._refresh_task: asyncio.Task | None = None
+        self._load_task: asyncio.Task | None = None
+        self._first_fetch_task: asyncio.Task | None = None
+        self._search_task: asyncio.Task | None = None
+        self.state = self.STATE_LOADING
+        self._failed_at = 0.0
+        self._registry = IdRegistry(self.data_dir / self.REGISTRY_NAME if self.data_dir else None)
+
+    @property
+    def id_collisions(self) -> list[dict]:
+        return self._pool.collisions if self._pool is not None else []
+
+    @property
+    def pool_version(self) -> int:
+        return self._pool.version if self._pool is not None else 0
+
+    @property
+    def _snapshot_path(self) -> Path | None:
+        return self.data_dir / self.SNAPSHOT_NAME if self.data_dir else None
+
+    @property
+    def _snapshot_meta_path(self) -> Path | None:
+        return self.data_dir / self.SNAPSHOT_META_NAME if self.data_dir else None
 
-    async def _fetch_image_list(self) -> list[str]:
-        """从远程获取图片列表"""
+    async def _fetch_image_list(self, conditional: bool = True) -> tuple[list[str], str, dict] | None:
+        """（条件）请求远程图片列表并逐行解析，返回 (列表, sha1, 缓存校验头)；未变化（304）时返回 None
+
+        校验头（ETag/Last-Modified）不在这里记下，由调用方在新列表成功换上后再保存，
+        否则换池失败后后续的条件请求会一直得到 304。
+        网络错误和非 200/304 状态码直接抛出，由调用方记录。
+        """
+        headers = {}
+        if conditional and self._snapshot_meta.get("etag"):
+            headers["If-None-Match"] = self._snapshot_meta["etag"]
+        if conditional and self._snapshot_meta.get("last_modified"):
+            headers["If-Modified-Since"] = self._snapshot_meta["last_modified"]
+        session = self.session
+        own_session = session is None or session.closed
+        if own_session:
+            from .http import create_session
+            session = create_session(limit=1)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(self.IMAGE_LIST_URL) as resp:
-                    if resp.status == 200:
-                        text = await resp.text()
-                        return [line.strip() for line in text.splitlines() if line.strip()]
-        except Exception:
-            pass
-        return []
+            async with session.get(self.IMAGE_LIST_URL, headers=headers) as resp:
+                if resp.status == 304:
+                    return None
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status, message=resp.reason or ""
+                    )
+                lines = []
+                digest = hashlib.sha1()
+                async for raw in resp.content:
+                    line = raw.decode("utf-8", errors="replace").strip()
+                    if not line:
+                        continue
+                    if lines:
+                        digest.update(b"\n")
+                    digest.update(line.encode("utf-8"))
+                    lines.append(line)
+                validators = {
+                    "etag": resp.headers.get("ETag"),
+                    "last_modified": resp.headers.get("Last-Modified"),
+                }
+                return lines, digest.hexdigest(), validators
+        finally:
+            if own_session:
+                await session.close()
 
     def _parse_character(self, filepath: str) -> dict | None:
         """解析图片路径为角色数据
@@ -36,21 +166,23 @@ class CharacterManager:
             # 移除路径前缀和扩展名
             filename = filepath.split("/")[-1]
             name_part = filename.rsplit(".", 1)[0]  # 移除扩展名
-            
+
             if "!" in name_part:
                 source, char_name = name_part.split("!", 1)
             else:
                 source = "未知作品"
                 char_name = name_part
-            
-            # 生成唯一ID（基于文件名哈希）
-            char_id = hash(filepath) % 10000000
-            
+
+            # 稳定ID：已登记的路径沿用原ID，新路径按内容哈希分配
+            char_id = self._registry.get_id(filepath)
+            image_url = f"{self.IMAGE_BASE_URL}/{filepath}"
+
             return {
                 "id": char_id,
                 "name": char_name,
                 "source": source,  # 作品名
-                "image_url": f"{self.IMAGE_BASE_URL}/{filepath}",
+                "image_url": image_url,
+                "image": [image_url],
                 "filepath": filepath,
                 "gender": "女",  # 默认为女性角色
                 "heat": 0
@@ -58,69 +190,500 @@ class CharacterManager:
         except Exception:
             return None
 
-    async def load_characters_async(self) -> list[dict]:
-        """异步加载角色数据"""
-        if self._characters is None:
-            file_list = await self._fetch_image_list()
-            self._characters = []
-            for filepath in file_list:
-                char = self._parse_character(filepath)
-                if char:
-                    self._characters.append(char)
-            
-            # 构建ID索引
-            self._id_index = {
-                c.get("id"): c
-                for c in self._characters
-                if isinstance(c, dict) and c.get("id") is not None
-            }
-        return self._characters
+    def _parse_bundled(self, item: dict) -> dict | None:
+        """解析 characters.json 中的一条 bangumi 角色数据"""
+        try:
+            images = item.get("image") or []
+            char = dict(item)
+            char["id"] = int(item["id"])
+            char["image"] = images
+            char["image_url"] = images[0] if images else None
+            return char
+        except Exception:
+            return None
 
-    def load_characters(self) -> list[dict]:
-        """同步加载（用于初始化）"""
-        if self._characters is None:
-            # 尝试异步加载，如果失败则返回空列表
+    def _read_bundled(self) -> list:
+        try:
+            with open(self.BUNDLED_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return []
+        return data if isinstance(data, list) else []
+
+    def _bundled_heat(self) -> dict[str, int]:
+        """characters.json 中 名字/别名 → 热度，用于给远程列表的角色补热度"""
+        if self._heat_by_name is None:
+            heat_by_name = {}
+            for item in self._read_bundled():
+                heat = int(item.get("heat") or 0)
+                for key in (item.get("name"), item.get("alias")):
+                    if key and heat > heat_by_name.get(key, 0):
+                        heat_by_name[key] = heat
+            self._heat_by_name = heat_by_name
+        return self._heat_by_name
+
+    def _build_from_list(self, file_list: list[str]) -> list[dict]:
+        heat_by_name = self._bundled_heat()
+        chars = []
+        for filepath in file_list:
+            char = self._parse_character(filepath)
+            if char:
+                char["heat"] = heat_by_name.get(char["name"], 0)
+                chars.append(char)
+        self._registry.save()
+        return chars
+
+    def _compile(self, chars: list[dict], tag: str | None):
+        """把解析结果编译为 pool.bin 并 mmap 打开；无数据目录或写入失败时原样返回"""
+        if self.data_dir is None or tag is None or not chars:
+            return chars
+        path = self.data_dir / self.ARTIFACT_NAME
+        try:
+            build_artifact(chars, path, tag, base_url=self.IMAGE_BASE_URL)
+        except Exception as e:
+            self.logger.warning({"stage": "pool_artifact_write_failed", "error": repr(e)})
+            return chars
+        return open_artifact(path, tag) or chars
+
+    def _open_compiled(self, tag: str | None) -> MappedPool | None:
+        if self.data_dir is None or tag is None:
+            return None
+        pool = open_artifact(self.data_dir / self.ARTIFACT_NAME, tag)
+        return pool if pool is not None and len(pool) else None
+
+    @property
+    def _bundled_marker_path(self) -> Path | None:
+        return self.data_dir / self.BUNDLED_MARKER_NAME if self.data_dir else None
+
+    def _set_bundled(self, bundled: bool) -> None:
+        """记录是否使用 characters.json 的ID空间，跨重启保留"""
+        self._bundled = bundled
+        path = self._bundled_marker_path
+        if path is None:
+            return
+        if bundled:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps({"source": "bundled"}), encoding="utf-8")
+        else:
+            path.unlink(missing_ok=True)
+
+    def _load_bundled(self):
+        """读取随插件分发的 characters.json，并记下此后一直使用它的ID"""
+        if not self._bundled:
+            self._set_bundled(True)
+        try:
+            tag = file_tag(self.BUNDLED_PATH)
+        except OSError:
+            tag = None
+        pool = self._open_compiled(tag)
+        if pool is not None:
+            return pool
+        chars = []
+        for item in self._read_bundled():
+            char = self._parse_bundled(item)
+            if char:
+                chars.append(char)
+        return self._compile(chars, tag)
+
+    def _load_local(self):
+        """读取本地数据：已改用 characters.json 时读它，否则读远程列表的本地快照
+
+        都没有时返回 None（从未拉取成功过远程列表）。
+        数据源与 pool.bin 的来源标记一致时直接返回 mmap 打开的产物。
+        """
+        marker = self._bundled_marker_path
+        if self._bundled or (marker is not None and marker.is_file()):
+            self._bundled = True
+            return self._load_bundled()
+        snapshot = self._snapshot_path
+        meta_path = self._snapshot_meta_path
+        if snapshot is not None and snapshot.is_file():
             try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    # 如果事件循环正在运行，创建新任务
-                    future = asyncio.ensure_future(self.load_characters_async())
-                    # 等待结果（可能会阻塞，但初始化时应该没问题）
-                    import concurrent.futures
-                    with concurrent.futures.ThreadPoolExecutor() as pool:
-                        self._characters = pool.submit(asyncio.run, self.load_characters_async()).result()
-                else:
-                    self._characters = loop.run_until_complete(self.load_characters_async())
+                if meta_path.is_file():
+                    self._snapshot_meta = json.loads(meta_path.read_text(encoding="utf-8")) or {}
+                digest = self._snapshot_meta.get("sha1")
+                tag = source_tag("list", digest) if digest else None
+                pool = self._open_compiled(tag)
+                if pool is not None:
+                    return pool
+                lines = snapshot.read_text(encoding="utf-8").splitlines()
+                chars = self._build_from_list([line.strip() for line in lines if line.strip()])
+                if chars:
+                    return self._compile(chars, tag)
             except Exception:
-                self._characters = []
-        return self._characters
+                self._snapshot_meta = {}
+        return None
+
+    def _save_snapshot(self, file_list: list[str] | None) -> None:
+        """原子写入 list.txt 快照及其 ETag/Last-Modified 元数据，file_list 为 None 时只更新元数据"""
+        if self.data_dir is None:
+            return
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        files = [(self._snapshot_meta_path, json.dumps(self._snapshot_meta, ensure_ascii=False))]
+        if file_list is not None:
+            files.insert(0, (self._snapshot_path, "\n".join(file_list) + "\n"))
+        for path, content in files:
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(content, encoding="utf-8")
+            os.replace(tmp, path)
+
+    def _build_indexes(self, chars, with_search: bool = True) -> CharacterPool:
+        """压缩为列式卡池（已是 PoolStore/MappedPool 时直接使用）并构建抽卡引擎与搜索索引（在线程中运行）
+
+        with_search 为 False 时不建搜索索引，由 _swap 之后在后台补建。
+        """
+        if isinstance(chars, (PoolStore, MappedPool)):
+            store = chars
+        else:
+            store = PoolStore(
+                (c for c in chars if isinstance(c, dict) and c.get("id") is not None),
+                base_url=self.IMAGE_BASE_URL,
+            )
+        collisions = list(self._registry.collisions)
+        for pos in store.duplicates:
+            cid = store.ids[pos]
+            collisions.append({
+                "id": cid,
+                "key": store[pos].get("name"),
+                "existing": store[store.position(cid)].get("name"),
+            })
+        engine = DrawEngine(store)
+        search_index = SearchIndex(store, engine.order) if with_search else None
+        return CharacterPool(store, engine, search_index, collisions)
+
+    def _swap(self, pool: CharacterPool) -> None:
+        """换上新卡池：只替换一个引用，查询接口每次只读一次引用，不会看到新旧混杂的索引"""
+        self._pool_version += 1
+        pool.version = self._pool_version
+        self._pool = pool
+        if len(pool.store):
+            self.state = self.STATE_READY
+        if pool.search_index is None and len(pool.store):
+            self._search_task = asyncio.create_task(self._build_search_index(pool))
+
+    async def _build_search_index(self, pool: CharacterPool) -> None:
+        pool.search_index = await asyncio.to_thread(SearchIndex, pool.store, pool.engine.order)
+
+    @property
+    def search_ready(self) -> bool:
+        """搜索索引是否已建好（启动时在卡池就绪后后台构建）"""
+        return self._pool is not None and self._pool.search_index is not None
 
-    def get_random_character(self, limit=None):
-        """随机获取一个角色"""
-        chars = self.load_characters()
-        if not chars:
+    def _diff(self, old, new) -> dict:
+        """比较两个卡池版本，返回新增/下架/改名的角色（在线程中运行）"""
+        added, removed, renamed = [], [], []
+        if old is not None:
+            for pos, cid in enumerate(old.ids):
+                new_pos = new.position(cid)
+                if new_pos is None:
+                    removed.append(old[pos])
+                elif old.field(pos, "name") != new.field(new_pos, "name"):
+                    renamed.append((old[pos], new[new_pos]))
+        for pos, cid in enumerate(new.ids):
+            if old is None or old.position(cid) is None:
+                added.append(new[pos])
+        return {"added": added, "removed": removed, "renamed": renamed}
+
+    def _tombstone_path(self) -> Path | None:
+        return self.data_dir / self.TOMBSTONE_NAME if self.data_dir else None
+
+    def _load_tombstones(self) -> None:
+        path = self._tombstone_path()
+        if path is None or not path.is_file():
+            return
+        try:
+            data = json.loads(path.read_text(encoding="utf-8")) or []
+        except Exception:
+            return
+        self._tombstones = PoolStore(
+            (c for c in data if isinstance(c, dict) and "id" in c), base_url=self.IMAGE_BASE_URL
+        )
+
+    def _update_tombstones(self, diff: dict, store, owned: set[int] | None) -> None:
+        """把仍在后宫里的下架角色记为墓碑，重新上架或已无人拥有的角色移出墓碑（在线程中运行）
+
+        owned 为 None（未注入 owned_ids 或它无法确定全部归属）时保留全部下架角色。
+        """
+        old = self._tombstones
+        tombstones = {}
+        for char in [old[pos] for pos in range(len(old))] + diff["removed"]:
+            cid = int(char["id"])
+            if store.position(cid) is None and (owned is None or cid in owned):
+                tombstones.setdefault(cid, char)
+        if tombstones.keys() == set(old.ids):
+            return
+        chars = [dict(c) for c in tombstones.values()]
+        path = self._tombstone_path()
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(json.dumps(chars, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        self._tombstones = PoolStore(chars, base_url=self.IMAGE_BASE_URL)
+
+    def _report(self, diff: dict, pool: CharacterPool, source: str, start: float) -> dict:
+        n = self.DIFF_SAMPLE
+        return {
+            "source": source,
+            "version": pool.version,
+            "size": len(pool.store),
+            "added": len(diff["added"]),
+            "removed": len(diff["removed"]),
+            "renamed": len(diff["renamed"]),
+            "added_sample": [c.get("name") for c in diff["added"][:n]],
+            "removed_sample": [c.get("name") for c in diff["removed"][:n]],
+            "renamed_sample": [f"{a.get('name')}→{b.get('name')}" for a, b in diff["renamed"][:n]],
+            "tombstones": len(self._tombstones),
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    async def _install(self, chars, source: str, start: float) -> dict:
+        """在线程中建好新卡池的全部索引并与当前卡池比较，然后一次性换上，返回变化报告"""
+        old = self._pool.store if self._pool is not None else None
+        owned = None
+        ids = await self.owned_ids() if self.owned_ids is not None else None
+        if ids is not None:
+            owned = set()
+            for cid in ids:
+                try:
+                    owned.add(int(cid))
+                except (TypeError, ValueError):
+                    pass
+
+        def build():
+            pool = self._build_indexes(chars)
+            diff = self._diff(old, pool.store)
+            self._update_tombstones(diff, pool.store, owned)
+            return pool, diff
+
+        pool, diff = await asyncio.to_thread(build)
+        self._swap(pool)
+        return self._report(diff, pool, source, start)
+
+    @property
+    def ready(self) -> bool:
+        """卡池是否可用（ready 或 stale）"""
+        return self.state in (self.STATE_READY, self.STATE_STALE)
+
+    async def _load_local_pool(self) -> None:
+        def load():
+            self._load_tombstones()
+            chars = self._load_local()
+            # 启动时先让抽卡可用，搜索索引在换上卡池后再建
+            return self._build_indexes(chars, with_search=False) if chars is not None else None
+
+        try:
+            pool = await asyncio.to_thread(load)
+        except Exception as e:
+            self.logger.error({"stage": "pool_load_failed", "error": repr(e)})
+            self._fail()
+            return
+        if self.ready:
+            return  # 加载期间远程刷新已经换上了卡池
+        if pool is None:
+            # 从未拉取成功过远程列表：在后台拉一次，期间保持加载中状态，不阻塞启动
+            self._first_fetch_task = asyncio.create_task(self._first_fetch())
+        elif len(pool.store):
+            self._swap(pool)
+        else:
+            self._fail()
+
+    async def _first_fetch(self) -> None:
+        """首次拉取远程列表，拉不到才退回 characters.json（之后一直使用它的ID）"""
+        try:
+            await self.refresh_remote(force=True)
+        except Exception as e:
+            self.logger.warning({"stage": "pool_first_fetch_failed", "url": self.IMAGE_LIST_URL, "error": repr(e)})
+        if self.ready:
+            return
+        try:
+            pool = await asyncio.to_thread(lambda: self._build_indexes(self._load_bundled(), with_search=False))
+        except Exception as e:
+            self.logger.error({"stage": "pool_load_failed", "error": repr(e)})
+            pool = None
+        if self.ready:
+            return
+        if pool and len(pool.store):
+            self.logger.warning({"stage": "pool_using_bundled", "size": len(pool.store)})
+            self._swap(pool)
+        else:
+            self._fail()
+
+    def _fail(self) -> None:
+        self.state = self.STATE_FAILED
+        self._failed_at = time.monotonic()
+
+    @property
+    def _fetching_first(self) -> bool:
+        return self._first_fetch_task is not None and not self._first_fetch_task.done()
+
+    def ensure_loading(self) -> None:
+        """未就绪时在后台启动一次加载；已有加载在进行、或上次失败不久时什么也不做"""
+        if self.ready or self._fetching_first or (self._load_task is not None and not self._load_task.done()):
+            return
+        if self.state == self.STATE_FAILED and time.monotonic() - self._failed_at < self.LOAD_RETRY_INTERVAL:
+            return
+        self.state = self.STATE_LOADING
+        self._load_task = asyncio.create_task(self._load_local_pool())
+
+    async def load_characters_async(self) -> list[dict]:
+        """异步加载角色数据（只读本地，不访问网络），并发调用共享同一次加载
+
+        本地没有任何数据时返回空结果，首次拉取在后台进行，完成前卡池处于加载中状态。
+        """
+        if not self.ready:
+            self.ensure_loading()
+            await asyncio.shield(self._load_task)
+        return self.characters
+
+    @property
+    def characters(self):
+        """当前卡池的角色序列（只读），未就绪时为空"""
+        return self._pool.store if self._pool is not None else ()
+
+    async def refresh_remote(self, force: bool = False) -> dict | None:
+        """拉取远程列表，内容有变化时保存快照并替换卡池，返回变化报告；未变化返回 None
+
+        force 为 True 时不发条件请求、不比较摘要，总是重建卡池。失败时保留当前卡池并抛出。
+        正在使用 characters.json 时，非强制的刷新不会切换到远程列表的ID空间。
+        """
+        if self._bundled and not force:
             return None
-        if limit and isinstance(limit, int) and limit > 0:
-            chars = chars[:limit]
-        return random.choice(chars)
+        start = time.perf_counter()
+        fetched = await self._fetch_image_list(conditional=not force)
+        if fetched is None:
+            self.refresh_stats["not_modified"] += 1
+            return None
+        file_list, digest, validators = fetched
+        if not file_list:
+            raise ValueError("remote list is empty")
+        if not force and digest == self._snapshot_meta.get("sha1") and self._pool is not None:
+            # 内容与已换上的列表相同，可以放心记下新的校验头
+            self._snapshot_meta.update(validators)
+            await asyncio.to_thread(self._save_snapshot, None)
+            self.refresh_stats["unchanged"] += 1
+            return None
+        async with self._reload_lock:
+            chars = await asyncio.to_thread(self._build_from_list, file_list)
+            if not chars:
+                raise ValueError("remote list has no parsable entries")
+            chars = await asyncio.to_thread(self._compile, chars, source_tag("list", digest))
+            report = await self._install(chars, "remote", start)
+            # 换池成功后才记下摘要、校验头和快照，中途失败时下次仍会完整拉取
+            self._snapshot_meta.update(validators, sha1=digest)
+            await asyncio.to_thread(self._save_snapshot, file_list)
+            if self._bundled:
+                await asyncio.to_thread(self._set_bundled, False)
+        self.refresh_stats["updated"] += 1
+        return report
+
+    async def reload(self, remote: bool = True) -> dict:
+        """热重载卡池：新版本在后台建好全部索引后一次性换上，返回新增/下架/改名报告
+
+        remote 为 True 时强制重新拉取远程列表（正在使用 characters.json 时由此切换到远程列表），
+        否则重新读取本地快照/characters.json。
+        失败时保留当前卡池并抛出。
+        """
+        if remote:
+            return await self.refresh_remote(force=True)
+        start = time.perf_counter()
+        async with self._reload_lock:
+            chars = await asyncio.to_thread(self._load_local)
+            if not chars:
+                raise ValueError("local pool is empty")
+            return await self._install(chars, "local", start)
+
+    async def refresh_once(self) -> bool:
+        """执行一次刷新并记录耗时/结果，不抛出异常"""
+        stats = self.refresh_stats
+        stats["attempts"] += 1
+        start = time.perf_counter()
+        try:
+            report = await self.refresh_remote()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats["failures"] += 1
+            stats["last_error"] = repr(e)
+            if self.state == self.STATE_READY:
+                self.state = self.STATE_STALE
+            self.logger.warning({
+                "stage": "pool_refresh_failed",
+                "url": self.IMAGE_LIST_URL,
+                "error": repr(e),
+                "failures": stats["failures"],
+                "pool_size": len(self.characters),
+            })
+            return False
+        finally:
+            elapsed = time.perf_counter() - start
+            stats["last_duration_ms"] = round(elapsed * 1000, 1)
+            if self.metrics is not None:
+                self.metrics.observe_pool("refresh", elapsed)
+        stats["last_success_ts"] = time.time()
+        stats["last_error"] = None
+        if self.state == self.STATE_STALE:
+            self.state = self.STATE_READY
+        if report is not None:
+            self.logger.info({"stage": "pool_refreshed", **report})
+        return report is not None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            if not self._fetching_first:  # 首次拉取还在进行，不重复请求
+                await self.refresh_once()
+            await asyncio.sleep(self.REFRESH_INTERVAL)
+
+    def start_background_refresh(self) -> None:
+        """启动后台刷新任务"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        """停止后台刷新和加载任务"""
+        for task in (self._refresh_task, self._load_task, self._first_fetch_task, self._search_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._refresh_task = self._load_task = self._first_fetch_task = self._search_task = None
+
+    # 以下查询接口都是同步且不阻塞的：卡池未就绪时返回空结果，调用方应先检查 ready
+
+    def get_random_character(self, limit=None, mode: str = DrawEngine.MODE_UNIFORM):
+        """从热度前 limit 名中随机获取一个角色，mode 为 weighted 时按热度加权"""
+        pool = self._pool
+        if pool is None:
+            return None
+        return pool.engine.draw(limit, mode)
+
+    def top_characters(self, n: int) -> list:
+        """热度最高的 n 个角色"""
+        pool = self._pool
+        if pool is None:
+            return []
+        return pool.engine.top(n)
 
     def get_character_by_id(self, id):
-        """根据ID获取角色"""
+        """根据ID获取角色，已下架的角色返回带 removed 标记的墓碑"""
         try:
             cid = int(id)
-            if self._id_index is None:
-                self.load_characters()
-            return self._id_index.get(cid)
-        except:
+        except (TypeError, ValueError):
             return None
+        pool = self._pool
+        pos = pool.store.position(cid) if pool is not None else None
+        if pos is not None:
+            return pool.store[pos]
+        # 已下架的角色以墓碑形式保留，带 removed 标记
+        tombstones = self._tombstones
+        pos = tombstones.position(cid)
+        return {**tombstones[pos], "removed": True} if pos is not None else None
 
-    def search_characters_by_name(self, keyword: str) -> list[dict]:
-        """根据角色名搜索"""
-        if not keyword:
+    def search_characters_by_name(self, keyword: str, limit: int | None = None) -> list[dict]:
+        """根据角色名/别名/作品名搜索，按匹配程度和热度排序"""
+        pool = self._pool
+        if not keyword or pool is None or pool.search_index is None:
             return []
-        key_lower = str(keyword).lower()
-        chars = self.load_characters()
-        if not chars:
-            return []
-        return [c for c in chars if key_lower in str(c.get("name", "")).lower()]
-
+        return pool.search_index.search(keyword, limit)
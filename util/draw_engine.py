@@ -0,0 +1,89 @@
+import random
+from array import array
+
+
+class AliasTable:
+    """Walker/Vose 别名表，O(1) 按权重抽样"""
+
+    __slots__ = ("n", "prob", "alias")
+
+    def __init__(self, weights) -> None:
+        n = len(weights)
+        self.n = n
+        self.prob = array("d", [1.0]) * n
+        self.alias = array("i", [0]) * n
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            return
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余项因浮点误差留下，概率视为 1
+
+    def sample(self) -> int:
+        i = random.randrange(self.n)
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+class DrawEngine:
+    """按热度降序排好的卡池，支持“热度前N”的均匀或按热度加权抽取
+
+    只保存按热度排序后的下标数组；均匀抽取只取一个随机下标，不复制卡池；
+    加权抽取按范围缓存别名表。
+    """
+
+    MODE_UNIFORM = "uniform"
+    MODE_WEIGHTED = "weighted"
+    MAX_CACHED_TABLES = 16
+
+    def __init__(self, store) -> None:
+        self._store = store
+        heat = store.heat
+        # sorted 是稳定排序，热度相同的角色保持数据源顺序
+        self._order = array("i", sorted(range(len(store)), key=lambda p: -heat[p]))
+        self._heat = array("i", (heat[p] for p in self._order))
+        self._tables: dict[int, AliasTable] = {}
+
+    @property
+    def order(self) -> array:
+        """按热度降序排列的卡池下标（只读）"""
+        return self._order
+
+    def top(self, n: int) -> list:
+        """热度最高的 n 个角色"""
+        return [self._store[p] for p in self._order[:n]]
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _scope(self, limit) -> int:
+        n = len(self._order)
+        if limit and isinstance(limit, int) and 0 < limit < n:
+            return limit
+        return n
+
+    def _table(self, scope: int) -> AliasTable:
+        table = self._tables.get(scope)
+        if table is None:
+            if len(self._tables) >= self.MAX_CACHED_TABLES:
+                self._tables.pop(next(iter(self._tables)))
+            # +1 平滑，热度为 0 的卡池退化为均匀抽取
+            table = AliasTable([h + 1 for h in self._heat[:scope]])
+            self._tables[scope] = table
+        return table
+
+    def draw(self, limit=None, mode: str = MODE_UNIFORM):
+        """从热度前 limit 名中抽取一个角色"""
+        scope = self._scope(limit)
+        if scope == 0:
+            return None
+        if mode == self.MODE_WEIGHTED:
+            return self._store[self._order[self._table(scope).sample()]]
+        return self._store[self._order[random.randrange(scope)]]
@@ -0,0 +1,203 @@
+import gzip
+import json
+import time
+import asyncio
+from pathlib import Path
+
+FORMAT = "ccb-group"
+VERSION = 1
+
+
+def _open(path: Path, mode: str):
+    """按扩展名决定是否 gzip 压缩，行缓冲写文本"""
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    return open(path, mode, encoding="utf-8")
+
+
+class GroupArchive:
+    """群存档的流式导出/导入（JSONL，可选 gzip）
+
+    每行一条记录：header（群号、时间、卡池版本）、config、每个用户一条 user
+    （后宫、最爱、愿望单），最后是 footer（用户数、角色数）。导出按批读取用户、
+    按批在线程中写文件；导入逐行读取、攒够一批写入一次并写回存储，内存里只保留
+    当前这一批和愿望单的反向索引。
+    """
+
+    def __init__(self, kv, batch: int = 200) -> None:
+        self.kv = kv
+        self.batch = batch
+
+    async def export(self, gid, users, path: str | Path, pool_version: int = 0) -> dict:
+        """导出一个群到 path（.gz 结尾时压缩），先写临时文件再改名"""
+        gid = str(gid)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp" + (".gz" if path.suffix == ".gz" else ""))
+        users = sorted({str(u) for u in users})
+        out = await asyncio.to_thread(_open, tmp, "w")
+        counts = {"users": 0, "characters": 0, "wishes": 0}
+        try:
+            header = {"type": "header", "format": FORMAT, "version": VERSION, "gid": gid, "ts": time.time(), "pool_version": pool_version}
+            config = {"type": "config", "value": await self.kv.get(f"{gid}:config", {}) or {}}
+            await asyncio.to_thread(out.write, json.dumps(header, ensure_ascii=False) + "\n" + json.dumps(config, ensure_ascii=False) + "\n")
+            for i in range(0, len(users), self.batch):
+                chunk = users[i:i + self.batch]
+                keys = [f"{gid}:{uid}:{name}" for uid in chunk for name in ("partners", "fav", "wish_list")]
+                values = await self.kv.get_many(keys, None)
+                lines = []
+                for uid in chunk:
+                    partners = [str(c) for c in values[f"{gid}:{uid}:partners"] or []]
+                    fav = values[f"{gid}:{uid}:fav"]
+                    wishes = [str(c) for c in values[f"{gid}:{uid}:wish_list"] or []]
+                    if not partners and fav is None and not wishes:
+                        continue
+                    counts["users"] += 1
+                    counts["characters"] += len(partners)
+                    counts["wishes"] += len(wishes)
+                    record = {"type": "user", "uid": uid, "partners": partners, "fav": None if fav is None else str(fav), "wish_list": wishes}
+                    lines.append(json.dumps(record, ensure_ascii=False))
+                if lines:
+                    await asyncio.to_thread(out.write, "\n".join(lines) + "\n")
+            await asyncio.to_thread(out.write, json.dumps({"type": "footer", **counts}) + "\n")
+        finally:
+            await asyncio.to_thread(out.close)
+        await asyncio.to_thread(tmp.replace, path)
+        return {"path": str(path), **counts}
+
+    @staticmethod
+    def _read_lines(f, n: int) -> list[str]:
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line)
+                if len(lines) >= n:
+                    break
+        return lines
+
+    async def load(self, gid, path: str | Path, known, apply=None) -> dict:
+        """逐批读取存档并校验；给了 apply 时把每批通过校验的用户记录交给它写入
+
+        known(cid) 判断角色是否在当前卡池里，不在的角色从后宫、最爱和愿望单中去掉并报告。
+        同一个角色出现在多个用户后宫里时只保留第一个。
+        """
+        gid = str(gid)
+        path = Path(path)
+        f = await asyncio.to_thread(_open, path, "r")
+        report = {"users": 0, "characters": 0, "wishes": 0, "unknown": [], "unknown_count": 0, "duplicates": 0, "config": None, "complete": False}
+        owned: set[str] = set()
+        try:
+            first = await asyncio.to_thread(self._read_lines, f, 1)
+            header = json.loads(first[0]) if first else {}
+            if header.get("type") != "header" or header.get("format") != FORMAT:
+                raise ValueError("不是群存档文件")
+            if header.get("version", 0) > VERSION:
+                raise ValueError(f"存档版本 {header.get('version')} 高于当前支持的 {VERSION}")
+            report["source_gid"] = header.get("gid")
+            report["ts"] = header.get("ts")
+
+            def check(cid) -> bool:
+                if known(cid):
+                    return True
+                report["unknown_count"] += 1
+                if len(report["unknown"]) < 20:
+                    report["unknown"].append(cid)
+                return False
+
+            while True:
+                lines = await asyncio.to_thread(self._read_lines, f, self.batch)
+                if not lines:
+                    break
+                records = []
+                for line in lines:
+                    item = json.loads(line)
+                    kind = item.get("type")
+                    if kind == "config":
+                        report["config"] = item.get("value") or {}
+                    elif kind == "footer":
+                        report["complete"] = True
+                    elif kind == "user":
+                        partners = []
+                        for cid in map(str, item.get("partners") or []):
+                            if not check(cid):
+                                continue
+                            if cid in owned:
+                                report["duplicates"] += 1
+                                continue
+                            owned.add(cid)
+                            partners.append(cid)
+                        fav = item.get("fav")
+                        fav = str(fav) if fav is not None and str(fav) in partners else None
+                        wishes = [cid for cid in dict.fromkeys(map(str, item.get("wish_list") or [])) if check(cid)]
+                        report["users"] += 1
+                        report["characters"] += len(partners)
+                        report["wishes"] += len(wishes)
+                        records.append((str(item.get("uid")), partners, fav, wishes))
+                if apply is not None and records:
+                    await apply(records)
+        finally:
+            await asyncio.to_thread(f.close)
+        return report
+
+    async def restore(self, gid, path: str | Path, known, current_users) -> dict:
+        """用存档替换群里的后宫、最爱、愿望单和群设置，返回报告
+
+        先清空 current_users（当前有数据的用户）的这些键，再按批写入存档内容，
+        每批写完立即写回存储。调用方负责持有群锁并在之后重建归属索引。
+        """
+        gid = str(gid)
+        kv = self.kv
+        # 存档不完整时不动现有数据
+        checked = await self.load(gid, path, lambda cid: True)
+        if not checked["complete"]:
+            raise ValueError("存档不完整（缺少结尾记录）")
+
+        current_users = sorted({str(u) for u in current_users})
+        for i in range(0, len(current_users), self.batch):
+            chunk = current_users[i:i + self.batch]
+            keys = [f"{gid}:{uid}:{name}" for uid in chunk for name in ("partners", "wish_list")]
+            values = await kv.get_many(keys, [])
+            for uid in chunk:
+                for cid in values[f"{gid}:{uid}:partners"] or []:
+                    await kv.delete(f"{gid}:{cid}:married_to")
+                for cid in values[f"{gid}:{uid}:wish_list"] or []:
+                    await kv.delete(f"{gid}:{cid}:wished_by")
+                for name in ("partners", "fav", "wish_list"):
+                    await kv.delete(f"{gid}:{uid}:{name}")
+            await kv.flush()
+
+        wished_by: dict[str, list[str]] = {}
+        users: list[str] = []
+
+        async def apply(records) -> None:
+            for uid, partners, fav, wishes in records:
+                users.append(uid)
+                if partners:
+                    await kv.put(f"{gid}:{uid}:partners", partners)
+                    for cid in partners:
+                        await kv.put(f"{gid}:{cid}:married_to", uid)
+                if fav is not None:
+                    await kv.put(f"{gid}:{uid}:fav", fav)
+                if wishes:
+                    await kv.put(f"{gid}:{uid}:wish_list", wishes)
+                    for cid in wishes:
+                        wished_by.setdefault(cid, []).append(uid)
+            await kv.flush()
+
+        report = await self.load(gid, path, known, apply)
+        for cid, uids in wished_by.items():
+            await kv.put(f"{gid}:{cid}:wished_by", uids)
+        if report["config"] is not None:
+            await kv.put(f"{gid}:config", report["config"])
+        await kv.flush()
+        report["imported_users"] = users
+        return report
+
+    @staticmethod
+    def prune(directory: str | Path, pattern: str, keep: int) -> list[Path]:
+        """按文件名（含时间戳）保留最新的 keep 个匹配 pattern 的存档，返回删除的文件"""
+        files = sorted(Path(directory).glob(pattern))
+        removed = files[:-keep] if keep > 0 else []
+        for path in removed:
+            path.unlink(missing_ok=True)
+        return removed
@@ -0,0 +1,107 @@
+import asyncio
+import functools
+from collections import deque
+
+
+class _Lane:
+    __slots__ = ("active", "waiters")
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+
+class GroupGate:
+    """按群限制同时处理的指令数，让一个群的刷屏不挤占其他群
+
+    每个群最多 limit 条指令同时在事件循环里运行，多出来的按到达顺序排队，
+    前一条结束时把名额直接交给队首。可丢弃的指令（只有抽卡：刷屏时多出来的抽卡
+    本来也会被次数限制拦下）在排队超过 max_waiting 条时回复一句忙碌提示后丢弃，其余指令总是排队。
+    所有群仍共用一个事件循环，这里只是不让一个群的指令占满所有并发，
+    并不能让单条指令的 CPU 开销不影响其他群。没有排队的群不占任何内存。
+    """
+
+    def __init__(self, limit: int = 4, max_waiting: int = 32) -> None:
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self._lanes: dict[str, _Lane] = {}
+        self.queued = 0
+        self.shed = 0
+
+    async def acquire(self, gid: str, shed: bool = False) -> bool:
+        """取得一个名额；shed 为 True 且排队已满时返回 False"""
+        if self.limit <= 0:
+            return True
+        lane = self._lanes.get(gid)
+        if lane is None:
+            lane = self._lanes[gid] = _Lane()
+        if lane.active < self.limit and not lane.waiters:
+            lane.active += 1
+            return True
+        if shed and len(lane.waiters) >= self.max_waiting:
+            self.shed += 1
+            return False
+        self.queued += 1
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(gid)  # 名额已经交过来了，转给下一个
+            else:
+                try:
+                    lane.waiters.remove(waiter)
+                except ValueError:
+                    pass
+            raise
+        return True
+
+    def release(self, gid: str) -> None:
+        if self.limit <= 0:
+            return
+        lane = self._lanes.get(gid)
+        if lane is None:
+            return
+        while lane.waiters:
+            waiter = lane.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # 名额原样交给队首，active 不变
+                return
+        lane.active -= 1
+        if lane.active <= 0:
+            del self._lanes[gid]
+
+    def stats(self) -> dict:
+        return {
+            "busy_groups": len(self._lanes),
+            "waiting": sum(len(lane.waiters) for lane in self._lanes.values()),
+            "queued": self.queued,
+            "shed": self.shed,
+        }
+
+
+def gated(fn=None, *, shed: str | None = None):
+    """处理器（异步生成器方法）按群排队执行
+
+    给了 shed（忙碌提示）时排队已满则回复该提示并丢弃本条指令，只用于丢了也无妨的
+    指令（抽卡）；其余指令总是排队，不会被丢弃。
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, event, *args, **kwargs):
+            gid = event.get_group_id() or "global"
+            if not await self.gate.acquire(gid, shed is not None):
+                event.call_llm = True
+                yield event.plain_result(shed)
+                return
+            try:
+                async for result in fn(self, event, *args, **kwargs):
+                    yield result
+            finally:
+                self.gate.release(gid)
+
+        return wrapper
+
+    return decorate(fn) if fn is not None else decorate
@@ -0,0 +1,95 @@
+import os
+import asyncio
+from pathlib import Path
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # Pillow 可选，缺失时不提供拼图
+    PILImage = None
+
+
+class HaremViews:
+    """“我的后宫”的分页文字与拼图缓存
+
+    按 (群, 用户) 缓存渲染好的分页和拼图文件，由归属索引在后宫变化时调用
+    invalidate() 失效；卡池重载后版本号变化也会重新渲染。拼图只用本地图片
+    缓存里已有的图，缺图时用灰色占位且不缓存，等图片预取完成后再拼。
+    """
+
+    PAGE_SIZE = 15
+    GRID_COLUMNS = 5
+    TILE_SIZE = (150, 210)
+    MAX_ENTRIES = 2000
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self._pages: dict[tuple[str, str], tuple[int, list[list[str]]]] = {}
+        self._grids: dict[tuple[str, str], tuple[int, Path]] = {}
+        # 每次失效加一，防止渲染期间发生的变化被旧结果覆盖
+        self._generation: dict[tuple[str, str], int] = {}
+
+    @property
+    def grid_available(self) -> bool:
+        return PILImage is not None
+
+    def invalidate(self, gid, uid) -> None:
+        key = (str(gid), str(uid))
+        self._pages.pop(key, None)
+        self._grids.pop(key, None)
+        self._generation[key] = self._generation.get(key, 0) + 1
+
+    def _remember(self, cache: dict, key, value) -> None:
+        cache.pop(key, None)
+        cache[key] = value
+        while len(cache) > self.MAX_ENTRIES:
+            cache.pop(next(iter(cache)))
+
+    def pages(self, gid, uid, pool_version: int, render) -> list[list[str]]:
+        """返回分好页的角色行，未缓存时调用 render() 生成全部行"""
+        key = (str(gid), str(uid))
+        entry = self._pages.get(key)
+        if entry is not None and entry[0] == pool_version:
+            return entry[1]
+        lines = render()
+        pages = [lines[i:i + self.PAGE_SIZE] for i in range(0, len(lines), self.PAGE_SIZE)] or [[]]
+        self._remember(self._pages, key, (pool_version, pages))
+        return pages
+
+    async def grid(self, gid, uid, pool_version: int, tiles: list[Path | None]) -> Path | None:
+        """把各角色的本地图片拼成一张图，返回文件路径；没有 Pillow 时返回 None"""
+        if PILImage is None or not tiles:
+            return None
+        key = (str(gid), str(uid))
+        entry = self._grids.get(key)
+        if entry is not None and entry[0] == pool_version and entry[1].is_file():
+            return entry[1]
+        generation = self._generation.get(key, 0)
+        path = self.root / f"{key[0]}_{key[1]}.jpg"
+        complete = await asyncio.to_thread(self._compose, tiles, path)
+        if complete and self._generation.get(key, 0) == generation:
+            self._remember(self._grids, key, (pool_version, path))
+        return path
+
+    def _compose(self, tiles: list[Path | None], path: Path) -> bool:
+        """在线程中拼图并原子写入，返回是否所有图片都齐全"""
+        width, height = self.TILE_SIZE
+        columns = min(self.GRID_COLUMNS, len(tiles))
+        rows = (len(tiles) + columns - 1) // columns
+        canvas = PILImage.new("RGB", (columns * width, rows * height), (240, 240, 240))
+        complete = True
+        for i, tile in enumerate(tiles):
+            box = ((i % columns) * width, (i // columns) * height)
+            if tile is None:
+                complete = False
+                canvas.paste((200, 200, 200), box + (box[0] + width - 2, box[1] + height - 2))
+                continue
+            try:
+                with PILImage.open(tile) as img:
+                    canvas.paste(ImageOps.fit(img.convert("RGB"), (width - 2, height - 2)), box)
+            except Exception:
+                complete = False
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        canvas.save(tmp, format="JPEG", quality=85)
+        os.replace(tmp, path)
+        return complete
@@ -0,0 +1,10 @@
+import aiohttp
+
+# 连接超时短、读超时按单次读取计算，避免慢源拖住刷新/下载
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=120, connect=5, sock_connect=5, sock_read=20)
+
+
+def create_session(limit: int = 16, limit_per_host: int = 8) -> aiohttp.ClientSession:
+    """创建插件共用的 HTTP 会话（需在事件循环中调用，随插件 terminate 关闭）"""
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, ttl_dns_cache=300)
+    return aiohttp.ClientSession(timeout=DEFAULT_TIMEOUT, connector=connector)
@@ -0,0 +1,68 @@
+import json
+import os
+import hashlib
+from pathlib import Path
+
+
+class IdRegistry:
+    """图片路径 → 角色ID 的只追加登记表
+
+    新路径的ID由路径内容哈希确定（与进程无关），撞号时顺延到下一个空闲ID
+    并记录冲突；已登记的路径永远保持原ID，保证重启后婚姻/愿望数据不错位。
+    """
+
+    ID_BASE = 1000000  # 避开 bangumi 角色ID（< 1000000）
+    ID_SPAN = 9000000
+
+    def __init__(self, path: str | Path | None = None) -> None:
+        self.path = Path(path) if path else None
+        self._ids: dict[str, int] = {}
+        self._owners: dict[int, str] = {}
+        self._dirty = False
+        self.collisions: list[dict] = []
+        self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.is_file():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8")) or {}
+        except Exception:
+            return
+        for key, cid in data.items():
+            cid = int(cid)
+            if cid in self._owners:
+                self.collisions.append({"id": cid, "key": key, "existing": self._owners[cid]})
+                continue
+            self._ids[key] = cid
+            self._owners[cid] = key
+
+    @classmethod
+    def content_id(cls, key: str) -> int:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return cls.ID_BASE + int.from_bytes(digest, "big") % cls.ID_SPAN
+
+    def get_id(self, key: str) -> int:
+        """返回路径对应的稳定ID，首次出现时分配并登记"""
+        cid = self._ids.get(key)
+        if cid is not None:
+            return cid
+        cid = self.content_id(key)
+        if cid in self._owners:
+            self.collisions.append({"id": cid, "key": key, "existing": self._owners[cid]})
+            while cid in self._owners:
+                cid = self.ID_BASE + (cid - self.ID_BASE + 1) % self.ID_SPAN
+        self._ids[key] = cid
+        self._owners[cid] = key
+        self._dirty = True
+        return cid
+
+    def save(self) -> None:
+        """有新登记时原子写回文件"""
+        if self.path is None or not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self._ids, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._dirty = False
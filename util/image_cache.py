@@ -0,0 +1,241 @@
+import io
+import os
+import json
+import time
+import base64
+import hashlib
+import asyncio
+import aiohttp
+from pathlib import Path
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # Pillow 可选，缺失时不做缩放
+    PILImage = None
+
+
+class ImageCache:
+    """按内容寻址的本地图片缓存
+
+    文件以内容 sha256 命名（同图多 URL 只存一份），url → 文件 的映射保存在
+    index.json；总大小超过上限时按最近访问时间淘汰。后台预取队列用于预热
+    高热度角色和愿望单里的角色。安装了 Pillow 时，入库前把过大的图缩放并
+    重新编码为 JPEG，以减少上传字节数。
+    """
+
+    INDEX_NAME = "index.json"
+    MAX_SIDE = 1280
+    JPEG_QUALITY = 85
+    MAX_DOWNLOAD = 20 * 1024 * 1024
+
+    def __init__(self, root: str | Path, max_bytes: int = 512 * 1024 * 1024, concurrency: int = 4) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        # url -> [文件名, 大小, 最近访问时间]
+        self._index: dict[str, list] = {}
+        self._refs: dict[str, int] = {}
+        self._total = 0
+        self._dirty = False
+        self._pending: set[str] = set()
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        # 由插件注入共享会话，未注入时首次下载时自建
+        self.session: aiohttp.ClientSession | None = None
+        self._own_session: aiohttp.ClientSession | None = None
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load_index(self) -> None:
+        path = self.root / self.INDEX_NAME
+        if not path.is_file():
+            return
+        try:
+            data = json.loads(path.read_text(encoding="utf-8")) or {}
+        except Exception:
+            return
+        for url, entry in data.items():
+            if (self.root / entry[0]).is_file():
+                self._add_entry(url, entry)
+
+    def _add_entry(self, url: str, entry: list) -> None:
+        self._index[url] = entry
+        name = entry[0]
+        if self._refs.get(name, 0) == 0:
+            self._total += entry[1]
+        self._refs[name] = self._refs.get(name, 0) + 1
+
+    def save_index(self) -> None:
+        if not self._dirty:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / self.INDEX_NAME
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self._index), encoding="utf-8")
+        os.replace(tmp, path)
+        self._dirty = False
+
+    def lookup(self, url: str | None) -> Path | None:
+        """命中时返回本地文件路径并刷新访问时间"""
+        if not url or not self.enabled:
+            return None
+        entry = self._index.get(url)
+        if entry is None:
+            self.misses += 1
+            return None
+        path = self.root / entry[0]
+        if not path.is_file():
+            self._remove(url)
+            self.misses += 1
+            return None
+        entry[2] = time.time()
+        self._dirty = True
+        self.hits += 1
+        return path
+
+    async def message_file(self, url: str | None, mode: str = "base64") -> str | None:
+        """供 NapCat image 段使用的 file 字段：命中缓存时为 base64:// 或 file://，否则为 None
+
+        file:// 要求 NapCat 与插件在同一文件系统上，跨容器部署请用 base64。
+        """
+        path = self.lookup(url)
+        if path is None:
+            return None
+        if mode == "file":
+            return path.resolve().as_uri()
+        data = await asyncio.to_thread(path.read_bytes)
+        return "base64://" + base64.b64encode(data).decode("ascii")
+
+    def _remove(self, url: str) -> None:
+        entry = self._index.pop(url, None)
+        if entry is None:
+            return
+        self._dirty = True
+        name = entry[0]
+        self._refs[name] -= 1
+        if self._refs[name] <= 0:
+            del self._refs[name]
+            self._total -= entry[1]
+            try:
+                (self.root / name).unlink()
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        if self._total <= self.max_bytes:
+            return
+        for url, _ in sorted(self._index.items(), key=lambda kv: kv[1][2]):
+            self._remove(url)
+            if self._total <= self.max_bytes * 0.9:
+                break
+
+    @classmethod
+    def _transcode(cls, data: bytes) -> tuple[bytes, str]:
+        """可选的缩放/重新编码，返回 (数据, 扩展名)"""
+        ext = ".img"
+        if PILImage is None:
+            return data, ext
+        try:
+            with PILImage.open(io.BytesIO(data)) as img:
+                fmt = (img.format or "").lower()
+                ext = f".{fmt}" if fmt else ext
+                if fmt == "gif" or max(img.size) <= cls.MAX_SIDE:
+                    return data, ext
+                img.thumbnail((cls.MAX_SIDE, cls.MAX_SIDE))
+                out = io.BytesIO()
+                img.convert("RGB").save(out, format="JPEG", quality=cls.JPEG_QUALITY, optimize=True)
+                if out.tell() < len(data):
+                    return out.getvalue(), ".jpg"
+        except Exception:
+            pass
+        return data, ext
+
+    def _write(self, data: bytes) -> tuple[str, int]:
+        """转码并写入内容寻址文件（在线程中运行，不碰索引）"""
+        data, ext = self._transcode(data)
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{digest[:2]}/{digest}{ext}"
+        path = self.root / name
+        if not path.is_file():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return name, len(data)
+
+    def _register(self, url: str, name: str, size: int) -> None:
+        self._remove(url)
+        self._add_entry(url, [name, size, time.time()])
+        self._dirty = True
+        self._evict()
+
+    async def fetch(self, url: str) -> Path | None:
+        """下载并入库，失败返回 None"""
+        if not self.enabled:
+            return None
+        session = self.session
+        if session is None or session.closed:
+            if self._own_session is None or self._own_session.closed:
+                from .http import create_session
+                self._own_session = create_session()
+            session = self._own_session
+        try:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                chunks, size = [], 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > self.MAX_DOWNLOAD:
+                        return None
+                    chunks.append(chunk)
+                data = b"".join(chunks)
+                if not data:
+                    return None
+        except Exception:
+            return None
+        name, size = await asyncio.to_thread(self._write, data)
+        self._register(url, name, size)
+        return self.lookup(url)
+
+    def prefetch(self, urls) -> int:
+        """把未缓存的图片放入后台预取队列，返回新入队数量"""
+        if not self.enabled:
+            return 0
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._prefetch_worker()) for _ in range(self.concurrency)]
+        added = 0
+        for url in urls:
+            if url and url not in self._index and url not in self._pending:
+                self._pending.add(url)
+                self._queue.put_nowait(url)
+                added += 1
+        return added
+
+    async def _prefetch_worker(self) -> None:
+        while True:
+            url = await self._queue.get()
+            try:
+                await self.fetch(url)
+            finally:
+                self._pending.discard(url)
+                self._queue.task_done()
+                if not self._pending:
+                    self.save_index()
+
+    async def close(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        if self._own_session is not None:
+            await self._own_session.close()
+            self._own_session = None
+        self.save_index()
@@ -0,0 +1,244 @@
+import copy
+import json
+import os
+import asyncio
+import contextvars
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+_MISSING = object()
+_DELETED = object()
+
+
+class KVCache:
+    """插件 KV 存储前的写回缓存
+
+    读操作命中内存；写操作只改内存并记入脏键集合和追加日志，由定时任务
+    合并后批量写回 KV。日志在每次写入后刷到操作系统，进程崩溃后
+    recover() 会把未写回的修改重放到 KV。
+    """
+
+    def __init__(
+        self,
+        get: Callable[[str, Any], Awaitable[Any]],
+        put: Callable[[str, Any], Awaitable[None]],
+        delete: Callable[[str], Awaitable[None]],
+        journal_path: str | Path | None = None,
+        flush_interval: float = 1.0,
+        flush_batch: int = 500,
+        max_entries: int = 200000,
+        write_batch: Callable[[list[tuple[str, Any, bool]]], Awaitable[None]] | None = None,
+    ) -> None:
+        self._get = get
+        self._put = put
+        self._delete = delete
+        # 后端支持时，一次写回的所有 (键, 值, 是否删除) 交给它在一个事务里完成
+        self._write_batch = write_batch
+        self.journal_path = Path(journal_path) if journal_path else None
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_entries = max_entries
+        self._data: dict[str, Any] = {}
+        self._dirty: set[str] = set()
+        self._journal = None
+        self._flush_task: asyncio.Task | None = None
+        self._urgent_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_hooks: list[Callable[[], Awaitable[None]]] = []
+
+    def add_flush_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """注册写回前调用的钩子，供派生索引把快照 put 进缓存"""
+        self._flush_hooks.append(hook)
+
+    @staticmethod
+    def _copy(value):
+        return copy.deepcopy(value) if isinstance(value, (list, dict, set)) else value
+
+    async def get(self, key: str, default=None):
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            loaded = await self._get(key, _MISSING)
+            # 等待期间可能已有写入，以内存为准
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                value = _DELETED if loaded is _MISSING or loaded is None else loaded
+                self._data[key] = value
+                self._evict()
+        if value is _DELETED:
+            return default
+        return self._copy(value)
+
+    async def get_many(self, keys, default=None) -> dict:
+        """批量读取，未缓存的键并发回源"""
+        missing = [k for k in keys if k not in self._data]
+        if missing:
+            await asyncio.gather(*(self.get(k) for k in missing))
+        return {k: await self.get(k, default) for k in keys}
+
+    def compare_and_set(self, expected: dict, updates: dict) -> bool:
+        """乐观并发控制：expected 中的键当前值都与预期相等时才一次性写入 updates
+
+        不会让出事件循环，调用方需先用 get() 把相关键读入缓存；未缓存的键视为
+        校验失败。预期值为空（None/空列表）时匹配不存在或为空的键，新值为 None
+        表示删除。
+        """
+        for key, want in expected.items():
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                return False
+            if ((None if value is _DELETED else value) or None) != (want or None):
+                return False
+        for key, value in updates.items():
+            if value is None:
+                self._data[key] = _DELETED
+                self._mark(key, {"k": key, "d": 1})
+            else:
+                self._data[key] = self._copy(value)
+                self._mark(key, {"k": key, "v": value})
+        return True
+
+    async def put(self, key: str, value) -> None:
+        self._data[key] = self._copy(value)
+        self._mark(key, {"k": key, "v": value})
+
+    async def delete(self, key: str) -> None:
+        self._data[key] = _DELETED
+        self._mark(key, {"k": key, "d": 1})
+
+    def _mark(self, key: str, record: dict) -> None:
+        self._dirty.add(key)
+        self._append_journal(record)
+        if len(self._dirty) >= self.flush_batch:
+            self._schedule(0)
+        else:
+            self._schedule(self.flush_interval)
+
+    def _evict(self) -> None:
+        """超出上限时丢弃最早读入的干净条目"""
+        overflow = len(self._data) - self.max_entries
+        if overflow <= 0:
+            return
+        for key in [k for k in self._data if k not in self._dirty][: overflow + self.max_entries // 10]:
+            del self._data[key]
+
+    def _append_journal(self, record: dict) -> None:
+        if self.journal_path is None:
+            return
+        try:
+            if self._journal is None:
+                self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._journal.write(json.dumps(record, ensure_ascii=False, default=list) + "\n")
+            self._journal.flush()
+        except Exception:
+            pass
+
+    def _rewrite_journal(self) -> None:
+        """只保留仍未写回的键，防止日志无限增长"""
+        if self.journal_path is None:
+            return
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        tmp = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key in self._dirty:
+                value = self._data.get(key, _DELETED)
+                record = {"k": key, "d": 1} if value is _DELETED else {"k": key, "v": value}
+                f.write(json.dumps(record, ensure_ascii=False, default=list) + "\n")
+        os.replace(tmp, self.journal_path)
+
+    def _schedule(self, delay: float) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # 写回任务在空白上下文里运行，不继承触发它的指令的 contextvar（写回的是所有群、所有指令的数据）
+        if delay <= 0:
+            if self._urgent_task is None or self._urgent_task.done():
+                self._urgent_task = contextvars.Context().run(loop.create_task, self.flush())
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = contextvars.Context().run(loop.create_task, self._flush_later(delay))
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """把脏键合并写回 KV，返回写回条数"""
+        async with self._flush_lock:
+            for hook in self._flush_hooks:
+                try:
+                    await hook()
+                except Exception:
+                    pass
+            keys, self._dirty = list(self._dirty), set()
+            done = written = 0
+            try:
+                if self._write_batch is not None and keys:
+                    items = []
+                    for key in keys:
+                        value = self._data.get(key, _DELETED)
+                        items.append((key, None, True) if value is _DELETED else (key, value, False))
+                    try:
+                        await self._write_batch(items)
+                        written = len(keys)
+                    except Exception:
+                        self._dirty.update(keys)
+                    done = len(keys)
+                for key in keys[done:]:
+                    value = self._data.get(key, _DELETED)
+                    try:
+                        if value is _DELETED:
+                            await self._delete(key)
+                        else:
+                            await self._put(key, value)
+                        written += 1
+                    except Exception:
+                        self._dirty.add(key)
+                    done += 1
+            finally:
+                # 被取消时，没来得及写回的键仍然是脏的
+                self._dirty.update(keys[done:])
+                try:
+                    self._rewrite_journal()
+                except Exception:
+                    pass
+            if self._dirty:
+                self._schedule(self.flush_interval)
+            return written
+
+    async def recover(self) -> list[str]:
+        """启动时把上次未写回的日志重放到 KV，返回重放的键"""
+        if self.journal_path is None or not self.journal_path.is_file():
+            return []
+        pending: dict[str, Any] = {}
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except Exception:
+                    continue  # 崩溃时写了一半的行
+                pending[record["k"]] = _DELETED if record.get("d") else record.get("v")
+        for key, value in pending.items():
+            self._data[key] = value
+            self._dirty.add(key)
+        await self.flush()
+        return list(pending)
+
+    async def close(self) -> None:
+        """停止定时任务并写回所有修改"""
+        for task in (self._flush_task, self._urgent_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._flush_task = self._urgent_task = None
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
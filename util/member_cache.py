@@ -0,0 +1,122 @@
+import time
+import asyncio
+
+
+class MemberCache:
+    """群成员与群身份（owner/admin/member）的 TTL 缓存
+
+    首次查询某个群时用一次 get_group_member_list 批量预热整群；之后只有未命中
+    （新成员、过期）才单独调用 get_group_member_info。NapCat 推送的管理员变动、
+    成员进出群通知会直接更新缓存。
+    """
+
+    def __init__(self, ttl: float = 600, list_ttl: float = 1800, on_call=None) -> None:
+        self.ttl = ttl
+        self.list_ttl = list_ttl
+        self.on_call = on_call  # (动作, 耗时秒, 是否失败)，用于统计 NapCat 调用
+        self._roles: dict[tuple[str, str], tuple[str | None, float]] = {}
+        self._members: dict[str, tuple[set[str], float]] = {}
+        self._warming: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _rows(resp) -> list:
+        if isinstance(resp, dict):
+            resp = resp.get("data", resp)
+        return resp if isinstance(resp, list) else []
+
+    async def _warm(self, call_action, gid: str) -> bool:
+        """拉取整群成员列表，成功返回 True；同一个群的并发预热共用一次请求"""
+        task = self._warming.get(gid)
+        if task is None:
+            task = self._warming[gid] = asyncio.create_task(self._fetch_members(call_action, gid))
+            task.add_done_callback(lambda _: self._warming.pop(gid, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            return False
+
+    async def _call(self, call_action, action: str, **params):
+        start = time.monotonic()
+        try:
+            resp = await call_action(action, **params)
+        except Exception:
+            if self.on_call is not None:
+                self.on_call(action, time.monotonic() - start, True)
+            raise
+        if self.on_call is not None:
+            self.on_call(action, time.monotonic() - start, False)
+        return resp
+
+    async def _fetch_members(self, call_action, gid: str) -> bool:
+        rows = self._rows(await self._call(call_action, "get_group_member_list", group_id=gid))
+        if not rows:
+            return False
+        now = time.monotonic()
+        members = set()
+        for row in rows:
+            uid = str(row.get("user_id"))
+            members.add(uid)
+            self._roles[(gid, uid)] = (row.get("role"), now + self.ttl)
+        self._members[gid] = (members, now + self.list_ttl)
+        return True
+
+    async def role(self, call_action, gid, uid) -> str | None:
+        """成员的群身份，缓存未命中时先批量预热，仍没有再单独查询"""
+        gid, uid = str(gid), str(uid)
+        now = time.monotonic()
+        entry = self._roles.get((gid, uid))
+        if entry is not None and entry[1] > now:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        members = self._members.get(gid)
+        if members is None or members[1] <= now:
+            if await self._warm(call_action, gid):
+                entry = self._roles.get((gid, uid))
+                if entry is not None:
+                    return entry[0]
+        resp = await self._call(call_action, "get_group_member_info", group_id=gid, user_id=uid)
+        role = resp.get("role", None) if isinstance(resp, dict) else None
+        self._roles[(gid, uid)] = (role, time.monotonic() + self.ttl)
+        return role
+
+    async def is_member(self, call_action, gid, uid) -> bool | None:
+        """是否仍在群里；成员列表拿不到时返回 None，由调用方自行兜底"""
+        gid, uid = str(gid), str(uid)
+        members = self._members.get(gid)
+        if members is None or members[1] <= time.monotonic():
+            if not await self._warm(call_action, gid):
+                return None
+            members = self._members.get(gid)
+        return uid in members[0]
+
+    def on_notice(self, raw) -> None:
+        """根据 NapCat 的 notice 事件更新缓存"""
+        notice_type = getattr(raw, "notice_type", None)
+        gid = str(getattr(raw, "group_id", "") or "")
+        uid = str(getattr(raw, "user_id", "") or "")
+        if not gid or not uid:
+            return
+        members = self._members.get(gid)
+        if notice_type == "group_admin":
+            role = "admin" if getattr(raw, "sub_type", None) == "set" else "member"
+            self._roles[(gid, uid)] = (role, time.monotonic() + self.ttl)
+        elif notice_type == "group_decrease":
+            if getattr(raw, "sub_type", None) == "kick_me":
+                self.forget(gid)
+                return
+            self._roles.pop((gid, uid), None)
+            if members is not None:
+                members[0].discard(uid)
+        elif notice_type == "group_increase":
+            self._roles[(gid, uid)] = ("member", time.monotonic() + self.ttl)
+            if members is not None:
+                members[0].add(uid)
+
+    def forget(self, gid) -> None:
+        gid = str(gid)
+        self._members.pop(gid, None)
+        for key in [k for k in self._roles if k[0] == gid]:
+            del self._roles[key]
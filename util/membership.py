@@ -0,0 +1,88 @@
+import asyncio
+from pathlib import Path
+
+
+class Membership:
+    """每个群里发过言的用户
+
+    集合常驻内存，新用户只向 members.log 追加一行 `gid<TAB>uid`，从不重写；
+    observe() 是同步的，已知用户只做一次集合查找。旧版本写在 KV
+    `{gid}:user_list` 里的列表在第一次读取该群时合并进来；KV 无法列出所有群，
+    一旦见到过旧列表就在日志里记一行 LEGACY_MARK，表示可能还有没发过言的旧群。
+    """
+
+    LEGACY_MARK = "#legacy"
+
+    def __init__(self, kv, path: str | Path | None = None) -> None:
+        self.kv = kv
+        self.path = Path(path) if path else None
+        self._groups: dict[str, set[str]] = {}
+        self._merged: set[str] = set()
+        self._file = None
+        self.legacy = False
+
+    def load(self) -> None:
+        """读取追加日志（启动时在线程中调用）"""
+        if self.path is None or not self.path.is_file():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.rstrip("\n") == self.LEGACY_MARK:
+                    self.legacy = True
+                    continue
+                gid, sep, uid = line.rstrip("\n").partition("\t")
+                if sep and uid:
+                    self._groups.setdefault(gid, set()).add(uid)
+
+    def observe(self, gid, uid) -> None:
+        """记录一次发言；只有新用户才写日志"""
+        users = self._groups.get(gid)
+        if users is None:
+            users = self._groups[gid] = set()
+        elif uid in users:
+            return
+        users.add(uid)
+        self._append(f"{gid}\t{uid}")
+
+    def _append(self, line: str) -> None:
+        if self.path is None:
+            return
+        try:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+        except Exception:
+            pass
+
+    def known(self, gid) -> set[str]:
+        """本地日志里记录的用户（不读旧 KV）"""
+        return self._groups.get(str(gid), set())
+
+    def groups(self) -> list[str]:
+        return list(self._groups)
+
+    async def users(self, gid) -> set[str]:
+        """群里发过言的用户集合（只读）"""
+        gid = str(gid)
+        if gid not in self._merged:
+            self._merged.add(gid)
+            legacy = await self.kv.get(f"{gid}:user_list", []) or []
+            if legacy and not self.legacy:
+                self.legacy = True
+                self._append(self.LEGACY_MARK)
+            users = self._groups.setdefault(gid, set())
+            for uid in map(str, legacy):
+                if uid not in users:
+                    users.add(uid)
+                    self._append(f"{gid}\t{uid}")
+        return self._groups.get(gid, set())
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.load)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
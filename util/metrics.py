@@ -0,0 +1,307 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from bisect import bisect_left
+from pathlib import Path
+
+# 延迟分桶上界（秒），最后一个桶是 +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COMMANDS = (
+    "抽卡", "我的后宫", "离婚", "交换", "最爱", "许愿", "愿望单", "删除许愿", "查询", "搜索",
+    "强制离婚", "清理后宫", "系统设置", "刷新", "终极轮回", "修复索引", "重载卡池", "菜单",
+    "统计", "贴表情", "导出存档", "导入存档",
+)
+BACKGROUND = "后台"  # 不在任何指令内发生的存储调用（定时写回等）
+NAPCAT_ACTIONS = ("send_group_msg", "get_group_member_list", "get_group_member_info")
+POOL_EVENTS = ("load", "refresh", "reload")
+
+
+class Histogram:
+    """固定分桶的计数直方图，observe 只做一次二分查找和两次加法"""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估计分位数（秒），落在 +Inf 桶时返回最后一个有限上界"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS[min(i, len(BUCKETS) - 1)]
+        return BUCKETS[-1]
+
+
+class CommandStats:
+    __slots__ = ("latency", "errors", "kv_get", "kv_put", "kv_delete")
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.errors = 0
+        self.kv_get = 0
+        self.kv_put = 0
+        self.kv_delete = 0
+
+
+class CallStats:
+    __slots__ = ("latency", "failures")
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.failures = 0
+
+
+_current: contextvars.ContextVar[CommandStats | None] = contextvars.ContextVar("ccb_command", default=None)
+
+
+class Metrics:
+    """插件的热路径指标：指令延迟、每个指令的 KV 调用数、NapCat 调用、群锁等待、卡池加载
+
+    所有计数器在构造时按已知的指令/动作预先分配，记录时只做整数加法和直方图分桶，
+    不分配对象，可以在生产环境常开。指令内发生的 KV 调用通过 contextvar 记到该指令名下；
+    写回缓存的定时/批量写回合并了所有群、所有指令的数据，记在“后台”名下。
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.commands = {name: CommandStats() for name in COMMANDS + (BACKGROUND,)}
+        self.napcat = {name: CallStats() for name in NAPCAT_ACTIONS}
+        self.lock_wait = Histogram()
+        self.pool = {name: Histogram() for name in POOL_EVENTS}
+        self._task: asyncio.Task | None = None
+        self._server: asyncio.AbstractServer | None = None
+
+    def _stats(self) -> CommandStats:
+        return _current.get() or self.commands[BACKGROUND]
+
+    # ---- KV ----
+
+    def wrap_kv(self, get, put, delete):
+        """包装 Star 的 KV 方法，按当前指令计数"""
+
+        async def metered_get(key, default):
+            self._stats().kv_get += 1
+            return await get(key, default)
+
+        async def metered_put(key, value):
+            self._stats().kv_put += 1
+            await put(key, value)
+
+        async def metered_delete(key):
+            self._stats().kv_delete += 1
+            await delete(key)
+
+        return metered_get, metered_put, metered_delete
+
+    def wrap_batch(self, write_batch):
+        """包装批量写回，按其中的写入/删除条数计数"""
+
+        async def metered_batch(items):
+            stats = self._stats()
+            for _, _, deleted in items:
+                if deleted:
+                    stats.kv_delete += 1
+                else:
+                    stats.kv_put += 1
+            await write_batch(items)
+
+        return metered_batch
+
+    # ---- NapCat / 锁 / 卡池 ----
+
+    def observe_napcat(self, action: str, seconds: float, failed: bool) -> None:
+        stats = self.napcat.get(action)
+        if stats is None:
+            return
+        stats.latency.observe(seconds)
+        if failed:
+            stats.failures += 1
+
+    def observe_pool(self, event: str, seconds: float) -> None:
+        self.pool[event].observe(seconds)
+
+    def timed_lock(self, lock: asyncio.Lock) -> "TimedLock":
+        return TimedLock(lock, self.lock_wait)
+
+    # ---- 输出 ----
+
+    def summary(self, pool_stats: dict | None = None) -> list[str]:
+        """统计指令的文字输出"""
+        uptime = int(time.time() - self.started)
+        lines = [f"运行{uptime // 3600}小时{uptime % 3600 // 60}分钟", "指令：次数 p50/p99 ms KV读/写/删"]
+        for name, s in self.commands.items():
+            h = s.latency
+            if not h.count and not (s.kv_get or s.kv_put or s.kv_delete):
+                continue
+            lines.append(
+                f"{name}：{h.count} {h.quantile(0.5) * 1000:g}/{h.quantile(0.99) * 1000:g}"
+                f" {s.kv_get}/{s.kv_put}/{s.kv_delete}" + (f" 出错{s.errors}" if s.errors else "")
+            )
+        lines.append("NapCat：次数 p99 ms 失败")
+        for name, s in self.napcat.items():
+            if s.latency.count:
+                lines.append(f"{name}：{s.latency.count} {s.latency.quantile(0.99) * 1000:g} {s.failures}")
+        h = self.lock_wait
+        lines.append(f"群锁等待：{h.count}次 p99 {h.quantile(0.99) * 1000:g}ms 合计{h.sum * 1000:.0f}ms")
+        for name, h in self.pool.items():
+            if h.count:
+                lines.append(f"卡池{name}：{h.count}次 平均{h.sum / h.count * 1000:.0f}ms")
+        if pool_stats:
+            lines.append(
+                f"远程刷新：尝试{pool_stats.get('attempts', 0)} 失败{pool_stats.get('failures', 0)}"
+                f" 上次{pool_stats.get('last_duration_ms') or 0}ms"
+            )
+        return lines
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        out = []
+
+        def histogram(name: str, labels: str, h: Histogram) -> None:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), h.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            out.append(f"{name}_sum{suffix} {h.sum}")
+            out.append(f"{name}_count{suffix} {h.count}")
+
+        out.append("# TYPE ccb_command_seconds histogram")
+        for name, s in self.commands.items():
+            histogram("ccb_command_seconds", f'command="{name}"', s.latency)
+        out.append("# TYPE ccb_command_errors_total counter")
+        for name, s in self.commands.items():
+            out.append(f'ccb_command_errors_total{{command="{name}"}} {s.errors}')
+        out.append("# TYPE ccb_kv_ops_total counter")
+        for name, s in self.commands.items():
+            for op, n in (("get", s.kv_get), ("put", s.kv_put), ("delete", s.kv_delete)):
+                out.append(f'ccb_kv_ops_total{{command="{name}",op="{op}"}} {n}')
+        out.append("# TYPE ccb_napcat_seconds histogram")
+        for name, s in self.napcat.items():
+            histogram("ccb_napcat_seconds", f'action="{name}"', s.latency)
+        out.append("# TYPE ccb_napcat_failures_total counter")
+        for name, s in self.napcat.items():
+            out.append(f'ccb_napcat_failures_total{{action="{name}"}} {s.failures}')
+        out.append("# TYPE ccb_group_lock_wait_seconds histogram")
+        histogram("ccb_group_lock_wait_seconds", "", self.lock_wait)
+        out.append("# TYPE ccb_pool_seconds histogram")
+        for name, h in self.pool.items():
+            histogram("ccb_pool_seconds", f'event="{name}"', h)
+        return "\n".join(out) + "\n"
+
+    def _write(self, path: Path, text: str) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+
+    async def _dump_loop(self, path: Path, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self._write, path, self.prometheus())
+            except Exception:
+                pass
+            await asyncio.sleep(interval)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            body = self.prometheus().encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                + body
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, path: str | Path | None = None, port: int = 0, interval: float = 15) -> None:
+        """按配置定时把指标写到文件，和/或在 127.0.0.1:port 上提供 /metrics"""
+        if path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._dump_loop(Path(path), interval))
+        if port and self._server is None:
+            self._server = await asyncio.start_server(self._serve, "127.0.0.1", port)
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class TimedLock:
+    """记录等待时间的 asyncio.Lock 包装，每个群创建一次"""
+
+    __slots__ = ("lock", "_wait")
+
+    def __init__(self, lock: asyncio.Lock, wait: Histogram) -> None:
+        self.lock = lock
+        self._wait = wait
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        await self.lock.acquire()
+        self._wait.observe(time.perf_counter() - start)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.lock.release()
+
+
+def metered(command: str):
+    """给处理器（异步生成器方法）记录延迟、出错次数，并把其中的 KV 调用记到该指令名下
+
+    延迟包含处理器产出的结果被发送的时间，即用户感受到的整体耗时。
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, event, *args, **kwargs):
+            stats = self.metrics.commands[command]
+            token = _current.set(stats)
+            start = time.perf_counter()
+            try:
+                async for result in fn(self, event, *args, **kwargs):
+                    yield result
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latency.observe(time.perf_counter() - start)
+                try:
+                    _current.reset(token)
+                except ValueError:
+                    pass  # 生成器在另一个上下文里被关闭
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,208 @@
+import random
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+OnDone = Callable[[Any, BaseException | None], Awaitable[None]]
+OnCall = Callable[[str, float, bool], None]  # (动作, 耗时秒, 是否失败)
+
+_MERGEABLE_TYPES = ("text", "at")
+# NapCat/aiocqhttp 明确拒绝或无法调用时抛出的异常类名，这些情况下消息一定没有发出
+_REJECTED_ERRORS = ("ActionFailed", "ApiNotAvailable")
+
+
+def not_sent(error: BaseException | None) -> bool:
+    """发送错误是否明确表示消息没有发出
+
+    超时、连接中断等情况下请求可能已经到达 NapCat，消息可能已经发出，返回 False。
+    """
+    if error is None:
+        return False
+    if isinstance(error, (asyncio.QueueFull, ConnectionRefusedError)):
+        return True
+    return type(error).__name__ in _REJECTED_ERRORS
+
+
+class _Outgoing:
+    __slots__ = ("call_action", "group_id", "message", "callbacks", "enqueued_at")
+
+    def __init__(self, call_action, group_id, message: list, on_done: OnDone | None) -> None:
+        self.call_action = call_action
+        self.group_id = group_id
+        self.message = message
+        self.callbacks = [on_done] if on_done else []
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def mergeable(self) -> bool:
+        return all(seg.get("type") in _MERGEABLE_TYPES for seg in self.message)
+
+
+class _GroupQueue:
+    __slots__ = ("items", "tokens", "updated", "worker", "wakeup")
+
+    def __init__(self, burst: float) -> None:
+        self.items: deque[_Outgoing] = deque()
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.worker: asyncio.Task | None = None
+        self.wakeup = asyncio.Event()
+
+
+class OutboundDispatcher:
+    """NapCat send_group_msg 的异步发送队列
+
+    每个群一条队列、一个令牌桶限速；相邻的纯文字消息合并成一条发送；
+    明确没有发出的失败按指数退避重试（超时不重试，以免重复发送）；
+    队列满时先尝试合并，否则丢弃最早的消息。
+    发送结果通过 on_done(resp, error) 回调通知，处理器入队后即可返回。
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 5,
+        max_queue: int = 50,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        send_timeout: float = 15.0,
+        idle_timeout: float = 30.0,
+        on_call: OnCall | None = None,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.send_timeout = send_timeout
+        self.idle_timeout = idle_timeout
+        self.on_call = on_call
+        self._queues: dict[str, _GroupQueue] = {}
+        self._closed = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.merged = 0
+        self.dropped = 0
+        self.latency_ewma = 0.0  # enqueue → NapCat 响应，秒
+        self.latency_max = 0.0
+
+    def submit(self, call_action, group_id, message: list, on_done: OnDone | None = None) -> None:
+        """把一条消息放入群队列，立即返回"""
+        gid = str(group_id)
+        queue = self._queues.get(gid)
+        if queue is None:
+            queue = self._queues[gid] = _GroupQueue(self.burst)
+        item = _Outgoing(call_action, group_id, message, on_done)
+        tail = queue.items[-1] if queue.items else None
+        if tail is not None and item.mergeable and tail.mergeable:
+            tail.message = tail.message + [{"type": "text", "data": {"text": "\n"}}] + item.message
+            tail.callbacks.extend(item.callbacks)
+            self.merged += 1
+        else:
+            if len(queue.items) >= self.max_queue:
+                self._drop(queue.items.popleft())
+            queue.items.append(item)
+        queue.wakeup.set()
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.create_task(self._run(gid, queue))
+
+    def _drop(self, item: _Outgoing) -> None:
+        self.dropped += 1
+        error = asyncio.QueueFull("outbound queue full")
+        for cb in item.callbacks:
+            asyncio.create_task(self._notify(cb, None, error))
+
+    @staticmethod
+    async def _notify(cb: OnDone, resp, error) -> None:
+        try:
+            await cb(resp, error)
+        except Exception:
+            pass
+
+    async def _take_token(self, queue: _GroupQueue) -> None:
+        while True:
+            now = time.monotonic()
+            queue.tokens = min(self.burst, queue.tokens + (now - queue.updated) * self.rate)
+            queue.updated = now
+            if queue.tokens >= 1:
+                queue.tokens -= 1
+                return
+            await asyncio.sleep((1 - queue.tokens) / self.rate)
+
+    async def _run(self, gid: str, queue: _GroupQueue) -> None:
+        while not self._closed:
+            if not queue.items:
+                # 空闲一段时间后退出，下一次 submit 会重新拉起
+                queue.wakeup.clear()
+                try:
+                    await asyncio.wait_for(queue.wakeup.wait(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                continue
+            await self._take_token(queue)
+            if not queue.items:
+                continue
+            await self._send(queue.items.popleft())
+        if not queue.items and self._queues.get(gid) is queue:
+            del self._queues[gid]
+
+    async def _send(self, item: _Outgoing) -> None:
+        resp, error = None, None
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                resp = await asyncio.wait_for(
+                    item.call_action("send_group_msg", group_id=item.group_id, message=item.message),
+                    timeout=self.send_timeout,
+                )
+                error = None
+                if self.on_call is not None:
+                    self.on_call("send_group_msg", time.monotonic() - start, False)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                if self.on_call is not None:
+                    self.on_call("send_group_msg", time.monotonic() - start, True)
+                if not not_sent(e):
+                    break  # 可能已经发出，重试会重复发送
+                if attempt < self.max_retries:
+                    self.retried += 1
+                    await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        latency = time.monotonic() - item.enqueued_at
+        samples = self.sent + self.failed
+        self.latency_ewma = latency if not samples else self.latency_ewma * 0.9 + latency * 0.1
+        self.latency_max = max(self.latency_max, latency)
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        for cb in item.callbacks:
+            await self._notify(cb, resp, error)
+
+    def stats(self) -> dict:
+        """队列深度与发送延迟，用于调参"""
+        return {
+            "depth": {gid: len(q.items) for gid, q in self._queues.items() if q.items},
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1),
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+        }
+
+    async def close(self, drain_timeout: float = 5.0) -> None:
+        """尽量发完已入队的消息后停止所有发送任务"""
+        workers = [q.worker for q in self._queues.values() if q.worker and not q.worker.done()]
+        deadline = time.monotonic() + drain_timeout
+        while any(q.items for q in self._queues.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._closed = True
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,139 @@
+import asyncio
+
+
+class GroupOwnership:
+    """单个群的归属关系：角色ID → 用户，用户 → 角色ID集合"""
+
+    __slots__ = ("owner", "harems")
+
+    def __init__(self) -> None:
+        self.owner: dict[str, str] = {}
+        self.harems: dict[str, set[str]] = {}
+
+    def add(self, uid, cid) -> None:
+        uid, cid = str(uid), str(cid)
+        self.remove(cid)
+        self.owner[cid] = uid
+        self.harems.setdefault(uid, set()).add(cid)
+
+    def remove(self, cid) -> str | None:
+        cid = str(cid)
+        uid = self.owner.pop(cid, None)
+        if uid is not None:
+            harem = self.harems.get(uid)
+            if harem is not None:
+                harem.discard(cid)
+                if not harem:
+                    del self.harems[uid]
+        return uid
+
+    def to_json(self) -> dict:
+        return {uid: sorted(cids) for uid, cids in self.harems.items()}
+
+
+class OwnershipIndex:
+    """按群维护的角色归属索引（只在内存中）
+
+    `{gid}:{uid}:partners` 与 `{gid}:{cid}:married_to` 仍是原始数据，本索引只是
+    它们的汇总，用于强制离婚/终极轮回等需要全群视角的操作，避免逐个用户读 KV。
+    每个群第一次使用时从原始键构建一次，之后随抽卡/离婚等操作增量更新，不写回存储，
+    因此抽卡风暴中不会反复整串重写一个群的索引。
+    """
+
+    def __init__(self, kv, users=None, loader=None) -> None:
+        self.kv = kv
+        # users(gid) 返回群里的用户；未提供时读 `{gid}:user_list`
+        self._users = users
+        # loader(gid) 直接从存储后端按群查出 {uid: [cid...]}，提供时不再逐个用户读后宫
+        self._loader = loader
+        self._groups: dict[str, GroupOwnership] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._listeners: list = []
+
+    def add_listener(self, callback) -> None:
+        """注册归属变化回调 callback(gid, uid)，用于让按用户缓存的视图失效"""
+        self._listeners.append(callback)
+
+    def _changed(self, gid, *uids) -> None:
+        for uid in uids:
+            if uid is None:
+                continue
+            for callback in self._listeners:
+                callback(str(gid), str(uid))
+
+    @staticmethod
+    def _key(gid) -> str:
+        # 旧版本写回的整群索引快照，已不再使用
+        return f"{gid}:owners"
+
+    async def group(self, gid) -> GroupOwnership:
+        gid = str(gid)
+        group = self._groups.get(gid)
+        if group is not None:
+            return group
+        lock = self._locks.setdefault(gid, asyncio.Lock())
+        async with lock:
+            group = self._groups.get(gid)
+            if group is None:
+                group = await self._build(gid)
+                if await self.kv.get(self._key(gid), None) is not None:
+                    await self.kv.delete(self._key(gid))
+                self._groups[gid] = group
+        return group
+
+    async def _build(self, gid: str) -> GroupOwnership:
+        if self._loader is not None:
+            # 先把缓存里尚未写回的后宫落盘，查询结果才是最新的
+            await self.kv.flush()
+            group = GroupOwnership()
+            for uid, cids in (await self._loader(gid)).items():
+                for cid in cids:
+                    group.add(uid, cid)
+            return group
+        if self._users is not None:
+            users = list(await self._users(gid))
+        else:
+            users = await self.kv.get(f"{gid}:user_list", []) or []
+        keys = [f"{gid}:{uid}:partners" for uid in users]
+        partners = await self.kv.get_many(keys, [])
+        group = GroupOwnership()
+        for uid in users:
+            for cid in partners.get(f"{gid}:{uid}:partners") or []:
+                group.add(uid, cid)
+        return group
+
+    async def rebuild(self, gid) -> GroupOwnership:
+        """从原始键重建索引，并把 married_to 修正为与后宫列表一致"""
+        gid = str(gid)
+        group = await self._build(gid)
+        old = self._groups.get(gid)
+        self._changed(gid, *set(group.harems) | set(old.harems if old is not None else ()))
+        for cid, uid in group.owner.items():
+            if str(await self.kv.get(f"{gid}:{cid}:married_to", None)) != uid:
+                await self.kv.put(f"{gid}:{cid}:married_to", uid)
+        self._groups[gid] = group
+        return group
+
+    async def owner_of(self, gid, cid) -> str | None:
+        return (await self.group(gid)).owner.get(str(cid))
+
+    async def add(self, gid, uid, cid) -> None:
+        group = await self.group(gid)
+        previous = group.owner.get(str(cid))
+        group.add(uid, cid)
+        self._changed(gid, uid, previous)
+
+    async def remove(self, gid, cid) -> str | None:
+        uid = (await self.group(gid)).remove(cid)
+        self._changed(gid, uid)
+        return uid
+
+    async def set_harem(self, gid, uid, cids) -> None:
+        """用新的后宫列表替换某个用户的全部归属"""
+        group = await self.group(gid)
+        for cid in list(group.harems.get(str(uid), ())):
+            group.remove(cid)
+        previous = {group.owner.get(str(cid)) for cid in cids}
+        for cid in cids:
+            group.add(uid, cid)
+        self._changed(gid, uid, *previous)
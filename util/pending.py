@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+from pathlib import Path
+
+
+class _Pending:
+    __slots__ = ("kind", "data", "expires")
+
+    def __init__(self, kind: str, data: dict, expires: float) -> None:
+        self.kind = kind
+        self.data = data
+        self.expires = expires
+
+
+class PendingActions:
+    """等待贴表情回应的消息（交换请求等），按 (群, 消息ID) 保存在内存里
+
+    查找是一次字典访问；过期时间放在小顶堆里，插入和过期都是 O(log n)，
+    不维护任何需要整体重写的索引。被取走的条目在堆里惰性丢弃。
+    给了 path 时定期快照到 JSON 文件，重启后恢复未过期的条目。
+    """
+
+    def __init__(self, ttl: float, path: str | Path | None = None, snapshot_interval: float = 5) -> None:
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self.snapshot_interval = snapshot_interval
+        self._items: dict[tuple[str, str], _Pending] = {}
+        self._heap: list[tuple[float, int, tuple[str, str], _Pending]] = []
+        self._seq = 0
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _push(self, key: tuple[str, str], entry: _Pending) -> None:
+        self._seq += 1
+        heapq.heappush(self._heap, (entry.expires, self._seq, key, entry))
+        self._items[key] = entry
+
+    def expire(self, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, _, key, entry = heapq.heappop(heap)
+            if self._items.get(key) is entry:
+                del self._items[key]
+                self._dirty = True
+
+    def add(self, gid, msg_id, kind: str, data: dict, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        self.expire(now)
+        self._push((str(gid), str(msg_id)), _Pending(kind, data, now + self.ttl))
+        self._dirty = True
+
+    def get(self, gid, msg_id, now: float | None = None) -> _Pending | None:
+        """未过期的条目，没有时返回 None"""
+        entry = self._items.get((str(gid), str(msg_id)))
+        if entry is None:
+            return None
+        if entry.expires <= (time.time() if now is None else now):
+            self.expire(now)
+            return None
+        return entry
+
+    def pop(self, gid, msg_id, now: float | None = None) -> _Pending | None:
+        """取走条目（只会被处理一次）"""
+        entry = self.get(gid, msg_id, now)
+        if entry is not None:
+            del self._items[(str(gid), str(msg_id))]
+            self._dirty = True
+        return entry
+
+    def to_json(self, now: float | None = None) -> list:
+        self.expire(now)
+        return [
+            [gid, msg_id, entry.kind, entry.data, round(entry.expires, 3)]
+            for (gid, msg_id), entry in self._items.items()
+        ]
+
+    def load(self) -> None:
+        if self.path is None or not self.path.is_file():
+            return
+        try:
+            rows = json.loads(self.path.read_text(encoding="utf-8")) or []
+        except Exception:
+            return
+        now = time.time()
+        for gid, msg_id, kind, data, expires in rows:
+            key = (str(gid), str(msg_id))
+            if float(expires) > now and key not in self._items:
+                self._push(key, _Pending(kind, data, float(expires)))
+
+    def _write(self, rows: list) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    async def snapshot(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self.to_json())
+        except Exception:
+            self._dirty = True
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def start(self) -> None:
+        """读取快照并启动定时快照任务（未开启持久化时什么也不做）"""
+        if self.path is None:
+            return
+        await asyncio.to_thread(self.load)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        await self.snapshot()
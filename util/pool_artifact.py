@@ -0,0 +1,328 @@
+"""卡池二进制产物：预先编译好的卡池，启动时 mmap 打开，按需解码
+
+文件布局（小端，各段按 8 字节对齐）：
+
+    头部      HEADER，含魔数、版本、各段偏移和来源标记
+    ids       int32[count]，角色ID，按热度降序排列
+    heat      int32[count]
+    records   定长记录 REC[count]：名字/别名/作品/性别的字符串下标，图片区间
+    images    IMG[n_images]：URL 前缀字符串下标 + 后缀字符串下标
+    id 索引   int32[n_index] 排好序的ID，与 uint32[n_index] 对应下标（重复ID只收第一个）
+    重复      uint32[n_dups]，因ID重复而无法按ID查到的下标
+    字符串表  uint32[n_strings + 1] 偏移 + UTF-8 数据，下标 0 表示缺失
+
+多个机器人进程在同一台机器上打开同一个文件时共享页缓存。
+
+命令行用法：
+    python util/pool_artifact.py build util/characters.json pool.bin
+    python util/pool_artifact.py validate pool.bin util/characters.json
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from collections.abc import Sequence
+
+try:
+    from .pool_store import PoolStore, CharacterRecord, _ABSENT
+except ImportError:  # 作为脚本直接运行
+    from pool_store import PoolStore, CharacterRecord, _ABSENT
+
+MAGIC = b"CCBPOOL\x00"
+VERSION = 2
+HEADER = struct.Struct("<8s6I9II64s")
+REC = struct.Struct("<6I")  # name, alias, source, gender, img_start, img_end
+IMG = struct.Struct("<2I")  # prefix, suffix
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def source_tag(kind: str, digest: str) -> str:
+    """产物对应的数据源标记，与当前数据源不一致时产物作废"""
+    return f"{kind}:{digest}"
+
+
+def file_tag(path: str | Path) -> str:
+    """按文件内容生成来源标记，用于 characters.json"""
+    return source_tag("json", hashlib.sha1(Path(path).read_bytes()).hexdigest())
+
+
+def _align(buf: bytearray) -> int:
+    buf.extend(b"\x00" * (-len(buf) % 8))
+    return len(buf)
+
+
+def build_artifact(chars, path: str | Path, tag: str, base_url: str | None = None) -> int:
+    """把角色列表编译为二进制产物并原子替换到 path，返回角色数"""
+    # sorted 是稳定排序，与 DrawEngine 的排名一致；按热度排好后加载时排序几乎不花时间
+    ranked = sorted(chars, key=lambda c: -int(c.get("heat") or 0))
+    store = PoolStore(ranked, base_url=base_url)
+    count = len(store)
+
+    strings: list[bytes] = [b""]
+    string_ids: dict[str, int] = {}
+
+    def intern(value) -> int:
+        if value is None:
+            return 0
+        idx = string_ids.get(value)
+        if idx is None:
+            idx = string_ids[value] = len(strings)
+            strings.append(value.encode("utf-8"))
+        return idx
+
+    base_idx = intern(store.base_url)
+    records = bytearray()
+    for pos in range(count):
+        records += REC.pack(
+            intern(store.names[pos]),
+            intern(store.aliases[pos]),
+            intern(store._strings[store._source_idx[pos]]),
+            intern(store._strings[store._gender_idx[pos]]),
+            store._img_start[pos],
+            store._img_start[pos + 1],
+        )
+    images = bytearray()
+    for prefix, suffix in zip(store._img_prefix, store._img_suffix):
+        images += IMG.pack(intern(store._strings[prefix]), intern(suffix))
+
+    # 重复ID只索引排名最靠前的一个
+    first: dict[int, int] = {}
+    for pos, cid in enumerate(store.ids):
+        first.setdefault(cid, pos)
+    index_ids = array("i", sorted(first))
+    index_pos = array("I", (first[cid] for cid in index_ids))
+    dups = array("I", store.duplicates)
+
+    offsets = array("I", [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    for arr in (store.ids, store.heat, index_ids, index_pos, dups, offsets):
+        if sys.byteorder != "little":
+            arr.byteswap()
+
+    body = bytearray(b"\x00" * HEADER.size)
+    sections = []
+    for chunk in (store.ids.tobytes(), store.heat.tobytes(), records, images,
+                  index_ids.tobytes(), index_pos.tobytes(), dups.tobytes(), offsets.tobytes(), b"".join(strings)):
+        sections.append(_align(body))
+        body += chunk
+    HEADER.pack_into(
+        body, 0, MAGIC, VERSION, count, len(strings), len(store._img_suffix), len(index_ids), len(dups),
+        *sections, base_idx, tag.encode("utf-8")[:64],
+    )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, path)
+    return count
+
+
+class MappedPool(Sequence):
+    """mmap 打开的卡池产物，接口与 PoolStore 相同，字段在读取时才解码"""
+
+    KEYS = PoolStore.KEYS
+
+    def __init__(self, path: str | Path) -> None:
+        if sys.byteorder != "little":
+            raise ArtifactError("artifact requires a little-endian host")
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size:
+            raise ArtifactError("artifact truncated")
+        (magic, version, count, n_strings, n_images, n_index, n_dups, ids_off, heat_off, rec_off, img_off,
+         idx_ids_off, idx_pos_off, dup_off, str_off_off, str_off, base_idx, tag) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ArtifactError("bad magic")
+        if version != VERSION:
+            raise ArtifactError(f"unsupported version {version}")
+        if str_off > len(self._mm):
+            raise ArtifactError("artifact truncated")
+        self.tag = tag.rstrip(b"\x00").decode("utf-8", errors="replace")
+        self._count = count
+        self._n_index = n_index
+        self._n_images = n_images
+        view = memoryview(self._mm)
+        self.ids = view[ids_off:ids_off + 4 * count].cast("i")
+        self.heat = view[heat_off:heat_off + 4 * count].cast("i")
+        self._rec_off = rec_off
+        self._img_off = img_off
+        self._index_ids = view[idx_ids_off:idx_ids_off + 4 * n_index].cast("i")
+        self._index_pos = view[idx_pos_off:idx_pos_off + 4 * n_index].cast("I")
+        self._str_offsets = view[str_off_off:str_off_off + 4 * (n_strings + 1)].cast("I")
+        self._str_base = str_off
+        if str_off + self._str_offsets[n_strings] > len(self._mm):
+            raise ArtifactError("artifact truncated")
+        self.base_url = self._string(base_idx)
+        self.duplicates: list[int] = view[dup_off:dup_off + 4 * n_dups].cast("I").tolist()
+
+    def _string(self, idx: int) -> str | None:
+        if idx == 0:
+            return None
+        start = self._str_base + self._str_offsets[idx]
+        end = self._str_base + self._str_offsets[idx + 1]
+        return self._mm[start:end].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [CharacterRecord(self, p) for p in range(self._count)[pos]]
+        if pos < 0:
+            pos += self._count
+        if not 0 <= pos < self._count:
+            raise IndexError(pos)
+        return CharacterRecord(self, pos)
+
+    def position(self, cid: int) -> int | None:
+        """在排好序的ID索引上二分查找"""
+        i = bisect_left(self._index_ids, cid)
+        if i < self._n_index and self._index_ids[i] == cid:
+            return self._index_pos[i]
+        return None
+
+    def _record(self, pos: int) -> tuple:
+        return REC.unpack_from(self._mm, self._rec_off + pos * REC.size)
+
+    def _image(self, i: int) -> str:
+        prefix, suffix = IMG.unpack_from(self._mm, self._img_off + i * IMG.size)
+        return (self._string(prefix) or "") + (self._string(suffix) or "")
+
+    def images(self, pos: int) -> list[str]:
+        _, _, _, _, start, end = self._record(pos)
+        return [self._image(i) for i in range(start, end)]
+
+    def field(self, pos: int, key: str):
+        """读取一个字段；不存在的字段返回 _ABSENT"""
+        if key == "id":
+            return self.ids[pos]
+        if key == "heat":
+            return self.heat[pos]
+        name, alias, source, gender, start, end = self._record(pos)
+        if key == "name":
+            return self._string(name) or ""
+        if key == "alias":
+            return self._string(alias)
+        if key == "source":
+            return _ABSENT if source == 0 else self._string(source)
+        if key == "gender":
+            return self._string(gender)
+        if key == "image":
+            return [self._image(i) for i in range(start, end)]
+        if key == "image_url":
+            return self._image(start) if start < end else None
+        if key == "filepath":
+            url = self._image(start) if start < end else None
+            if self.base_url and url and url.startswith(self.base_url):
+                return url[len(self.base_url):]
+            return _ABSENT
+        return _ABSENT
+
+
+def open_artifact(path: str | Path, tag: str | None = None) -> MappedPool | None:
+    """打开产物；文件不存在、损坏或来源标记不符时返回 None"""
+    path = Path(path)
+    if not path.is_file():
+        return None
+    try:
+        pool = MappedPool(path)
+    except (OSError, ValueError, struct.error, ArtifactError):
+        return None
+    if tag is not None and pool.tag != tag:
+        return None
+    return pool
+
+
+def validate_artifact(path: str | Path, chars, limit: int = 20) -> list[str]:
+    """逐条比对产物与源数据，返回发现的问题（最多 limit 条），为空表示一致"""
+    problems: list[str] = []
+    try:
+        pool = MappedPool(path)
+    except (OSError, ValueError, struct.error, ArtifactError) as e:
+        return [f"cannot open artifact: {e!r}"]
+    expected = PoolStore(sorted(chars, key=lambda c: -int(c.get("heat") or 0)), base_url=pool.base_url)
+    if len(pool) != len(expected):
+        problems.append(f"count mismatch: artifact {len(pool)}, source {len(expected)}")
+    for pos in range(min(len(pool), len(expected))):
+        got, want = dict(pool[pos]), dict(expected[pos])
+        if got != want:
+            keys = sorted(k for k in set(got) | set(want) if got.get(k) != want.get(k))
+            problems.append(f"record {pos} (id {want.get('id')}) differs in {keys}")
+            if len(problems) >= limit:
+                return problems
+    if pool.duplicates != expected.duplicates:
+        problems.append(f"duplicate positions differ: artifact {pool.duplicates[:limit]}, source {expected.duplicates[:limit]}")
+    ids = list(pool._index_ids)
+    if ids != sorted(set(ids)):
+        problems.append("id index is not strictly sorted")
+    for cid, pos in zip(ids, pool._index_pos):
+        if pos >= len(pool) or pool.ids[pos] != cid:
+            problems.append(f"id index entry {cid} points to position {pos}")
+            if len(problems) >= limit:
+                break
+    for pos, cid in enumerate(expected.ids):
+        if expected.position(cid) == pos and pool.position(cid) != pos:
+            problems.append(f"id {cid} not found at position {pos}")
+            if len(problems) >= limit:
+                break
+    return problems[:limit]
+
+
+def load_json_source(path: str | Path) -> list[dict]:
+    """读取 characters.json 格式的角色列表"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    chars = []
+    for item in data if isinstance(data, list) else []:
+        try:
+            char = dict(item)
+            char["id"] = int(item["id"])
+        except Exception:
+            continue
+        images = item.get("image") or []
+        char["image"] = images
+        char["image_url"] = images[0] if images else None
+        chars.append(char)
+    return chars
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="编译/校验卡池二进制产物")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="从 characters.json 编译产物")
+    build.add_argument("source")
+    build.add_argument("output")
+    check = sub.add_parser("validate", help="校验产物与 characters.json 是否一致")
+    check.add_argument("artifact")
+    check.add_argument("source")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        count = build_artifact(load_json_source(args.source), args.output, file_tag(args.source))
+        print(f"wrote {count} characters to {args.output}")
+        return 0
+    problems = validate_artifact(args.artifact, load_json_source(args.source))
+    pool = open_artifact(args.artifact)
+    if pool is not None and pool.tag != file_tag(args.source):
+        problems.insert(0, f"source tag mismatch: {pool.tag}")
+    for problem in problems:
+        print(problem)
+    print("ok" if not problems else f"{len(problems)} problem(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
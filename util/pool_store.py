@@ -0,0 +1,165 @@
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+
+_ABSENT = object()
+
+
+class CharacterRecord(Mapping):
+    """卡池中一个角色的只读视图，按需构造，接口与原来的角色 dict 相同"""
+
+    __slots__ = ("_store", "_pos")
+
+    def __init__(self, store: "PoolStore", pos: int) -> None:
+        self._store = store
+        self._pos = pos
+
+    def __getitem__(self, key):
+        value = self._store.field(self._pos, key)
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._store.field(self._pos, key)
+        return default if value is _ABSENT else value
+
+    def __iter__(self):
+        return (k for k in self._store.KEYS if self._store.field(self._pos, k) is not _ABSENT)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CharacterRecord):
+            return other._store is self._store and other._pos == self._pos
+        return Mapping.__eq__(self, other)
+
+    def __hash__(self) -> int:
+        return hash((id(self._store), self._pos))
+
+    def __repr__(self) -> str:
+        return f"CharacterRecord({dict(self)!r})"
+
+
+class PoolStore(Sequence):
+    """列式存储的卡池
+
+    id/热度 用 array('i')，作品名与性别驻留到去重表里只存下标，图片 URL
+    拆成 共享前缀下标 + 后缀，名字/别名直接存字符串列表。一万多个角色常驻
+    内存只有几个数组和字符串表，读取时由 CharacterRecord 按需拼出字段。
+    """
+
+    KEYS = ("id", "name", "alias", "source", "heat", "gender", "image", "image_url", "filepath")
+    URL_PREFIX_SLASHES = 5  # https://host/a/b/ 作为共享前缀
+
+    def __init__(self, chars, base_url: str | None = None) -> None:
+        self.base_url = base_url.rstrip("/") + "/" if base_url else None
+        self.ids = array("i")
+        self.heat = array("i")
+        self.names: list[str] = []
+        self.aliases: list[str | None] = []
+        self._source_idx = array("i")
+        self._gender_idx = array("i")
+        self._img_start = array("i", [0])
+        self._img_prefix = array("i")
+        self._img_suffix: list[str] = []
+        self._strings: list[str | None] = [None]  # 下标 0 表示缺失
+        self._string_ids: dict[str, int] = {}
+        self._positions: dict[int, int] = {}  # 角色ID → 下标，重复ID保留第一个
+        self.duplicates: list[int] = []  # 因ID重复而无法按ID查到的下标
+        for c in chars:
+            self._append(c)
+        self._strings = tuple(self._strings)
+        del self._string_ids
+
+    def _intern(self, value) -> int:
+        if value is None:
+            return 0
+        value = sys.intern(str(value))
+        idx = self._string_ids.get(value)
+        if idx is None:
+            idx = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return idx
+
+    def _append(self, c) -> None:
+        cid = int(c["id"])
+        if cid in self._positions:
+            self.duplicates.append(len(self.ids))
+        else:
+            self._positions[cid] = len(self.ids)
+        self.ids.append(cid)
+        self.heat.append(int(c.get("heat") or 0))
+        self.names.append(c.get("name") or "")
+        self.aliases.append(c.get("alias") or None)
+        self._source_idx.append(self._intern(c.get("source")))
+        self._gender_idx.append(self._intern(c.get("gender")))
+        images = list(c.get("image") or [])
+        if not images and c.get("image_url"):
+            images = [c["image_url"]]
+        for url in images:
+            cut = -1
+            for _ in range(self.URL_PREFIX_SLASHES):
+                cut = url.find("/", cut + 1)
+                if cut < 0:
+                    break
+            if cut < 0:
+                self._img_prefix.append(0)
+                self._img_suffix.append(url)
+            else:
+                self._img_prefix.append(self._intern(url[: cut + 1]))
+                self._img_suffix.append(url[cut + 1:])
+        self._img_start.append(len(self._img_suffix))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [CharacterRecord(self, p) for p in range(len(self))[pos]]
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError(pos)
+        return CharacterRecord(self, pos)
+
+    def position(self, cid: int) -> int | None:
+        """按角色ID查下标"""
+        return self._positions.get(cid)
+
+    def images(self, pos: int) -> list[str]:
+        strings = self._strings
+        return [
+            (strings[self._img_prefix[i]] or "") + self._img_suffix[i]
+            for i in range(self._img_start[pos], self._img_start[pos + 1])
+        ]
+
+    def field(self, pos: int, key: str):
+        """读取一个字段；不存在的字段返回 _ABSENT"""
+        if key == "id":
+            return self.ids[pos]
+        if key == "name":
+            return self.names[pos]
+        if key == "heat":
+            return self.heat[pos]
+        if key == "alias":
+            return self.aliases[pos]
+        if key == "source":
+            value = self._strings[self._source_idx[pos]]
+            return _ABSENT if value is None else value
+        if key == "gender":
+            return self._strings[self._gender_idx[pos]]
+        if key == "image":
+            return self.images(pos)
+        if key == "image_url":
+            start = self._img_start[pos]
+            if start == self._img_start[pos + 1]:
+                return None
+            return (self._strings[self._img_prefix[start]] or "") + self._img_suffix[start]
+        if key == "filepath":
+            url = self.field(pos, "image_url")
+            if self.base_url and url and url.startswith(self.base_url):
+                return url[len(self.base_url):]
+            return _ABSENT
+        return _ABSENT
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from pathlib import Path
+
+
+class _UserQuota:
+    __slots__ = ("times", "warned")
+
+    def __init__(self, times=()) -> None:
+        self.times: deque[float] = deque(times)
+        self.warned = False
+
+
+class QuotaEngine:
+    """按 (群, 用户) 计数的抽卡配额：滑动窗口次数限制 + 抽卡冷却
+
+    每个用户只保存窗口内最近几次抽卡的时间戳（不超过上限次数），检查和扣减都是
+    O(1) 的内存操作，不读写存储。状态定期快照到 JSON 文件，重启后恢复。
+    """
+
+    OK = "ok"
+    LIMITED = "limit"  # 达到上限，需要提示
+    SILENT = "silent"  # 达到上限且已提示过，不再回复
+    COOLDOWN = "cooldown"
+
+    def __init__(self, path: str | Path | None = None, window: float = 3600, snapshot_interval: float = 60, store=None) -> None:
+        self.path = Path(path) if path else None
+        # 提供 read_quotas()/write_quotas() 的存储后端，设置后快照写进数据库而不是文件
+        self.store = store
+        self.window = window
+        self.snapshot_interval = snapshot_interval
+        self._users: dict[tuple[str, str], _UserQuota] = {}
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+
+    def _trim(self, quota: _UserQuota, now: float, limit: int) -> None:
+        times = quota.times
+        while times and (now - times[0] >= self.window or len(times) > limit):
+            times.popleft()
+
+    def acquire(self, gid, uid, limit: int, cooldown: float = 0, now: float | None = None) -> tuple[str, int, float]:
+        """尝试消耗一次抽卡，返回 (状态, 剩余次数, 需等待秒数)"""
+        now = time.time() if now is None else now
+        key = (str(gid), str(uid))
+        quota = self._users.get(key)
+        if quota is None:
+            quota = self._users[key] = _UserQuota()
+        limit = max(1, int(limit))
+        self._trim(quota, now, limit)
+        times = quota.times
+        if len(times) >= limit:
+            wait = times[0] + self.window - now
+            if quota.warned:
+                return self.SILENT, 0, wait
+            quota.warned = True
+            return self.LIMITED, 0, wait
+        if cooldown and times and now - times[-1] < cooldown:
+            return self.COOLDOWN, limit - len(times), times[-1] + cooldown - now
+        times.append(now)
+        quota.warned = False
+        self._dirty = True
+        return self.OK, limit - len(times), 0.0
+
+    def refund(self, gid, uid) -> None:
+        """退回最近一次消耗（抽卡没有完成时）"""
+        quota = self._users.get((str(gid), str(uid)))
+        if quota is not None and quota.times:
+            quota.times.pop()
+            self._dirty = True
+
+    def reset(self, gid, uid) -> None:
+        """清空用户的次数和冷却"""
+        if self._users.pop((str(gid), str(uid)), None) is not None:
+            self._dirty = True
+
+    def to_json(self, now: float | None = None) -> dict:
+        now = time.time() if now is None else now
+        data: dict[str, dict[str, list[float]]] = {}
+        for (gid, uid), quota in list(self._users.items()):
+            times = [t for t in quota.times if now - t < self.window]
+            if not times:
+                # 窗口外的用户不必再记着
+                del self._users[(gid, uid)]
+                continue
+            data.setdefault(gid, {})[uid] = [round(t, 3) for t in times]
+        return data
+
+    def load(self) -> None:
+        try:
+            if self.store is not None:
+                data = self.store.read_quotas()
+            elif self.path is not None and self.path.is_file():
+                data = json.loads(self.path.read_text(encoding="utf-8")) or {}
+            else:
+                return
+        except Exception:
+            return
+        now = time.time()
+        for gid, users in data.items():
+            for uid, times in (users or {}).items():
+                times = sorted(float(t) for t in times or [] if now - float(t) < self.window)
+                if times:
+                    self._users.setdefault((gid, uid), _UserQuota(times))
+
+    def _write(self, data: dict) -> None:
+        if self.store is not None:
+            self.store.write_quotas(data)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    async def snapshot(self) -> None:
+        """有变化时把当前配额写入快照文件"""
+        if (self.path is None and self.store is None) or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write, self.to_json())
+        except Exception:
+            self._dirty = True
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.snapshot()
+
+    async def start(self) -> None:
+        """读取快照并启动定时快照任务"""
+        await asyncio.to_thread(self.load)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        await self.snapshot()
@@ -0,0 +1,91 @@
+import unicodedata
+from array import array
+
+
+def normalize(text) -> str:
+    """全半角/大小写归一"""
+    return unicodedata.normalize("NFKC", str(text or "")).lower().strip()
+
+
+class SearchIndex:
+    """角色名/别名/作品名的 n-gram 倒排索引
+
+    单字查询走单字表，其余取最稀有的二元组倒排表再做子串校验（中文名多为
+    2~4 字，二元组比三元组召回更好）。倒排表按热度降序存放，结果天然按热度排序；
+    排名依次为：完全匹配 > 前缀匹配 > 名字/别名包含 > 作品名包含。
+    """
+
+    FIELDS = ("name", "alias", "source")
+
+    def __init__(self, store, order) -> None:
+        self._store = store
+        self._order = order
+        self._texts: list[tuple[str, ...]] = []
+        self._exact: dict[str, array] = {}
+        unigrams: dict[str, list[int]] = {}
+        bigrams: dict[str, list[int]] = {}
+        for pos, idx in enumerate(order):
+            char = store[idx]
+            texts = tuple(self._norm(char.get(f)) for f in self.FIELDS)
+            self._texts.append(texts)
+            seen1, seen2 = set(), set()
+            for i, text in enumerate(texts):
+                if not text:
+                    continue
+                seen1.update(text)
+                seen2.update(text[j:j + 2] for j in range(len(text) - 1))
+            # 名字与别名相同时只记一次
+            for text in {t for t in texts[:2] if t}:
+                self._exact.setdefault(text, array("i")).append(pos)
+            for g in seen1:
+                unigrams.setdefault(g, []).append(pos)
+            for g in seen2:
+                bigrams.setdefault(g, []).append(pos)
+        self._unigrams = {g: array("i", p) for g, p in unigrams.items()}
+        self._bigrams = {g: array("i", p) for g, p in bigrams.items()}
+
+    @staticmethod
+    def _norm(value) -> str:
+        # 归一后与原文相同时复用原字符串，不额外占内存
+        text = normalize(value)
+        return value if isinstance(value, str) and text == value else text
+
+    def _candidates(self, key: str):
+        """按热度顺序产出可能命中的下标（取最短的倒排表，命中与否由子串校验决定）"""
+        if len(key) == 1:
+            return self._unigrams.get(key, ())
+        shortest = None
+        for j in range(len(key) - 1):
+            p = self._bigrams.get(key[j:j + 2])
+            if p is None:
+                return ()
+            if shortest is None or len(p) < len(shortest):
+                shortest = p
+        return shortest
+
+    def search(self, keyword: str, k: int | None = None) -> list[dict]:
+        """返回排好序的前 k 个结果，k 为 None 时返回全部"""
+        key = normalize(keyword)
+        if not key:
+            return []
+        exact = list(self._exact.get(key, ()))
+        seen = set(exact)
+        prefix, name_hits, source_hits = [], [], []
+        limit = k if k is not None else -1
+        for pos in self._candidates(key):
+            # 前两档已凑满 k 个，后面的候选热度更低、档位不会更高
+            if limit >= 0 and len(exact) + len(prefix) >= limit:
+                break
+            if pos in seen:
+                continue
+            name, alias, source = self._texts[pos]
+            if name.startswith(key) or alias.startswith(key):
+                prefix.append(pos)
+            elif key in name or key in alias:
+                name_hits.append(pos)
+            elif key in source:
+                source_hits.append(pos)
+        ordered = exact + prefix + name_hits + source_hits
+        if k is not None:
+            ordered = ordered[:k]
+        return [self._store[self._order[pos]] for pos in ordered]
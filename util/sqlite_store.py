@@ -0,0 +1,325 @@
+import json
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS marriages (gid TEXT NOT NULL, cid TEXT NOT NULL, uid TEXT NOT NULL, PRIMARY KEY (gid, cid));
+CREATE INDEX IF NOT EXISTS marriages_by_user ON marriages (gid, uid);
+CREATE TABLE IF NOT EXISTS harems (gid TEXT NOT NULL, uid TEXT NOT NULL, cid TEXT NOT NULL, pos INTEGER NOT NULL, PRIMARY KEY (gid, uid, cid));
+CREATE INDEX IF NOT EXISTS harems_by_char ON harems (gid, cid);
+CREATE TABLE IF NOT EXISTS wishes (gid TEXT NOT NULL, uid TEXT NOT NULL, cid TEXT NOT NULL, pos INTEGER NOT NULL, PRIMARY KEY (gid, uid, cid));
+CREATE INDEX IF NOT EXISTS wishes_by_char ON wishes (gid, cid);
+CREATE TABLE IF NOT EXISTS favourites (gid TEXT NOT NULL, uid TEXT NOT NULL, cid TEXT NOT NULL, PRIMARY KEY (gid, uid));
+CREATE TABLE IF NOT EXISTS quotas (gid TEXT NOT NULL, uid TEXT NOT NULL, ts REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS quotas_by_user ON quotas (gid, uid);
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS migrated (gid TEXT PRIMARY KEY, users INTEGER NOT NULL, rows INTEGER NOT NULL, ts REAL NOT NULL);
+"""
+
+# 所有语句集中在这里，连接的语句缓存会把它们各编译一次后复用
+SQL = {
+    "marriage_get": "SELECT uid FROM marriages WHERE gid = ? AND cid = ?",
+    "marriage_put": "INSERT INTO marriages (gid, cid, uid) VALUES (?, ?, ?) ON CONFLICT (gid, cid) DO UPDATE SET uid = excluded.uid",
+    "marriage_del": "DELETE FROM marriages WHERE gid = ? AND cid = ?",
+    "marriage_init": "INSERT OR IGNORE INTO marriages (gid, cid, uid) VALUES (?, ?, ?)",
+    "harem_get": "SELECT cid, pos FROM harems WHERE gid = ? AND uid = ? ORDER BY pos",
+    "harem_put": "INSERT INTO harems (gid, uid, cid, pos) VALUES (?, ?, ?, ?) ON CONFLICT (gid, uid, cid) DO UPDATE SET pos = excluded.pos",
+    "harem_del_one": "DELETE FROM harems WHERE gid = ? AND uid = ? AND cid = ?",
+    "harem_del": "DELETE FROM harems WHERE gid = ? AND uid = ?",
+    "harem_init": "INSERT OR IGNORE INTO harems (gid, uid, cid, pos) VALUES (?, ?, ?, ?)",
+    "harem_group": "SELECT uid, cid FROM harems WHERE gid = ? ORDER BY uid, pos",
+    "wish_get": "SELECT cid, pos FROM wishes WHERE gid = ? AND uid = ? ORDER BY pos",
+    "wish_put": "INSERT INTO wishes (gid, uid, cid, pos) VALUES (?, ?, ?, ?) ON CONFLICT (gid, uid, cid) DO UPDATE SET pos = excluded.pos",
+    "wish_del_one": "DELETE FROM wishes WHERE gid = ? AND uid = ? AND cid = ?",
+    "wish_del": "DELETE FROM wishes WHERE gid = ? AND uid = ?",
+    "wish_init": "INSERT OR IGNORE INTO wishes (gid, uid, cid, pos) VALUES (?, ?, ?, ?)",
+    "wishers": "SELECT uid FROM wishes WHERE gid = ? AND cid = ? ORDER BY rowid",
+    "fav_get": "SELECT cid FROM favourites WHERE gid = ? AND uid = ?",
+    "fav_put": "INSERT INTO favourites (gid, uid, cid) VALUES (?, ?, ?) ON CONFLICT (gid, uid) DO UPDATE SET cid = excluded.cid",
+    "fav_del": "DELETE FROM favourites WHERE gid = ? AND uid = ?",
+    "fav_init": "INSERT OR IGNORE INTO favourites (gid, uid, cid) VALUES (?, ?, ?)",
+    "kv_get": "SELECT value FROM kv WHERE key = ?",
+    "kv_put": "INSERT INTO kv (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+    "kv_del": "DELETE FROM kv WHERE key = ?",
+    "kv_init": "INSERT OR IGNORE INTO kv (key, value) VALUES (?, ?)",
+    "quota_all": "SELECT gid, uid, ts FROM quotas ORDER BY gid, uid, ts",
+    "quota_clear": "DELETE FROM quotas",
+    "quota_put": "INSERT INTO quotas (gid, uid, ts) VALUES (?, ?, ?)",
+    "migrated_all": "SELECT gid FROM migrated",
+    "migrated_put": "INSERT OR REPLACE INTO migrated (gid, users, rows, ts) VALUES (?, ?, ?, strftime('%s', 'now'))",
+}
+
+# KV 键 `{gid}:{x}:{kind}` 中映射到表的后缀
+RELATIONAL = ("married_to", "partners", "wish_list", "wished_by", "fav")
+# 按用户迁移的其余键，原样放进 kv 表
+USER_KEYS = ("last_claim",)
+GROUP_KEYS = ("config", "user_list")
+
+
+def _route(key: str) -> tuple[str, str, str | None]:
+    parts = key.rsplit(":", 2)
+    if len(parts) == 3 and parts[2] in RELATIONAL:
+        return parts[2], parts[0], parts[1]
+    return "kv", key.split(":", 1)[0], None
+
+
+class SqliteStore:
+    """游戏数据的 SQLite 后端（WAL 模式），接口与 AstrBot KV 相同
+
+    插件仍按 `{gid}:{uid}:partners` 这样的键读写，本类把婚姻、后宫、愿望单、最爱
+    映射到带 (gid, uid)/(gid, cid) 索引的表里：写入时只对变化的行做单行 upsert/删除，
+    不再整串重写；`wished_by` 直接由 wishes 表按 (gid, cid) 索引查出。其余键存进通用
+    的 kv 表。所有 SQL 在同一个后台线程上执行，批量写回在一个事务里完成。
+
+    首次访问某个群（或启动时的全量迁移）时，从 legacy_get（AstrBot KV）流式读出该群
+    的数据写入各表，完成后记在 migrated 表里，之后不再读旧 KV。
+    """
+
+    def __init__(self, path: str | Path, legacy_get=None, known_users=None, batch_rows: int = 2000) -> None:
+        self.path = Path(path)
+        self.legacy_get = legacy_get
+        # known_users(gid) 返回本地已知的发言用户，与旧的 user_list 合并后作为迁移范围
+        self.known_users = known_users
+        self.batch_rows = batch_rows
+        self._db: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ccb-sqlite")
+        self._migrated: set[str] = set()
+        self._migrating: dict[str, asyncio.Task] = {}
+
+    # ---- 连接 ----
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self.path), check_same_thread=False, cached_statements=len(SQL) * 2)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        self._db = db
+        self._migrated = {row[0] for row in db.execute(SQL["migrated_all"])}
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _call(self, fn, *args):
+        """在其他线程中同步调用（如配额快照线程）"""
+        return self._executor.submit(fn, *args).result()
+
+    async def open(self) -> None:
+        await self._run(self._open)
+
+    async def close(self) -> None:
+        # 没迁移完的群下次启动会重新迁移（迁移是幂等的）
+        for task in list(self._migrating.values()):
+            task.cancel()
+        await asyncio.gather(*self._migrating.values(), return_exceptions=True)
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=True)
+
+    # ---- 读 ----
+
+    def _get(self, key: str, default):
+        db = self._db
+        kind, gid, x = _route(key)
+        if kind == "married_to":
+            row = db.execute(SQL["marriage_get"], (gid, x)).fetchone()
+            return row[0] if row else default
+        if kind == "partners":
+            rows = db.execute(SQL["harem_get"], (gid, x)).fetchall()
+            return [cid for cid, _ in rows] if rows else default
+        if kind == "wish_list":
+            rows = db.execute(SQL["wish_get"], (gid, x)).fetchall()
+            return [cid for cid, _ in rows] if rows else default
+        if kind == "wished_by":
+            rows = db.execute(SQL["wishers"], (gid, x)).fetchall()
+            return [uid for (uid,) in rows] if rows else default
+        if kind == "fav":
+            row = db.execute(SQL["fav_get"], (gid, x)).fetchone()
+            return row[0] if row else default
+        row = db.execute(SQL["kv_get"], (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    async def get(self, key: str, default=None):
+        await self._ensure_migrated(_route(key)[1])
+        return await self._run(self._get, key, default)
+
+    def _group_harems(self, gid: str) -> dict[str, list[str]]:
+        harems: dict[str, list[str]] = {}
+        for uid, cid in self._db.execute(SQL["harem_group"], (gid,)):
+            harems.setdefault(uid, []).append(cid)
+        return harems
+
+    async def group_harems(self, gid) -> dict[str, list[str]]:
+        """一次索引查询取出整群的后宫，代替逐个用户读 partners"""
+        gid = str(gid)
+        await self._ensure_migrated(gid)
+        return await self._run(self._group_harems, gid)
+
+    # ---- 写 ----
+
+    @staticmethod
+    def _sync_list(db, get_sql: str, put_sql: str, del_sql: str, gid: str, uid: str, values) -> None:
+        """只写变化的行：新增/挪位的 upsert，移除的删除"""
+        current = dict(db.execute(get_sql, (gid, uid)).fetchall())
+        seen = set()
+        for pos, cid in enumerate(str(v) for v in values or []):
+            if cid in seen:
+                continue
+            seen.add(cid)
+            if current.get(cid) != pos:
+                db.execute(put_sql, (gid, uid, cid, pos))
+        for cid in current.keys() - seen:
+            db.execute(del_sql, (gid, uid, cid))
+
+    def _write(self, key: str, value, deleted: bool) -> None:
+        db = self._db
+        kind, gid, x = _route(key)
+        if kind == "married_to":
+            if deleted or value is None:
+                db.execute(SQL["marriage_del"], (gid, x))
+            else:
+                db.execute(SQL["marriage_put"], (gid, x, str(value)))
+        elif kind == "partners":
+            if deleted:
+                db.execute(SQL["harem_del"], (gid, x))
+            else:
+                self._sync_list(db, SQL["harem_get"], SQL["harem_put"], SQL["harem_del_one"], gid, x, value)
+        elif kind == "wish_list":
+            if deleted:
+                db.execute(SQL["wish_del"], (gid, x))
+            else:
+                self._sync_list(db, SQL["wish_get"], SQL["wish_put"], SQL["wish_del_one"], gid, x, value)
+        elif kind == "wished_by":
+            pass  # 由 wishes 表派生
+        elif kind == "fav":
+            if deleted or value is None:
+                db.execute(SQL["fav_del"], (gid, x))
+            else:
+                db.execute(SQL["fav_put"], (gid, x, str(value)))
+        elif deleted:
+            db.execute(SQL["kv_del"], (key,))
+        else:
+            db.execute(SQL["kv_put"], (key, json.dumps(value, ensure_ascii=False, default=list)))
+
+    def _write_batch(self, items) -> None:
+        db = self._db
+        with db:
+            for key, value, deleted in items:
+                self._write(key, value, deleted)
+
+    async def write_batch(self, items: list[tuple[str, object, bool]]) -> None:
+        """在一个事务里写入 (键, 值, 是否删除)"""
+        for gid in {_route(key)[1] for key, _, _ in items}:
+            await self._ensure_migrated(gid)
+        await self._run(self._write_batch, items)
+
+    async def put(self, key: str, value) -> None:
+        await self.write_batch([(key, value, False)])
+
+    async def delete(self, key: str) -> None:
+        await self.write_batch([(key, None, True)])
+
+    # ---- 配额 ----
+
+    def _read_quotas(self) -> dict:
+        data: dict[str, dict[str, list[float]]] = {}
+        for gid, uid, ts in self._db.execute(SQL["quota_all"]):
+            data.setdefault(gid, {}).setdefault(uid, []).append(ts)
+        return data
+
+    def _write_quotas(self, data: dict) -> None:
+        db = self._db
+        with db:
+            db.execute(SQL["quota_clear"])
+            db.executemany(
+                SQL["quota_put"],
+                ((gid, uid, ts) for gid, users in data.items() for uid, times in users.items() for ts in times),
+            )
+
+    def read_quotas(self) -> dict:
+        return self._call(self._read_quotas)
+
+    def write_quotas(self, data: dict) -> None:
+        self._call(self._write_quotas, data)
+
+    # ---- 从 KV 迁移 ----
+
+    async def _ensure_migrated(self, gid: str) -> None:
+        if gid in self._migrated or self.legacy_get is None:
+            return
+        task = self._migrating.get(gid)
+        if task is None:
+            task = self._migrating[gid] = asyncio.create_task(self._migrate_group(gid))
+            task.add_done_callback(lambda _: self._migrating.pop(gid, None))
+        await asyncio.shield(task)
+
+    def _insert_rows(self, rows: list[tuple[str, tuple]]) -> None:
+        db = self._db
+        with db:
+            for name, params in rows:
+                db.execute(SQL[name], params)
+
+    async def _migrate_group(self, gid: str) -> dict:
+        """把一个群的旧 KV 数据流式写入各表：按用户读取，攒够 batch_rows 行写一个事务
+
+        迁移只用 INSERT OR IGNORE，不会覆盖迁移开始后已经写进来的新数据。
+        """
+        get = self.legacy_get
+        rows: list[tuple[str, tuple]] = []
+        total = 0
+
+        async def flush() -> None:
+            nonlocal rows, total
+            if rows:
+                batch, rows = rows, []
+                total += len(batch)
+                await self._run(self._insert_rows, batch)
+
+        for name in GROUP_KEYS:
+            value = await get(f"{gid}:{name}", None)
+            if value is not None:
+                rows.append(("kv_init", (f"{gid}:{name}", json.dumps(value, ensure_ascii=False, default=list))))
+        legacy_users = await get(f"{gid}:user_list", []) or []
+        users = {str(u) for u in legacy_users}
+        if self.known_users is not None:
+            users |= {str(u) for u in self.known_users(gid)}
+        for uid in sorted(users):
+            partners = await get(f"{gid}:{uid}:partners", None) or []
+            for pos, cid in enumerate(dict.fromkeys(str(c) for c in partners)):
+                rows.append(("harem_init", (gid, uid, cid, pos)))
+                owner = await get(f"{gid}:{cid}:married_to", None)
+                # 后宫列表为准；married_to 指向别人时留给修复索引处理
+                rows.append(("marriage_init", (gid, cid, str(owner) if owner else uid)))
+            wishes = await get(f"{gid}:{uid}:wish_list", None) or []
+            for pos, cid in enumerate(dict.fromkeys(str(c) for c in wishes)):
+                rows.append(("wish_init", (gid, uid, cid, pos)))
+            fav = await get(f"{gid}:{uid}:fav", None)
+            if fav is not None:
+                rows.append(("fav_init", (gid, uid, str(fav))))
+            for name in USER_KEYS:
+                value = await get(f"{gid}:{uid}:{name}", None)
+                if value is not None:
+                    rows.append(("kv_init", (f"{gid}:{uid}:{name}", json.dumps(value, ensure_ascii=False, default=list))))
+            if len(rows) >= self.batch_rows:
+                await flush()
+        await flush()
+        await self._run(self._insert_rows, [("migrated_put", (gid, len(users), total))])
+        self._migrated.add(gid)
+        return {"gid": gid, "users": len(users), "rows": total}
+
+    async def migrate(self, gids) -> list[dict]:
+        """一次性迁移给定的群（已迁移的跳过），返回每个群的迁移报告"""
+        reports = []
+        for gid in gids:
+            gid = str(gid)
+            if gid in self._migrated:
+                continue
+            task = self._migrating.get(gid)
+            if task is None:
+                task = self._migrating[gid] = asyncio.create_task(self._migrate_group(gid))
+                task.add_done_callback(lambda _, gid=gid: self._migrating.pop(gid, None))
+            reports.append(await asyncio.shield(task))
+        return reports
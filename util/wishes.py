@@ -0,0 +1,82 @@
+import random
+
+
+class WishBook:
+    """许愿数据：`{gid}:{uid}:wish_list` 愿望单与 `{gid}:{cid}:wished_by` 反向索引
+
+    抽卡时的许愿加成按用户预先算好命中阈值缓存在内存里，愿望单变化时失效，
+    每次抽卡只需一次随机数比较，不读存储。
+    """
+
+    def __init__(self, kv, ownership) -> None:
+        self.kv = kv
+        self.ownership = ownership
+        # (gid, uid) -> (愿望单, 卡池范围, 加成倍数, 命中阈值)
+        self._pools: dict[tuple[str, str], tuple] = {}
+
+    async def wish_list(self, gid, uid) -> list[str]:
+        return [str(c) for c in await self.kv.get(f"{gid}:{uid}:wish_list", []) or []]
+
+    async def add(self, gid, uid, cid, max_size: int) -> bool:
+        """加入愿望单，愿望单已满时返回 False"""
+        gid, uid, cid = str(gid), str(uid), str(cid)
+        wish_list = await self.wish_list(gid, uid)
+        if cid not in wish_list:
+            if len(wish_list) >= max_size:
+                return False
+            wish_list.append(cid)
+            await self.kv.put(f"{gid}:{uid}:wish_list", wish_list)
+        wished_by_key = f"{gid}:{cid}:wished_by"
+        wished_by = await self.kv.get(wished_by_key, []) or []
+        if uid not in wished_by:
+            wished_by.append(uid)
+            await self.kv.put(wished_by_key, wished_by)
+        self._pools.pop((gid, uid), None)
+        return True
+
+    async def remove(self, gid, uid, cid) -> None:
+        gid, uid, cid = str(gid), str(uid), str(cid)
+        wish_list = await self.wish_list(gid, uid)
+        await self.kv.put(f"{gid}:{uid}:wish_list", [x for x in wish_list if x != cid])
+        wished_by_key = f"{gid}:{cid}:wished_by"
+        wished_by = [u for u in await self.kv.get(wished_by_key, []) or [] if str(u) != uid]
+        if wished_by:
+            await self.kv.put(wished_by_key, wished_by)
+        else:
+            await self.kv.delete(wished_by_key)
+        self._pools.pop((gid, uid), None)
+
+    def invalidate_group(self, gid) -> None:
+        """丢弃一个群所有用户的许愿加成缓存（整群愿望单被替换后调用）"""
+        gid = str(gid)
+        for key in [k for k in self._pools if k[0] == gid]:
+            del self._pools[key]
+
+    async def statuses(self, gid, uid) -> list[tuple[str, str | None]]:
+        """愿望单中每个角色及其当前持有者，归属一次从本群索引中查出"""
+        wish_list = await self.wish_list(gid, uid)
+        owners = (await self.ownership.group(gid)).owner
+        return [(cid, owners.get(cid)) for cid in wish_list]
+
+    async def wishers(self, gid, cid) -> list[str]:
+        """许愿了该角色的用户"""
+        return [str(u) for u in await self.kv.get(f"{gid}:{cid}:wished_by", []) or []]
+
+    async def pick(self, gid, uid, scope: int, weight: float) -> str | None:
+        """按许愿加成决定本次是否直接抽中愿望单里的角色，命中时返回角色ID
+
+        愿望单里每个角色的权重是普通角色的 weight 倍：在 scope 个角色中，
+        命中愿望单的概率为 k*w / (scope - k + k*w)。
+        """
+        key = (str(gid), str(uid))
+        entry = self._pools.get(key)
+        if entry is None or entry[1] != scope or entry[2] != weight:
+            wishes = tuple(entry[0]) if entry is not None else tuple(await self.wish_list(gid, uid))
+            k = len(wishes)
+            boosted = k * max(weight, 0)
+            threshold = boosted / (max(scope - k, 0) + boosted) if boosted > 0 else 0.0
+            entry = self._pools[key] = (wishes, scope, weight, threshold)
+        wishes, _, _, threshold = entry
+        if wishes and random.random() < threshold:
+            return random.choice(wishes)
+        return None